@@ -0,0 +1,361 @@
+"""
+API HTTP JSON del preventivatore per i portali dei partner (ASGI).
+
+    uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+
+    GET  /health                  stato del servizio e del database
+    GET  /services                servizi disponibili
+    POST /fees                    calcolo dei costi senza salvataggio
+    POST /quotes                  calcolo e salvataggio di un preventivo
+    GET  /quotes/{id}             preventivo salvato
+    GET  /quotes/{id}/pdf         PDF del preventivo salvato (202 finché è in generazione)
+    GET  /metrics                 metriche del worker in formato Prometheus
+
+Ogni partner ha una chiave personale, da inviare come
+"Authorization: Bearer <chiave>" (o nell'intestazione X-API-Key); la chiave
+è associata sul server a uno studio (utils.tenants) e la richiesta opera solo
+sui dati di quello studio: intestazione X-Tenant e nome host non scelgono lo
+studio. Senza una chiave valida la risposta è 401; una richiesta con X-Tenant
+diverso dallo studio della chiave riceve 403. Solo /health e /metrics (nessun
+dato dei clienti) non richiedono la chiave. Catalogo, tariffario e
+intestazione dei PDF sono quelli dello studio.
+
+    API_KEYS    chiavi dei partner, "studio:chiave" separate da virgole
+                (per esempio "rossi:9f2c...,bianchi:41ad..."); senza chiavi ogni richiesta riceve 401
+
+Le richieste non lasciano stato nel processo: tutto passa dal database, quindi
+si scala aggiungendo worker (--workers) o istanze dietro un bilanciatore.
+Il calcolo usa utils.fee_calculator come l'interfaccia Streamlit; le chiamate
+bloccanti (database, PDF) girano nel threadpool per non fermare l'event loop.
+Catalogo e PDF passano dalla cache condivisa (utils.cache): con più istanze
+conviene CACHE_URL=redis://... perché tutte la condividano.
+
+Il PDF di un nuovo preventivo viene generato subito dal pool di
+utils.pdf_executor e archiviato nel database: GET /quotes/{id}/pdf restituisce
+quello. Finché il PDF è in generazione (in questo processo, o preventivo
+salvato da meno di PDF_PENDING_SECONDS secondi) la risposta è 202 con
+Retry-After, senza generarne un secondo. Solo i preventivi senza PDF
+archiviato (precedenti all'archiviazione o con generazione fallita) vengono
+generati al momento, con il dettaglio dei costi ricavato dal totale salvato
+(non dal tariffario attuale), e il risultato viene archiviato.
+
+    PDF_PENDING_SECONDS   secondi dal salvataggio in cui un PDF mancante è
+                          considerato in generazione (default 60)
+"""
+import contextlib
+import functools
+import hashlib
+import logging
+import math
+import os
+import re
+from datetime import datetime
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+import database
+from utils import catalog, metrics, pdf_executor, tenants
+from utils.fee_calculator import calculate_fees, fees_from_total
+from utils.pdf_generator import generate_pdf_cached
+
+logger = logging.getLogger("avvocato.api")
+
+EMAIL_REGEX = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+
+# Campi del cliente: obbligatori come nel modulo dell'interfaccia Streamlit
+REQUIRED_CLIENT_FIELDS = ('nome', 'cognome', 'email', 'codice_fiscale')
+OPTIONAL_CLIENT_FIELDS = ('telefono', 'indirizzo')
+
+# Percorsi senza chiave: controllo di salute del bilanciatore e metriche aggregate
+PUBLIC_PATHS = ('/health', '/metrics')
+
+# Secondi suggeriti (Retry-After) a chi chiede un PDF ancora in generazione
+PDF_RETRY_AFTER = 2
+
+
+def pdf_pending_seconds():
+    return float(os.environ.get("PDF_PENDING_SECONDS", "60"))
+
+
+def _digest(key):
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+@functools.lru_cache(maxsize=4)
+def _parse_api_keys(value):
+    keys = {}
+    for entry in value.split(','):
+        slug, separator, key = entry.strip().partition(':')
+        if not entry.strip():
+            continue
+        if not separator or not slug.strip() or not key.strip():
+            logger.error("Voce di API_KEYS ignorata: serve il formato studio:chiave")
+            continue
+        # Solo l'hash in memoria: il confronto non dipende dai caratteri della chiave
+        keys[_digest(key.strip())] = slug.strip().lower()
+    return keys
+
+
+def api_keys():
+    """{sha256 of the key: tenant slug} from API_KEYS"""
+    return _parse_api_keys(os.environ.get("API_KEYS", ""))
+
+
+def _request_key(headers):
+    authorization = headers.get('authorization', '')
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() == 'bearer' and token.strip():
+        return token.strip()
+    return headers.get('x-api-key', '').strip() or None
+
+
+def authenticate(key):
+    """Tenant bound to a partner key, or None when the key (or its tenant) is unknown"""
+    slug = api_keys().get(_digest(key)) if key else None
+    if slug is None:
+        return None
+    tenant = tenants.find(slug)
+    if tenant is None:
+        logger.error("API_KEYS associa una chiave allo studio inesistente '%s'", slug)
+    return tenant
+
+
+class TenantMiddleware:
+    """Authenticate each request by partner key and make the key's tenant the current one"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in PUBLIC_PATHS:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        # Elenco degli studi dalla cache condivisa (anche Redis): fuori dall'event loop
+        tenant = await run_in_threadpool(authenticate, _request_key(headers))
+        if tenant is None:
+            response = JSONResponse({'error': "Chiave API mancante o non valida"}, status_code=401,
+                                    headers={'WWW-Authenticate': 'Bearer'})
+            await response(scope, receive, send)
+            return
+        requested = headers.get('x-tenant', '').strip().lower()
+        if requested and requested != tenant.slug:
+            response = JSONResponse({'error': f"La chiave non è abilitata per lo studio '{requested}'"},
+                                    status_code=403)
+            await response(scope, receive, send)
+            return
+        # Il threadpool di Starlette copia il contesto: le chiamate a database.py vedono lo studio
+        with tenants.use_tenant(tenant):
+            await self.app(scope, receive, send)
+
+
+async def _json_body(request):
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(400, "Il corpo della richiesta non è un JSON valido")
+    if not isinstance(payload, dict):
+        raise HTTPException(400, "Il corpo della richiesta deve essere un oggetto JSON")
+    return payload
+
+
+def _asset_value(payload):
+    value = payload.get('valore_bene')
+    error = HTTPException(422, "valore_bene deve essere un numero finito maggiore di zero")
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise error
+    try:
+        value = float(value)
+    except OverflowError:
+        raise error
+    # Il JSON di Python accetta NaN e Infinity: non sono importi da salvare
+    if not math.isfinite(value) or value <= 0:
+        raise error
+    return value
+
+
+def _selected_services(payload):
+    """Services of the catalog matching payload['service_ids'], in catalog order"""
+    service_ids = payload.get('service_ids')
+    if not isinstance(service_ids, list) or not service_ids:
+        raise HTTPException(422, "Seleziona almeno un servizio (service_ids)")
+    if not all(isinstance(service_id, int) and not isinstance(service_id, bool) for service_id in service_ids):
+        raise HTTPException(422, "service_ids deve contenere identificativi numerici")
+
+    services = catalog.get_catalog()
+    requested = set(service_ids)
+    selected = [service for service in services if service.id in requested]
+    missing = {service_id for service_id in requested if services.get(service_id) is None}
+    if missing:
+        raise HTTPException(422, f"Servizi inesistenti: {', '.join(str(i) for i in sorted(missing))}")
+    return selected
+
+
+def _client_data(payload):
+    client = payload.get('cliente')
+    if not isinstance(client, dict):
+        raise HTTPException(422, "Mancano i dati del cliente (cliente)")
+
+    missing = [field for field in REQUIRED_CLIENT_FIELDS
+               if not isinstance(client.get(field), str) or not client[field].strip()]
+    if missing:
+        raise HTTPException(422, f"Campi obbligatori mancanti: {', '.join(missing)}")
+    if not re.match(EMAIL_REGEX, client['email']):
+        raise HTTPException(422, "L'indirizzo email non è valido")
+
+    data = {field: client[field].strip() for field in REQUIRED_CLIENT_FIELDS}
+    for field in OPTIONAL_CLIENT_FIELDS:
+        value = client.get(field)
+        data[field] = value.strip() if isinstance(value, str) else ''
+    return data
+
+
+def _service_json(service):
+    return {'id': service['id'], 'name': service['name'], 'description': service['description']}
+
+
+def _quote_json(quote):
+    return {
+        'id': quote['id'],
+        'created_at': quote['created_at'].isoformat(),
+        'valore_bene': float(quote['valore_bene']),
+        'total_fee': float(quote['total_fee']),
+        'cliente': {field: quote[field] for field in REQUIRED_CLIENT_FIELDS + OPTIONAL_CLIENT_FIELDS},
+        'services': [_service_json(service) for service in quote['services']],
+        'pdf_url': f"/quotes/{quote['id']}/pdf",
+    }
+
+
+def _load_quote(quote_id):
+    quote = database.get_quote(quote_id)
+    if quote is None:
+        raise HTTPException(404, f"Preventivo {quote_id} inesistente")
+    return quote
+
+
+def _pdf_pending(quote):
+    """Whether the PDF of a just saved quote may still be rendering (here or in another worker)"""
+    if pdf_executor.pending(quote['id'], tenants.current_id()):
+        return True
+    return (datetime.now() - quote['created_at']).total_seconds() < pdf_pending_seconds()
+
+
+def _quote_pdf(quote_id):
+    """The quote and its stored PDF; the PDF is None while it is still rendering"""
+    quote = _load_quote(quote_id)
+    pdf_bytes = database.get_quote_pdf(quote_id)
+    if pdf_bytes is not None or _pdf_pending(quote):
+        return quote, pdf_bytes
+
+    client_data = {field: quote[field] for field in REQUIRED_CLIENT_FIELDS + OPTIONAL_CLIENT_FIELDS}
+    client_data['valore_bene'] = float(quote['valore_bene'])
+    # Importi salvati, non ricalcolati: il PDF concorda con total_fee anche se il tariffario è cambiato
+    fees = fees_from_total(quote['total_fee'])
+    pdf_bytes = generate_pdf_cached(client_data, quote['services'], fees, tenants.current().branding)
+    database.save_quote_pdf(quote_id, pdf_bytes)
+    return quote, pdf_bytes
+
+
+async def health(request):
+    await run_in_threadpool(database.load_services_from_db)
+    return JSONResponse({'status': 'ok'})
+
+
+async def services(request):
+    services = await run_in_threadpool(catalog.get_catalog)
+    return JSONResponse([_service_json(service) for service in services])
+
+
+async def fees(request):
+    payload = await _json_body(request)
+    valore_bene = _asset_value(payload)
+    if 'service_ids' in payload:
+        num_services = len(await run_in_threadpool(_selected_services, payload))
+    else:
+        num_services = payload.get('num_services', 1)
+        if isinstance(num_services, bool) or not isinstance(num_services, int) or num_services < 1:
+            raise HTTPException(422, "num_services deve essere un intero maggiore di zero")
+    return JSONResponse(calculate_fees(valore_bene, num_services, tenants.current().tariff))
+
+
+def _create_quote(payload):
+    client_data = _client_data(payload)
+    client_data['valore_bene'] = _asset_value(payload)
+    selected_services = _selected_services(payload)
+
+    quote_fees = calculate_fees(client_data['valore_bene'], len(selected_services), tenants.current().tariff)
+    quote_id = database.save_quote_to_db(client_data, selected_services, quote_fees)
+    # Il PDF viene generato e archiviato in background: la risposta non lo attende
+    try:
+        pdf_executor.submit(client_data, selected_services, quote_fees, quote_id=quote_id)
+    except pdf_executor.PdfRejected as e:
+        # Preventivo comunque salvato: il PDF verrà generato alla prima richiesta dopo PDF_PENDING_SECONDS
+        logger.warning("PDF del preventivo %s non accodato: %s", quote_id, e)
+    return {
+        'id': quote_id,
+        'fees': quote_fees,
+        'services': [_service_json(service) for service in selected_services],
+        'pdf_url': f"/quotes/{quote_id}/pdf",
+    }
+
+
+async def create_quote(request):
+    payload = await _json_body(request)
+    result = await run_in_threadpool(_create_quote, payload)
+    return JSONResponse(result, status_code=201, headers={'Location': f"/quotes/{result['id']}"})
+
+
+async def get_quote(request):
+    quote = await run_in_threadpool(_load_quote, request.path_params['quote_id'])
+    return JSONResponse(_quote_json(quote))
+
+
+async def quote_pdf(request):
+    quote, pdf_bytes = await run_in_threadpool(_quote_pdf, request.path_params['quote_id'])
+    if pdf_bytes is None:
+        return JSONResponse({'status': 'PDF in preparazione', 'pdf_url': f"/quotes/{quote['id']}/pdf"},
+                            status_code=202, headers={'Retry-After': str(PDF_RETRY_AFTER)})
+    filename = f"Preventivo_{quote['cognome']}_{quote['nome']}_{quote['created_at']:%Y%m%d}.pdf"
+    # Il nome del file viene dai dati del cliente: niente caratteri fuori dall'header
+    filename = re.sub(r'[^A-Za-z0-9_.-]', '_', filename)
+    return Response(pdf_bytes, media_type='application/pdf',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+async def prometheus(request):
+    return PlainTextResponse(metrics.render_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+async def http_error(request, exc):
+    return JSONResponse({'error': exc.detail}, status_code=exc.status_code)
+
+
+def _startup():
+    metrics.setup_from_env()
+    database.initialize_database()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await run_in_threadpool(_startup)
+    yield
+
+
+routes = [
+    Route('/health', health),
+    Route('/services', services),
+    Route('/fees', fees, methods=['POST']),
+    Route('/quotes', create_quote, methods=['POST']),
+    Route('/quotes/{quote_id:int}', get_quote),
+    Route('/quotes/{quote_id:int}/pdf', quote_pdf),
+    Route('/metrics', prometheus),
+]
+
+app = Starlette(routes=routes, middleware=[Middleware(TenantMiddleware)],
+                exception_handlers={HTTPException: http_error}, lifespan=lifespan)
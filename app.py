@@ -1,9 +1,11 @@
 import streamlit as st
 import pandas as pd
-import json
 import os
 import base64
+import functools
 import re
+import tempfile
+import time
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
@@ -11,11 +13,23 @@ from datetime import datetime
 from calendar import month_name, month_abbr
 import matplotlib.ticker as ticker
 from matplotlib.colors import LinearSegmentedColormap
-from utils.fee_calculator import calculate_fees
-from utils.pdf_generator import generate_pdf
+from utils.fee_calculator import calculate_fees, fees_from_total
 from utils.email_sender import send_email_with_pdf
+from utils.exporter import EXPORT_FORMATS, download_limit, export_quotes
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from utils import catalog, metrics, pdf_executor, profiler, session_memory, tenants, upload_spool
 import database
 
+# Durata dell'intero rerun (i rerun interrotti da st.rerun/st.stop non vengono registrati)
+_rerun_start = time.perf_counter()
+metrics.setup_from_env()
+
+# Profilo del rerun: PROFILE_RERUNS=1 o interruttore in modalità amministratore (utils.profiler)
+_script_ctx = get_script_run_ctx()
+_rerun_profile = profiler.start_rerun(_script_ctx.session_id if _script_ctx else None,
+                                      st.session_state.get('profile_reruns', False))
+
 st.set_page_config(
     page_title="Preventivatore Servizi Legali",
     page_icon="⚖️",
@@ -29,18 +43,31 @@ with open('.streamlit/style.css') as f:
 # Initialize database
 database.initialize_database()
 
+# Studio della sessione, deciso dal server: nome host secondo TENANT_HOSTS, altrimenti
+# DEFAULT_TENANT. Senza runtime (AppTest, benchmarks.load_test) non ci sono intestazioni
+_request_host = st.context.headers.get("Host") if runtime.exists() else None
+try:
+    tenant = tenants.resolve(host=_request_host)
+except tenants.UnknownTenant as e:
+    st.error(str(e))
+    st.stop()
+tenants.activate(tenant)
+if st.session_state.get('tenant_id') != tenant.id:
+    # Cambio di studio nella stessa sessione: il catalogo è quello dell'altro studio
+    st.session_state.tenant_id = tenant.id
+    st.session_state.pop('services', None)
+
 # Initialize session state
 if 'services' not in st.session_state:
-    # First, try to load from database
-    st.session_state.services = database.load_services_from_db()
+    # First, try to load from database (the Catalog object is shared by all sessions)
+    st.session_state.services = catalog.get_catalog()
     
     # If database is empty and JSON exists, import from JSON
-    if not st.session_state.services and os.path.exists('data/services.json'):
-        with open('data/services.json', 'r') as f:
-            json_services = json.load(f)
-            if json_services:
-                database.import_json_services(json_services)
-                st.session_state.services = database.load_services_from_db()
+    if not st.session_state.services:
+        json_services = catalog.get_catalog(catalog.JsonSource())
+        if json_services:
+            database.import_json_services(list(json_services))
+            st.session_state.services = catalog.get_catalog()
 
 if 'admin_view' not in st.session_state:
     st.session_state.admin_view = False
@@ -51,6 +78,13 @@ if 'show_recent_quotes' not in st.session_state:
 if 'show_dashboard' not in st.session_state:
     st.session_state.show_dashboard = False
 
+# I documenti caricati restano su disco: nella sessione solo lo spool e gli handle
+if 'upload_spool' not in st.session_state:
+    st.session_state.upload_spool = upload_spool.SessionSpool()
+
+if 'service_upload_key' not in st.session_state:
+    st.session_state.service_upload_key = 0
+
 def toggle_admin_view():
     st.session_state.admin_view = not st.session_state.admin_view
 
@@ -67,12 +101,42 @@ def toggle_dashboard():
 def add_service(name, description, file_content=None):
     service_id = database.save_service_to_db(name, description, file_content)
     # Refresh services list
-    st.session_state.services = database.load_services_from_db()
+    st.session_state.services = catalog.get_catalog()
 
 def delete_service(service_id):
     database.delete_service_from_db(service_id)
     # Refresh services list
-    st.session_state.services = database.load_services_from_db()
+    st.session_state.services = catalog.get_catalog()
+
+def spool_service_file():
+    uploaded = st.session_state.get(f"service_file_{st.session_state.service_upload_key}")
+    if uploaded is None:
+        return
+    try:
+        st.session_state.service_file = st.session_state.upload_spool.add(uploaded)
+    except upload_spool.QuotaExceeded as e:
+        st.session_state.service_file_error = str(e)
+    # Nuova chiave: il widget si svuota e Streamlit libera la sua copia del file
+    st.session_state.service_upload_key += 1
+
+def discard_service_file():
+    handle = st.session_state.pop('service_file', None)
+    if handle is not None:
+        st.session_state.upload_spool.discard(handle)
+
+def offload_pending_pdf(pending):
+    """Once rendered and stored with the quote, the session keeps only the quote id of the PDF"""
+    if pending['job'] is None or not pending['job'].done():
+        return pending
+    # Solo l'esistenza del PDF archiviato, senza leggerlo
+    if pending['quote_id'] not in database.quotes_with_pdf([pending['quote_id']], tenant_id=pending['tenant_id']):
+        return pending
+    return dict(pending, job=None)
+
+# Chiavi che session_memory può liberare quando la sessione supera il suo budget
+EVICTABLE_STATE = {
+    'pending_pdf': offload_pending_pdf,
+}
 
 def get_pdf_download_link(pdf_bytes, filename):
     """Generate a link to download the PDF file"""
@@ -80,15 +144,104 @@ def get_pdf_download_link(pdf_bytes, filename):
     href = f'<a href="data:application/pdf;base64,{b64}" download="{filename}">Scarica Preventivo PDF</a>'
     return href
 
+def show_pdf_actions(pdf_bytes, filename, email, full_name):
+    """Download link and email button for a generated quote PDF"""
+    # Provide download link
+    st.markdown(get_pdf_download_link(pdf_bytes, filename), unsafe_allow_html=True)
+    
+    # Email validation
+    email_regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+    if not re.match(email_regex, email):
+        st.warning("L'indirizzo email inserito non sembra valido. La funzione di invio email è disabilitata.")
+    else:
+        # Add button to send PDF via email
+        if st.button("Invia il preventivo via email"):
+            with st.spinner("Invio dell'email in corso..."):
+                success, message = send_email_with_pdf(email, full_name, pdf_bytes)
+                if success:
+                    st.success(message)
+                else:
+                    st.error(message)
+
+@st.fragment(run_every=1)
+def wait_for_pending_pdf():
+    """Polled every second while the render queue works on the PDF; one full rerun once it is done"""
+    pending = st.session_state.get('pending_pdf')
+    if pending is None or pending['job'] is None or pending['job'].done():
+        # Il rerun completo mostra il PDF fuori dal fragment, che non viene più eseguito
+        st.rerun(scope="app")
+    st.info("Il PDF del preventivo è in preparazione: il link per scaricarlo comparirà qui appena pronto.")
+
+def submit_pending_pdf(pending, client_data, selected_services, fees):
+    """Queue the PDF of the pending quote; a full render queue is recorded as the pending error"""
+    try:
+        _, job = pdf_executor.render(client_data, selected_services, fees, quote_id=pending['quote_id'])
+    except pdf_executor.PdfRejected as e:
+        return dict(pending, job=None, error=str(e))
+    return dict(pending, job=job, error=None)
+
+def retry_pending_pdf():
+    """Queue again a PDF rejected by the render queue, from the amounts stored with the quote"""
+    pending = st.session_state.pending_pdf
+    quote = database.get_quote(pending['quote_id'], tenant_id=pending['tenant_id'])
+    if quote is None:
+        del st.session_state.pending_pdf
+        return
+    client_data = {field: quote[field]
+                   for field in ('nome', 'cognome', 'email', 'telefono', 'codice_fiscale', 'indirizzo')}
+    client_data['valore_bene'] = float(quote['valore_bene'])
+    st.session_state.pending_pdf = submit_pending_pdf(pending, client_data, quote['services'],
+                                                      fees_from_total(quote['total_fee']))
+
+def show_pdf_rejected(message):
+    st.error(f"Il PDF del preventivo non è stato generato: {message}. Il preventivo è comunque salvato.")
+    st.button("Genera di nuovo il PDF", on_click=retry_pending_pdf)
+
+def show_pending_pdf():
+    """PDF delivered after the summary: waits in wait_for_pending_pdf, then shows the actions"""
+    pending = st.session_state.get('pending_pdf')
+    if pending is None:
+        return
+    if pending.get('error'):
+        # Rifiutato dalla coda dei PDF (piena o attesa troppo lunga)
+        show_pdf_rejected(pending['error'])
+        return
+    if pending['job'] is None:
+        # Scaricato da session_memory: il PDF è quello archiviato con il preventivo
+        pdf_bytes = database.get_quote_pdf(pending['quote_id'], tenant_id=pending['tenant_id'])
+        if pdf_bytes is None:
+            del st.session_state.pending_pdf
+            st.error("Il PDF del preventivo non è più disponibile.")
+            return
+        show_pdf_actions(pdf_bytes, pending['filename'], pending['email'], pending['full_name'])
+        return
+    if not pending['job'].done():
+        wait_for_pending_pdf()
+        return
+    try:
+        pdf_bytes = pending['job'].result()
+    except pdf_executor.PdfRejected as e:
+        st.session_state.pending_pdf = dict(pending, job=None, error=str(e))
+        show_pdf_rejected(str(e))
+        return
+    except Exception as e:
+        del st.session_state.pending_pdf
+        st.error(f"Non è stato possibile generare il PDF del preventivo: {e}")
+        return
+    show_pdf_actions(pdf_bytes, pending['filename'], pending['email'], pending['full_name'])
+
 # Main application
 # Display the banner image
 st.image("images/legal_banner.svg", use_container_width=True)
 
 # Admin toggle buttons in sidebar
+st.sidebar.caption(f"Studio: {tenant.name}")
 st.sidebar.button("Modalità Amministratore", on_click=toggle_admin_view)
 if st.session_state.admin_view:
     st.sidebar.button("Visualizza Preventivi Recenti", on_click=toggle_recent_quotes)
     st.sidebar.button("Dashboard Analisi Servizi", on_click=toggle_dashboard)
+    st.sidebar.toggle("Profila i rerun", key='profile_reruns',
+                      help="Salva un report cProfile e tracemalloc per ogni rerun di questa sessione")
 
 # Admin interface
 if st.session_state.admin_view:
@@ -404,9 +557,68 @@ if st.session_state.admin_view:
             st.rerun()    # Recent Quotes View
     elif st.session_state.show_recent_quotes:
         st.subheader("Preventivi Recenti")
-        recent_quotes = database.get_recent_quotes(20)  # Get last 20 quotes
+        
+        # Esportazione completa per la contabilità (letta dal database a blocchi)
+        export_col1, export_col2 = st.columns([1, 3])
+        with export_col1:
+            export_format = st.selectbox("Formato", list(EXPORT_FORMATS), format_func=str.upper)
+        with export_col2:
+            if st.button("Esporta tutti i preventivi"):
+                mime, extension = EXPORT_FORMATS[export_format]
+                with st.spinner("Esportazione in corso..."):
+                    with tempfile.NamedTemporaryFile(suffix=f".{extension}", delete=False) as export_file:
+                        exported = export_quotes(export_file, export_format)
+                # st.download_button tiene in memoria l'intero file: oltre il limite solo da riga di comando
+                export_size = os.path.getsize(export_file.name)
+                if export_size > download_limit():
+                    os.unlink(export_file.name)
+                    st.warning(
+                        f"L'esportazione di {exported} preventivi occupa {export_size / (1024 * 1024):.1f} MB, "
+                        f"oltre il limite di {download_limit() / (1024 * 1024):.1f} MB per il download "
+                        f"dal browser (EXPORT_DOWNLOAD_MAX_MB). Usa sul server: "
+                        f"python manage.py --tenant {tenant.slug} export-quotes --format {export_format} "
+                        f"--output preventivi.{extension}"
+                    )
+                else:
+                    with open(export_file.name, 'rb') as export_data:
+                        os.unlink(export_file.name)
+                        st.download_button(
+                            f"Scarica {exported} preventivi ({extension.upper()})",
+                            data=export_data,
+                            file_name=f"preventivi_{datetime.now().strftime('%Y%m%d')}.{extension}",
+                            mime=mime
+                        )
+        
+        # Ricerca su cliente (nome, cognome, email, codice fiscale) e servizi richiesti
+        if 'quote_search_page' not in st.session_state:
+            st.session_state.quote_search_page = 1
+        search_text = st.text_input(
+            "Cerca preventivi",
+            placeholder="Nome, cognome, email, codice fiscale o servizio",
+            on_change=lambda: st.session_state.update(quote_search_page=1)
+        )
+        
+        if search_text.strip():
+            search_results = database.search_quotes(search_text, st.session_state.quote_search_page, 20)
+            recent_quotes = search_results['quotes']
+            
+            page_col1, page_col2, page_col3 = st.columns([1, 2, 1])
+            with page_col1:
+                if search_results['page'] > 1 and st.button("← Precedenti", key="search_prev"):
+                    st.session_state.quote_search_page -= 1
+                    st.rerun()
+            with page_col2:
+                st.caption(f"Pagina {search_results['page']}")
+            with page_col3:
+                if search_results['has_more'] and st.button("Successivi →", key="search_next"):
+                    st.session_state.quote_search_page += 1
+                    st.rerun()
+        else:
+            recent_quotes = database.get_recent_quotes(20)  # Get last 20 quotes
         
         if recent_quotes:
+            # Una sola query per sapere quali preventivi hanno il PDF archiviato
+            stored_pdfs = database.quotes_with_pdf([quote['id'] for quote in recent_quotes])
             for quote in recent_quotes:
                 with st.expander(f"{quote['nome']} {quote['cognome']} - €{quote['total_fee']:,.2f} - {quote['created_at'].strftime('%d/%m/%Y')}"):
                     st.write(f"**Cliente:** {quote['nome']} {quote['cognome']}")
@@ -418,6 +630,22 @@ if st.session_state.admin_view:
                     st.write("**Servizi richiesti:**")
                     for service in quote['services']:
                         st.write(f"- {service}")
+                    
+                    # Il PDF archiviato al momento del preventivo, letto dal database solo al clic
+                    if quote['id'] in stored_pdfs:
+                        st.download_button(
+                            "Scarica PDF del preventivo",
+                            # Letto fuori dal rerun: lo studio va indicato esplicitamente
+                            data=functools.partial(database.get_quote_pdf, quote['id'], tenant_id=tenant.id),
+                            file_name=f"Preventivo_{quote['cognome']}_{quote['nome']}_{quote['created_at'].strftime('%Y%m%d')}.pdf",
+                            mime="application/pdf",
+                            key=f"quote_pdf_{quote['id']}",
+                            on_click="ignore"
+                        )
+                    else:
+                        st.caption("PDF non archiviato (preventivo precedente all'archiviazione dei PDF).")
+        elif search_text.strip():
+            st.info("Nessun preventivo corrisponde alla ricerca.")
         else:
             st.info("Nessun preventivo recente disponibile.")
             
@@ -429,15 +657,25 @@ if st.session_state.admin_view:
         with st.expander("Aggiungi Nuovo Servizio", expanded=True):
             service_name = st.text_input("Nome del Servizio")
             service_description = st.text_area("Descrizione del Servizio")
-            service_file = st.file_uploader("Carica documento informativo (opzionale)", type=["pdf", "doc", "docx", "txt"])
+            service_file = st.session_state.get('service_file')
+            if service_file is None:
+                st.file_uploader("Carica documento informativo (opzionale)", type=["pdf", "doc", "docx", "txt"],
+                                 key=f"service_file_{st.session_state.service_upload_key}",
+                                 on_change=spool_service_file)
+            else:
+                st.write(f"**Documento:** {service_file.filename} ({service_file.size / 1024:,.1f} KB)")
+                st.button("Rimuovi documento", on_click=discard_service_file)
+            if 'service_file_error' in st.session_state:
+                st.error(st.session_state.pop('service_file_error'))
             
             if st.button("Aggiungi Servizio"):
                 file_content = None
                 if service_file is not None:
-                    file_content = base64.b64encode(service_file.getvalue()).decode()
+                    file_content = service_file.base64()
                 
                 if service_name and service_description:
                     add_service(service_name, service_description, file_content)
+                    discard_service_file()
                     st.success(f"Servizio '{service_name}' aggiunto con successo!")
                 else:
                     st.error("Nome e descrizione del servizio sono obbligatori.")
@@ -507,7 +745,7 @@ else:
             selected_services = [s for s in st.session_state.services if servizi_selezionati.get(s["id"], False)]
             
             # Calculate fees based on asset value
-            fees = calculate_fees(valore_bene, len(selected_services))
+            fees = calculate_fees(valore_bene, len(selected_services), tenant.tariff)
             
             # Display the fee calculation
             st.success("Preventivo calcolato con successo!")
@@ -554,23 +792,36 @@ else:
             }
             
             # Save quote to database
-            database.save_quote_to_db(client_data, selected_services, fees)
+            quote_id = database.save_quote_to_db(client_data, selected_services, fees)
             
-            pdf_bytes = generate_pdf(client_data, selected_services, fees)
-            
-            # Provide download link
-            st.markdown(get_pdf_download_link(pdf_bytes, f"Preventivo_{cognome}_{nome}_{datetime.now().strftime('%Y%m%d')}.pdf"), unsafe_allow_html=True)
-            
-            # Email validation
-            email_regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-            if not re.match(email_regex, email):
-                st.warning("L'indirizzo email inserito non sembra valido. La funzione di invio email è disabilitata.")
-            else:
-                # Add button to send PDF via email
-                if st.button("Invia il preventivo via email"):
-                    with st.spinner("Invio dell'email in corso..."):
-                        success, message = send_email_with_pdf(email, f"{nome} {cognome}", pdf_bytes)
-                        if success:
-                            st.success(message)
-                        else:
-                            st.error(message)
+            # The PDF is rendered by the bounded pool: if the queue is long it is delivered later.
+            # It is stored with the quote as soon as it is ready, so it is never rendered again.
+            # Anche se è già pronto passa dalla sessione: il pulsante email deve esistere anche nel
+            # rerun del clic, in cui il modulo non risulta inviato
+            st.session_state.pop('pending_pdf', None)
+            st.session_state.pending_pdf = submit_pending_pdf({
+                'quote_id': quote_id,
+                'tenant_id': tenant.id,
+                'filename': f"Preventivo_{cognome}_{nome}_{datetime.now().strftime('%Y%m%d')}.pdf",
+                'email': email,
+                'full_name': f"{nome} {cognome}",
+            }, client_data, selected_services, fees)
+    
+    if 'pending_pdf' in st.session_state:
+        show_pending_pdf()
+
+# Memoria dello stato della sessione: misura, totale del processo e budget (utils.session_memory)
+if _script_ctx is not None:
+    session_memory.enforce(st.session_state, _script_ctx.session_id, EVICTABLE_STATE,
+                           shared_types=(catalog.Catalog,))
+if st.session_state.admin_view:
+    _usage = session_memory.process_usage()
+    st.sidebar.caption(f"Memoria delle sessioni: {_usage['bytes'] / (1024 * 1024):.1f} MB "
+                       f"in {_usage['sessions']} sessioni attive, file caricati "
+                       f"{upload_spool.global_usage() / (1024 * 1024):.1f} MB")
+
+metrics.observe("streamlit_rerun_seconds", time.perf_counter() - _rerun_start)
+
+_profile_path = profiler.finish_rerun(_rerun_profile)
+if _profile_path and st.session_state.get('profile_reruns'):
+    st.sidebar.caption(f"Profilo del rerun: {_profile_path}")
@@ -0,0 +1 @@
+# Strumenti di misura delle prestazioni (load test e benchmark)
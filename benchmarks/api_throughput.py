@@ -0,0 +1,235 @@
+"""
+Throughput dell'API ASGI (api.py) confrontato con il flusso Streamlit.
+
+Avvia uvicorn con N worker su una porta locale e simula client concorrenti che
+eseguono lo stesso lavoro del pulsante "Calcola Preventivo" di app.py: calcolo
+e salvataggio del preventivo (POST /quotes) e generazione del PDF
+(GET /quotes/{id}/pdf). Con --streamlit-sessions esegue anche il load test
+Streamlit (benchmarks.load_test) sullo stesso database e riporta i due
+throughput nello stesso report.
+
+Esempio:
+    DATABASE_URL=postgresql://localhost/avvocato DATABASE_SSLMODE=disable \\
+        python -m benchmarks.api_throughput --requests 500 --concurrency 16 \\
+        --workers 4 --streamlit-sessions 40 --output reports/api_throughput.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stats import environment_info, summarize, write_report
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = ['create_quote', 'quote_pdf', 'total']
+
+
+def start_server(port, workers, api_key, startup_timeout=30):
+    """Start uvicorn on 127.0.0.1:port, accepting api_key for the current tenant, and wait until /health answers"""
+    from utils import tenants
+
+    env = dict(os.environ, API_KEYS=f"{tenants.current().slug}:{api_key}")
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=ROOT_DIR, env=env,
+    )
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn terminato con codice {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"L'API non ha risposto entro {startup_timeout} secondi")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+class Client:
+    """One keep-alive HTTP connection per benchmark thread"""
+
+    _local = threading.local()
+
+    def __init__(self, port, timeout, api_key):
+        self.port = port
+        self.timeout = timeout
+        self.api_key = api_key
+
+    def request(self, method, path, body=None):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.timeout)
+        headers = {'Authorization': f"Bearer {self.api_key}"}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        try:
+            conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path}: HTTP {response.status} {data[:200]!r}")
+        return data
+
+
+def quote_payload(index, rng, service_ids):
+    """Same client data and distributions as benchmarks.load_test.fill_client_form"""
+    return {
+        'cliente': {
+            'nome': f"Mario{index}",
+            'cognome': "Rossi",
+            'email': f"cliente{index}@example.com",
+            'telefono': "+39 333 1234567",
+            'codice_fiscale': "RSSMRA80A01H501U",
+            'indirizzo': "Via Roma 1, Milano",
+        },
+        'valore_bene': round(rng.uniform(500, 800000), 2),
+        'service_ids': rng.sample(service_ids, min(len(service_ids), rng.randint(1, 3))),
+    }
+
+
+def run_request(client, index, samples, lock, service_ids, seed):
+    rng = random.Random(seed + index)
+    payload = quote_payload(index, rng, service_ids)
+
+    start = time.perf_counter()
+    quote = json.loads(client.request('POST', '/quotes', payload))
+    created = time.perf_counter()
+    client.request('GET', quote['pdf_url'])
+    done = time.perf_counter()
+
+    with lock:
+        samples['create_quote'].append(created - start)
+        samples['quote_pdf'].append(done - created)
+        samples['total'].append(done - start)
+
+
+def run_api_benchmark(requests, concurrency, workers, port=8765, timeout=60, seed=0):
+    """Run the API benchmark against a fresh uvicorn and return the report section"""
+    api_key = secrets.token_urlsafe(32)
+    process = start_server(port, workers, api_key)
+    try:
+        client = Client(port, timeout, api_key)
+        service_ids = [service['id'] for service in json.loads(client.request('GET', '/services'))]
+        if not service_ids:
+            raise RuntimeError("Nessun servizio disponibile nel database")
+
+        samples = {stage: [] for stage in STAGES}
+        lock = threading.Lock()
+        errors = []
+
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(run_request, client, i, samples, lock, service_ids, seed)
+                for i in range(requests)
+            ]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(str(e))
+        wall_time = time.perf_counter() - wall_start
+    finally:
+        stop_server(process)
+
+    completed = requests - len(errors)
+    return {
+        'parameters': {'requests': requests, 'concurrency': concurrency, 'workers': workers, 'seed': seed},
+        'wall_time_s': wall_time,
+        'completed': completed,
+        'failed': len(errors),
+        'errors': sorted(set(errors))[:20],
+        'throughput_quotes_per_s': completed / wall_time if wall_time else 0.0,
+        'stages': {stage: summarize(samples[stage]) for stage in STAGES},
+    }
+
+
+def run_streamlit_benchmark(sessions, concurrency, timeout=60, seed=0):
+    """The Streamlit load test, reduced to the fields comparable with the API"""
+    from benchmarks.load_test import run_load_test
+
+    report = run_load_test(sessions, concurrency, timeout, seed)
+    stages = report['stages']
+    return {
+        'parameters': report['parameters'],
+        'wall_time_s': report['wall_time_s'],
+        'completed': report['completed_sessions'],
+        'failed': report['failed_sessions'],
+        'errors': report['errors'],
+        # Una sessione Streamlit produce un preventivo (caricamento pagina + invio + email)
+        'throughput_quotes_per_s': report['throughput_sessions_per_s'],
+        'stages': {'load': stages['load'], 'submit': stages['submit']},
+    }
+
+
+def print_section(title, section):
+    print(f"{title}: {section['completed']} preventivi (falliti: {section['failed']}) "
+          f"in {section['wall_time_s']:.2f}s, {section['throughput_quotes_per_s']:.2f} preventivi/s")
+    print(f"  {'fase':<14}{'n':>6}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    for stage, stats in section['stages'].items():
+        print(f"  {stage:<14}{stats['count']:>6}{stats['p50_ms']:>11.1f}"
+              f"{stats['p95_ms']:>11.1f}{stats['p99_ms']:>11.1f}")
+    for error in section['errors']:
+        print(f"  Errore: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput dell'API ASGI rispetto al flusso Streamlit")
+    parser.add_argument('--requests', type=int, default=200, help="Preventivi creati tramite l'API")
+    parser.add_argument('--concurrency', type=int, default=8, help="Client concorrenti")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker uvicorn")
+    parser.add_argument('--port', type=int, default=8765, help="Porta locale per uvicorn")
+    parser.add_argument('--streamlit-sessions', type=int, default=0,
+                        help="Sessioni Streamlit da confrontare (0 = solo API)")
+    parser.add_argument('--timeout', type=float, default=60, help="Timeout per richiesta o rerun (secondi)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed per i dati generati")
+    parser.add_argument('--output', help="Percorso del report JSON")
+    args = parser.parse_args(argv)
+
+    report = {'environment': environment_info()}
+    report['api'] = run_api_benchmark(args.requests, args.concurrency, args.workers,
+                                      args.port, args.timeout, args.seed)
+    print_section("API", report['api'])
+
+    if args.streamlit_sessions:
+        report['streamlit'] = run_streamlit_benchmark(args.streamlit_sessions, args.concurrency,
+                                                      args.timeout, args.seed)
+        print_section("Streamlit", report['streamlit'])
+        if report['streamlit']['throughput_quotes_per_s']:
+            report['speedup'] = (report['api']['throughput_quotes_per_s']
+                                 / report['streamlit']['throughput_quotes_per_s'])
+            print(f"L'API produce {report['speedup']:.1f}x preventivi al secondo rispetto a Streamlit")
+
+    if args.output:
+        write_report(report, args.output)
+    return 1 if report['api']['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
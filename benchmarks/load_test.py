@@ -0,0 +1,257 @@
+"""
+Load test del flusso di preventivo di app.py.
+
+Simula N sessioni Streamlit concorrenti che compilano il modulo client_form,
+inviano la richiesta (salvataggio su database e generazione del PDF) e
+premono il pulsante di invio email, misurando la latenza di ogni fase.
+Il database è quello indicato da DATABASE_URL (PostgreSQL locale o SQLite).
+
+Esempio:
+    DATABASE_URL=postgresql://localhost/avvocato DATABASE_SSLMODE=disable \\
+        python -m benchmarks.load_test --sessions 50 --concurrency 10 \\
+        --output reports/load_test.json --baseline reports/load_test_prev.json
+"""
+import argparse
+import functools
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit.testing.v1 import AppTest
+
+import database
+import utils.email_sender
+import utils.pdf_executor
+from benchmarks.stats import (
+    compare_metric, environment_info, load_report, print_comparison, summarize, write_report
+)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT_DIR, 'app.py')
+
+# Fasi misurate a livello di sessione (un rerun completo dello script)
+SESSION_STAGES = ['load', 'submit', 'email']
+# Fasi misurate all'interno del rerun, intercettando le funzioni chiamate da app.py
+INNER_STAGES = {
+    'save_quote': (database, 'save_quote_to_db'),
+    'generate_pdf': (utils.pdf_executor, 'render'),
+    'send_email': (utils.email_sender, 'send_email_with_pdf'),
+}
+
+
+class StageRecorder:
+    """Thread-safe collector of durations per stage"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def count(self, stage):
+        with self._lock:
+            return len(self.samples.get(stage, ()))
+
+    def timed(self, stage, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return wrapper
+
+
+def install_probes(recorder):
+    """Wrap the functions used by app.py so each inner stage is timed; returns an undo callable"""
+    originals = []
+    for stage, (module, name) in INNER_STAGES.items():
+        original = getattr(module, name)
+        originals.append((module, name, original))
+        setattr(module, name, recorder.timed(stage, original))
+
+    def restore():
+        for module, name, original in originals:
+            setattr(module, name, original)
+
+    return restore
+
+
+def _widget(widgets, label):
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"Widget '{label}' non trovato")
+
+
+def fill_client_form(at, session_index, rng):
+    """Fill client_form with plausible data and select one to three services"""
+    _widget(at.text_input, "Nome *").input(f"Mario{session_index}")
+    _widget(at.text_input, "Cognome *").input("Rossi")
+    _widget(at.text_input, "Email *").input(f"cliente{session_index}@example.com")
+    _widget(at.text_input, "Telefono").input("+39 333 1234567")
+    _widget(at.text_input, "Codice Fiscale *").input("RSSMRA80A01H501U")
+    _widget(at.text_input, "Indirizzo").input("Via Roma 1, Milano")
+    _widget(at.number_input, "Valore del bene in € *").set_value(round(rng.uniform(500, 800000), 2))
+
+    service_boxes = [box for box in at.checkbox if box.key and box.key.startswith('service_')]
+    if not service_boxes:
+        raise LookupError("Nessun servizio disponibile nel modulo")
+    for box in rng.sample(service_boxes, min(len(service_boxes), rng.randint(1, 3))):
+        box.check()
+
+
+def _email_buttons(at):
+    return [button for button in at.button if button.label == "Invia il preventivo via email"]
+
+
+def run_session(session_index, recorder, timeout, seed):
+    """Drive a single simulated client through the quote flow"""
+    rng = random.Random(seed + session_index)
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    start = time.perf_counter()
+    at.run()
+    recorder.record('load', time.perf_counter() - start)
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+    fill_client_form(at, session_index, rng)
+
+    start = time.perf_counter()
+    _widget(at.button, "Calcola Preventivo").click().run()
+    recorder.record('submit', time.perf_counter() - start)
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    if at.error:
+        raise RuntimeError(at.error[0].value)
+    if not at.success:
+        raise RuntimeError("Invio del modulo non registrato dal rerun")
+
+    # PDF in coda (consegna differita): AppTest non esegue i fragment con run_every,
+    # quindi i rerun completi prendono il posto del polling dell'interfaccia
+    deadline = time.monotonic() + timeout
+    while not _email_buttons(at):
+        if time.monotonic() > deadline:
+            raise RuntimeError("Pulsante di invio email non mostrato entro il timeout")
+        time.sleep(0.2)
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+    start = time.perf_counter()
+    _email_buttons(at)[0].click().run()
+    recorder.record('email', time.perf_counter() - start)
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    # L'esito (st.success o st.error) compare solo se send_email_with_pdf è stata eseguita nel rerun del clic
+    if not (at.success or at.error):
+        raise RuntimeError("Il clic sul pulsante email non ha eseguito send_email_with_pdf")
+
+
+def run_load_test(sessions, concurrency, timeout=60, seed=0):
+    """Run the load test and return the report dictionary"""
+    recorder = StageRecorder()
+    errors = []
+
+    # app.py apre file con percorsi relativi alla radice del progetto
+    os.chdir(ROOT_DIR)
+    restore = install_probes(recorder)
+    wall_start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(run_session, i, recorder, timeout, seed)
+                for i in range(sessions)
+            ]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(str(e))
+    finally:
+        wall_time = time.perf_counter() - wall_start
+        restore()
+
+    completed = sessions - len(errors)
+    # Ogni clic misurato deve aver eseguito l'invio: altrimenti la fase email non misura nulla
+    clicks, sends = recorder.count('email'), recorder.count('send_email')
+    if sends < clicks:
+        errors.append(f"send_email_with_pdf eseguita {sends} volte su {clicks} clic del pulsante email")
+    return {
+        'environment': environment_info(),
+        'parameters': {'sessions': sessions, 'concurrency': concurrency, 'seed': seed},
+        'wall_time_s': wall_time,
+        'completed_sessions': completed,
+        'failed_sessions': sessions - completed,
+        'errors': sorted(set(errors))[:20],
+        'throughput_sessions_per_s': completed / wall_time if wall_time else 0.0,
+        'stages': {
+            stage: summarize(recorder.samples.get(stage, []))
+            for stage in SESSION_STAGES + list(INNER_STAGES)
+        },
+    }
+
+
+def compare_reports(baseline, current, threshold):
+    """Compare two load test reports on p95 latency per stage and throughput"""
+    rows = []
+    for stage, stats in current['stages'].items():
+        base_stats = baseline.get('stages', {}).get(stage)
+        if not base_stats or not stats['count']:
+            continue
+        rows.append(compare_metric(f"{stage} p95 (ms)", base_stats['p95_ms'], stats['p95_ms'], threshold))
+
+    # Per il throughput valori più alti sono migliori: si confronta l'inverso
+    base_tp = baseline.get('throughput_sessions_per_s') or 0
+    cur_tp = current['throughput_sessions_per_s']
+    if base_tp and cur_tp:
+        row = compare_metric("secondi per sessione", 1 / base_tp, 1 / cur_tp, threshold)
+        rows.append(row)
+    return rows
+
+
+def print_report(report):
+    print(f"Sessioni completate: {report['completed_sessions']} "
+          f"(fallite: {report['failed_sessions']}) in {report['wall_time_s']:.2f}s")
+    print(f"Throughput: {report['throughput_sessions_per_s']:.2f} sessioni/s")
+    print(f"{'fase':<14}{'n':>6}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    for stage, stats in report['stages'].items():
+        print(f"{stage:<14}{stats['count']:>6}{stats['p50_ms']:>11.1f}"
+              f"{stats['p95_ms']:>11.1f}{stats['p99_ms']:>11.1f}")
+    for error in report['errors']:
+        print(f"Errore: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test del flusso di preventivo Streamlit")
+    parser.add_argument('--sessions', type=int, default=20, help="Numero totale di sessioni simulate")
+    parser.add_argument('--concurrency', type=int, default=5, help="Sessioni eseguite in parallelo")
+    parser.add_argument('--timeout', type=float, default=60, help="Timeout per singolo rerun (secondi)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed per i dati generati")
+    parser.add_argument('--output', help="Percorso del report JSON")
+    parser.add_argument('--baseline', help="Report JSON di una release precedente da confrontare")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Peggioramento relativo oltre il quale segnalare una regressione")
+    args = parser.parse_args(argv)
+
+    report = run_load_test(args.sessions, args.concurrency, args.timeout, args.seed)
+    print_report(report)
+
+    if args.output:
+        write_report(report, args.output)
+
+    if args.baseline:
+        regressed = print_comparison(compare_reports(load_report(args.baseline), report, args.threshold))
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
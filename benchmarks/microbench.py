@@ -0,0 +1,303 @@
+"""
+Microbenchmark dei percorsi critici: calcolo onorari, generazione PDF e database.
+
+Esempi:
+    python -m benchmarks.microbench run --output reports/bench.json
+    DATABASE_URL=postgresql://localhost/avvocato_bench DATABASE_SSLMODE=disable \\
+        python -m benchmarks.microbench run --db --seed-quotes 5000 --output reports/bench.json
+    DATABASE_URL=sqlite:///reports/bench.db \\
+        python -m benchmarks.microbench run --db --seed-quotes 5000 --output reports/bench_sqlite.json
+    python -m benchmarks.microbench compare reports/baseline.json reports/bench.json
+
+I benchmark del database scrivono dati: usare un database dedicato.
+"""
+import argparse
+import gc
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import date
+
+import fee_calculator
+from utils.fee_calculator import calculate_fees
+from utils.pdf_generator import generate_pdf
+from benchmarks.stats import (
+    compare_metric, environment_info, load_report, percentile, print_comparison, write_report
+)
+
+SAMPLE_CLIENT = {
+    'nome': 'Mario',
+    'cognome': 'Rossi',
+    'email': 'mario.rossi@example.com',
+    'telefono': '+39 333 1234567',
+    'codice_fiscale': 'RSSMRA80A01H501U',
+    'indirizzo': 'Via Roma 1, Milano',
+    'valore_bene': 75000.0,
+}
+
+SAMPLE_SERVICES = [
+    {'id': 1, 'name': 'Consulenza Legale'},
+    {'id': 2, 'name': 'Assistenza Contrattuale'},
+    {'id': 3, 'name': 'Recupero Crediti'},
+]
+
+
+class Case:
+    """A benchmark case: func is timed, setup (if given) runs untimed before every call"""
+
+    def __init__(self, name, func, setup=None, teardown=None):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.teardown = teardown
+
+
+def _call(case):
+    args = case.setup() if case.setup else ()
+    start = time.perf_counter()
+    result = case.func(*args)
+    elapsed = time.perf_counter() - start
+    if case.teardown:
+        case.teardown(result)
+    return elapsed
+
+
+def _calibrate(case, min_time):
+    """Number of calls per repetition so that each repetition lasts at least min_time"""
+    if case.setup or case.teardown:
+        return 1
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            case.func()
+        if time.perf_counter() - start >= min_time or number >= 1_000_000:
+            return number
+        number *= 10
+
+
+def run_case(case, warmup, repetitions, min_time):
+    """Time a case and measure its peak traced memory; returns per-call statistics in microseconds"""
+    for _ in range(warmup):
+        _call(case)
+
+    number = _calibrate(case, min_time)
+    timings = []
+    gc_was_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repetitions):
+            if number == 1:
+                timings.append(_call(case))
+            else:
+                start = time.perf_counter()
+                for _ in range(number):
+                    case.func()
+                timings.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    # La misura della memoria avviene in una chiamata separata: tracemalloc rallenta l'esecuzione
+    tracemalloc.start()
+    try:
+        _call(case)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'calls_per_repetition': number,
+        'repetitions': repetitions,
+        'min_us': timings[0] * 1e6,
+        'median_us': statistics.median(timings) * 1e6,
+        'mean_us': statistics.fmean(timings) * 1e6,
+        'stdev_us': (statistics.stdev(timings) if len(timings) > 1 else 0.0) * 1e6,
+        'p95_us': percentile(timings, 95) * 1e6,
+        'peak_memory_kb': peak / 1024,
+    }
+
+
+def calculation_cases():
+    values = [800, 4000, 20000, 45000, 150000, 400000, 900000]
+    service_names = list(fee_calculator.TARIFFE_BASE) + ["Diritto Successorio"]
+
+    return [
+        Case('calculate_fees', lambda: [calculate_fees(v, n) for v in values for n in (1, 2, 4)]),
+        Case('get_preventivo_dettagliato',
+             lambda: [fee_calculator.get_preventivo_dettagliato(v, service_names, "media") for v in values]),
+        Case('generate_pdf', lambda: generate_pdf(SAMPLE_CLIENT, SAMPLE_SERVICES, calculate_fees(75000, 3))),
+    ]
+
+
+def seed_database(quotes, seed=0):
+    """Populate the benchmark database with services, clients and quotes"""
+    import database
+    from storage import get_storage
+
+    rng = random.Random(seed)
+    storage = get_storage()
+    database.initialize_database()
+
+    services = database.load_services_from_db()
+    if not services:
+        storage.copy_rows('services', ('id', 'name', 'description'), [
+            (i, f"Servizio {i}", f"Descrizione del servizio {i}") for i in range(1, 11)
+        ])
+        services = database.load_services_from_db()
+    service_ids = [service['id'] for service in services]
+
+    conn = storage.connect()
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM clients")
+    first_client = cur.fetchone()[0] + 1
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM quotes")
+    first_quote = cur.fetchone()[0] + 1
+    cur.close()
+    conn.close()
+
+    storage.copy_rows('clients', ('id', 'nome', 'cognome', 'email', 'telefono', 'codice_fiscale', 'indirizzo'), (
+        (first_client + i, f"Nome{i}", f"Cognome{i}", f"cliente{i}@example.com",
+         "3331234567", "RSSMRA80A01H501U", "Via Roma 1")
+        for i in range(quotes)
+    ))
+
+    quote_rows = []
+    links = []
+    for i in range(quotes):
+        value = round(rng.lognormvariate(10, 1.5), 2)
+        chosen = rng.sample(service_ids, rng.randint(1, min(3, len(service_ids))))
+        created_at = f"{rng.randint(2023, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 10:00:00"
+        quote_rows.append((first_quote + i, first_client + i, value,
+                           round(calculate_fees(value, len(chosen))['total'], 2), created_at))
+        links.extend((first_quote + i, created_at, service_id) for service_id in chosen)
+
+    storage.ensure_partitions(since=date(2023, 1, 1))
+    storage.copy_rows('quotes', ('id', 'client_id', 'valore_bene', 'total_fee', 'created_at'), quote_rows)
+    if storage.dialect == 'postgresql':
+        # Su PostgreSQL i collegamenti sono partizionati per data del preventivo
+        storage.copy_rows('quote_services', ('quote_id', 'quote_created_at', 'service_id'), links)
+    else:
+        storage.copy_rows('quote_services', ('quote_id', 'service_id'),
+                          ((quote_id, service_id) for quote_id, _, service_id in links))
+    storage.reset_sequences()
+
+
+def database_cases():
+    import database
+
+    services = database.load_services_from_db()
+    json_services = [
+        {'id': s['id'], 'name': s['name'], 'description': s['description'], 'file_content': s['file_content']}
+        for s in services
+    ]
+    selected = services[:3]
+    fees = calculate_fees(SAMPLE_CLIENT['valore_bene'], len(selected))
+
+    def create_service():
+        return (database.save_service_to_db("Servizio benchmark", "Da eliminare"),)
+
+    return [
+        Case('db.get_connection', database.get_connection, teardown=lambda conn: conn.close()),
+        Case('db.initialize_database', database.initialize_database),
+        Case('db.load_services_from_db', database.load_services_from_db),
+        Case('db.save_service_to_db',
+             lambda: database.save_service_to_db("Servizio benchmark", "Da eliminare"),
+             teardown=database.delete_service_from_db),
+        Case('db.delete_service_from_db', database.delete_service_from_db, setup=create_service),
+        Case('db.save_quote_to_db', lambda: database.save_quote_to_db(SAMPLE_CLIENT, selected, fees)),
+        Case('db.get_recent_quotes', lambda: database.get_recent_quotes(20)),
+        Case('db.import_json_services', lambda: database.import_json_services(json_services)),
+        Case('db.get_service_statistics', database.get_service_statistics),
+    ]
+
+
+def run_benchmarks(args):
+    cases = calculation_cases()
+    if args.db:
+        if 'DATABASE_URL' not in os.environ:
+            raise SystemExit("DATABASE_URL deve puntare a un database locale dedicato "
+                             "(PostgreSQL o sqlite:///percorso.db)")
+        if args.seed_quotes:
+            seed_database(args.seed_quotes, args.seed)
+        cases += database_cases()
+
+    if args.filter:
+        cases = [case for case in cases if args.filter in case.name]
+
+    results = {}
+    for case in cases:
+        results[case.name] = run_case(case, args.warmup, args.repetitions, args.min_time)
+        stats = results[case.name]
+        print(f"{case.name:<30} mediana {stats['median_us']:>12.1f} µs  "
+              f"p95 {stats['p95_us']:>12.1f} µs  picco mem {stats['peak_memory_kb']:>9.1f} KiB")
+
+    report = {
+        'environment': environment_info(),
+        'parameters': {
+            'warmup': args.warmup,
+            'repetitions': args.repetitions,
+            'min_time': args.min_time,
+            'seed_quotes': args.seed_quotes if args.db else 0,
+        },
+        'results': results,
+    }
+    if args.output:
+        write_report(report, args.output)
+    return 0
+
+
+def compare_benchmarks(args):
+    baseline = load_report(args.baseline)['results']
+    current = load_report(args.current)['results']
+
+    rows = []
+    for name, stats in current.items():
+        if name not in baseline:
+            continue
+        rows.append(compare_metric(f"{name} mediana (µs)", baseline[name]['median_us'],
+                                   stats['median_us'], args.threshold))
+        if args.memory:
+            rows.append(compare_metric(f"{name} picco mem (KiB)", baseline[name]['peak_memory_kb'],
+                                       stats['peak_memory_kb'], args.threshold))
+
+    regressed = print_comparison(rows)
+    return 1 if regressed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmark di calcolo onorari, PDF e database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Esegue i benchmark")
+    run_parser.add_argument('--db', action='store_true', help="Include le funzioni di database.py")
+    run_parser.add_argument('--seed-quotes', type=int, default=0,
+                            help="Preventivi da generare nel database prima dei benchmark")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--warmup', type=int, default=3)
+    run_parser.add_argument('--repetitions', type=int, default=20)
+    run_parser.add_argument('--min-time', type=float, default=0.05,
+                            help="Durata minima di ogni ripetizione (secondi)")
+    run_parser.add_argument('--filter', help="Esegue solo i casi il cui nome contiene questa stringa")
+    run_parser.add_argument('--output', help="Percorso del report JSON")
+    run_parser.set_defaults(handler=run_benchmarks)
+
+    compare_parser = subparsers.add_parser('compare', help="Confronta un report con una baseline")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help="Peggioramento relativo oltre il quale segnalare una regressione")
+    compare_parser.add_argument('--memory', action='store_true', help="Confronta anche il picco di memoria")
+    compare_parser.set_defaults(handler=compare_benchmarks)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
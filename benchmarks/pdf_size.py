@@ -0,0 +1,164 @@
+"""
+Dimensioni e tempi del PDF del preventivo con diversi profili di uscita.
+
+Genera i preventivi tipici (pochi servizi, molti servizi, nomi lunghi con
+lettere accentate) con ogni variante e riporta byte del PDF, byte in base64
+(quello che finisce nella pagina e nell'email) e tempo di generazione:
+
+    legacy        impostazioni predefinite di reportlab (flussi in ASCII85, non deterministico)
+    uncompressed  flussi non compressi
+    compact       profilo di utils.pdf_generator (OUTPUT_PROFILE, senza ASCII85)
+    compact+font  compact con il font TTF di --font (sottoinsieme incorporato)
+    compact+logo  compact con il logo di --logo (o un PNG 1600x400 generato al momento)
+
+Esempio:
+    python -m benchmarks.pdf_size --repetitions 20 \\
+        --font /usr/share/fonts/truetype/dejavu/DejaVuSans.ttf --output reports/pdf_size.json
+"""
+import argparse
+import base64
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+from reportlab import rl_config
+
+from benchmarks.stats import environment_info, summarize, write_report
+from utils import pdf_generator
+from utils.fee_calculator import calculate_fees
+
+CLIENT = {
+    'nome': 'Maria Grazia',
+    'cognome': 'Dell\'Acqua',
+    'email': 'mariagrazia.dellacqua@example.com',
+    'telefono': '+39 333 1234567',
+    'codice_fiscale': 'DLLMGR80A41F205X',
+    'indirizzo': 'Via Niccolò Tommaseo 12, 20121 Milano',
+}
+
+SERVICE_NAMES = [
+    'Consulenza Legale',
+    'Assistenza Contrattuale',
+    'Recupero Crediti',
+    'Separazione consensuale e negoziazione assistita',
+    'Successione e divisione ereditaria',
+    'Risarcimento danni da sinistro stradale',
+    'Opposizione a decreto ingiuntivo',
+    'Sfratto per morosità e convalida',
+    'Diffida e messa in mora',
+    'Contenzioso di lavoro: impugnazione del licenziamento',
+]
+
+QUOTES = {
+    '1 servizio': (12000.0, 1),
+    '3 servizi': (75000.0, 3),
+    '10 servizi': (480000.0, 10),
+}
+
+
+def quote(value, count):
+    client_data = dict(CLIENT, valore_bene=value)
+    services = [{'id': i, 'name': name, 'description': None} for i, name in enumerate(SERVICE_NAMES[:count], 1)]
+    return client_data, services, calculate_fees(value, count)
+
+
+@contextlib.contextmanager
+def variant(use_a85=0, profile=None, env=None):
+    """Temporarily switch the reportlab/pdf_generator settings of one variant"""
+    saved_a85, saved_profile = rl_config.useA85, pdf_generator.OUTPUT_PROFILE
+    saved_env = {name: os.environ.get(name) for name in ('PDF_FONT', 'PDF_FONT_BOLD', 'PDF_LOGO')}
+    rl_config.useA85 = use_a85
+    if profile is not None:
+        pdf_generator.OUTPUT_PROFILE = profile
+    for name in saved_env:
+        os.environ.pop(name, None)
+    os.environ.update(env or {})
+    try:
+        yield
+    finally:
+        rl_config.useA85, pdf_generator.OUTPUT_PROFILE = saved_a85, saved_profile
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def synthetic_logo(directory):
+    """A 1600x400 PNG, the size of a typical letterhead logo exported for the web"""
+    from PIL import Image, ImageDraw
+
+    path = os.path.join(directory, 'logo.png')
+    image = Image.new('RGB', (1600, 400), (26, 54, 93))
+    draw = ImageDraw.Draw(image)
+    for x in range(0, 1600, 8):
+        draw.line([(x, 0), (x + 400, 400)], fill=(40 + x % 60, 90, 140), width=3)
+    draw.rectangle([60, 120, 1540, 280], fill=(255, 255, 255))
+    image.save(path)
+    return path
+
+
+def measure(client_data, services, fees, repetitions):
+    """First call (cold caches) plus repetitions timed calls"""
+    start = time.perf_counter()
+    pdf_bytes = pdf_generator.generate_pdf(client_data, services, fees)
+    first = time.perf_counter() - start
+    samples = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        pdf_bytes = pdf_generator.generate_pdf(client_data, services, fees)
+        samples.append(time.perf_counter() - start)
+    return {
+        'bytes': len(pdf_bytes),
+        'base64_bytes': len(base64.b64encode(pdf_bytes)),
+        'first_ms': first * 1000,
+        'time': summarize(samples),
+    }
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        logo = args.logo or synthetic_logo(directory)
+        variants = {
+            'legacy': dict(use_a85=1, profile={}),
+            'uncompressed': dict(profile={'pageCompression': 0, 'invariant': 1}),
+            'compact': dict(),
+            'compact+logo': dict(env={'PDF_LOGO': logo}),
+        }
+        if args.font:
+            variants['compact+font'] = dict(env={'PDF_FONT': args.font, 'PDF_FONT_BOLD': args.font_bold or args.font})
+
+        results = {}
+        for name, settings in variants.items():
+            results[name] = {}
+            with variant(**settings):
+                for label, (value, count) in QUOTES.items():
+                    stats = measure(*quote(value, count), args.repetitions)
+                    results[name][label] = stats
+                    print(f"{name:<14} {label:<11} {stats['bytes']:>8} B  base64 {stats['base64_bytes']:>8} B  "
+                          f"p50 {stats['time']['p50_ms']:>7.1f} ms  primo {stats['first_ms']:>7.1f} ms")
+
+    report = {
+        'environment': environment_info(),
+        'parameters': {'repetitions': args.repetitions, 'font': args.font, 'logo': args.logo},
+        'results': results,
+    }
+    if args.output:
+        write_report(report, args.output)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dimensioni e tempi del PDF del preventivo per profilo")
+    parser.add_argument('--repetitions', type=int, default=10)
+    parser.add_argument('--font', help="File TTF per la variante compact+font")
+    parser.add_argument('--font-bold', help="File TTF del grassetto (default: --font)")
+    parser.add_argument('--logo', help="Logo PNG/JPEG/SVG (default: PNG sintetico 1600x400)")
+    parser.add_argument('--output', help="Percorso del report JSON")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Benchmark delle istruzioni preparate lato server (storage.postgres.PREPARED_STATEMENTS).
+
+Per ogni istruzione dell'invio di un preventivo (cliente, preventivo e tre
+collegamenti ai servizi) confronta il tempo di pianificazione riportato da
+EXPLAIN ANALYZE con l'esecuzione normale e con EXECUTE dell'istruzione
+preparata, e misura il tempo complessivo di un invio nei due modi.
+Ogni iterazione avviene in una transazione annullata: il database non cambia.
+
+Esempio:
+    DATABASE_URL=postgresql://localhost/avvocato_bench DATABASE_SSLMODE=disable \\
+        python -m benchmarks.prepared_statements --iterations 500 --output reports/prepared.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from benchmarks.stats import environment_info, summarize, write_report
+from storage import get_storage
+from storage.base import DEFAULT_TENANT_ID
+from storage.postgres import PREPARED_STATEMENTS, plain_sql
+
+TENANT = DEFAULT_TENANT_ID
+
+CLIENT = (TENANT, 'Mario', 'Rossi', 'mario.rossi@example.com', '3331234567', 'RSSMRA80A01H501U', 'Via Roma 1')
+
+# Istruzioni eseguite da save_quote_to_db per un preventivo con tre servizi
+SUBMISSION = ['insert_client', 'insert_quote', 'insert_quote_service', 'insert_quote_service',
+              'insert_quote_service']
+
+
+def _submission_params(client_id, quote, service_ids):
+    quote_id, created_at = quote
+    return [
+        CLIENT,
+        (TENANT, client_id, 75000, 5000),
+        (TENANT, quote_id, created_at, service_ids[0]),
+        (TENANT, quote_id, created_at, service_ids[1]),
+        (TENANT, quote_id, created_at, service_ids[2]),
+    ]
+
+
+def _fixtures(cur):
+    """
+    Insert a client and a quote inside the current transaction to use as foreign-key
+    targets; return (client_id, (quote_id, created_at))
+    """
+    cur.execute(plain_sql('insert_client'), CLIENT)
+    client_id = cur.fetchone()[0]
+    cur.execute(plain_sql('insert_quote'), (TENANT, client_id, 75000, 5000))
+    return client_id, cur.fetchone()
+
+
+def _explain(cur, statement, params):
+    cur.execute(f"EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) {statement}", params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Planning Time'], plan[0]['Execution Time']
+
+
+def _prepare_all(cur):
+    cur.execute("DEALLOCATE ALL")
+    cur.connection.prepared.clear()
+    for name in sorted(set(SUBMISSION)):
+        types, sql = PREPARED_STATEMENTS[name]
+        cur.execute(f"PREPARE {name} {types} AS {sql}")
+
+
+def measure_planning(conn, service_ids, iterations, warmup):
+    """Planning time per statement (ms) with plain and prepared execution"""
+    cur = conn.cursor()
+    _prepare_all(cur)
+    conn.commit()
+
+    planning = {'plain': [], 'prepared': []}
+    for iteration in range(warmup + iterations):
+        plain_total = 0.0
+        prepared_total = 0.0
+        client_id, quote = _fixtures(cur)
+        for name, params in zip(SUBMISSION, _submission_params(client_id, quote, service_ids)):
+            if name == 'insert_quote_service':
+                # Il collegamento già inserito in modalità normale violerebbe la chiave primaria
+                cur.execute("SAVEPOINT link")
+            plan_ms, _ = _explain(cur, plain_sql(name), params)
+            plain_total += plan_ms
+            if name == 'insert_quote_service':
+                cur.execute("ROLLBACK TO SAVEPOINT link")
+            placeholders = ", ".join(["%s"] * len(params))
+            plan_ms, _ = _explain(cur, f"EXECUTE {name} ({placeholders})", params)
+            prepared_total += plan_ms
+        conn.rollback()
+
+        # Le prime esecuzioni servono a far scegliere a PostgreSQL il piano generico
+        if iteration >= warmup:
+            planning['plain'].append(plain_total / 1000)
+            planning['prepared'].append(prepared_total / 1000)
+
+    cur.close()
+    return planning
+
+
+def measure_wall_time(conn, service_ids, iterations, warmup, prepared):
+    """Wall-clock time of the submission statements per quote (seconds)"""
+    cur = conn.cursor()
+    samples = []
+    for iteration in range(warmup + iterations):
+        client_id, quote = _fixtures(cur)
+        start = time.perf_counter()
+        for name, params in zip(SUBMISSION, _submission_params(client_id, quote, service_ids)):
+            if prepared:
+                cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+            else:
+                cur.execute(plain_sql(name), params)
+        elapsed = time.perf_counter() - start
+        conn.rollback()
+        if iteration >= warmup:
+            samples.append(elapsed)
+    cur.close()
+    return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark delle istruzioni preparate su PostgreSQL")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--output', help="Percorso del report JSON")
+    args = parser.parse_args(argv)
+
+    storage = get_storage()
+    if storage.dialect != 'postgresql' or 'DATABASE_URL' not in os.environ:
+        parser.error("DATABASE_URL deve puntare a un database PostgreSQL locale")
+    storage.initialize()
+
+    conn = storage.connect()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM services WHERE tenant_id = %s ORDER BY id LIMIT 3", (TENANT,))
+    service_ids = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.rollback()
+    if len(service_ids) < 3:
+        parser.error("Servono almeno tre servizi nel database (vedi benchmarks.microbench --seed-quotes)")
+
+    try:
+        planning = measure_planning(conn, service_ids, args.iterations, args.warmup)
+        wall_plain = measure_wall_time(conn, service_ids, args.iterations, args.warmup, prepared=False)
+        wall_prepared = measure_wall_time(conn, service_ids, args.iterations, args.warmup, prepared=True)
+    finally:
+        # Le istruzioni preparate qui non devono restare sulla connessione del pool
+        conn.cursor().execute("DEALLOCATE ALL")
+        conn.prepared.clear()
+        conn.close()
+
+    report = {
+        'environment': environment_info(),
+        'parameters': {'iterations': args.iterations, 'warmup': args.warmup},
+        'planning_per_submission': {mode: summarize(samples) for mode, samples in planning.items()},
+        'wall_time_per_submission': {
+            'plain': summarize(wall_plain),
+            'prepared': summarize(wall_prepared),
+        },
+    }
+
+    plain_plan = report['planning_per_submission']['plain']['mean_ms']
+    prepared_plan = report['planning_per_submission']['prepared']['mean_ms']
+    plain_wall = report['wall_time_per_submission']['plain']['p50_ms']
+    prepared_wall = report['wall_time_per_submission']['prepared']['p50_ms']
+    print(f"Pianificazione per invio: normale {plain_plan:.3f} ms, preparata {prepared_plan:.3f} ms "
+          f"(risparmio {plain_plan - prepared_plan:.3f} ms)")
+    print(f"Tempo per invio (p50): normale {plain_wall:.3f} ms, preparata {prepared_wall:.3f} ms")
+
+    if args.output:
+        write_report(report, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
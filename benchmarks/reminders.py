@@ -0,0 +1,188 @@
+"""
+Job dei promemoria di scadenza (utils.reminders) contro un server SMTP locale.
+
+Genera nel database N preventivi in scadenza (più altrettanti fuori dalla
+finestra, che non devono ricevere nulla), avvia un server SMTP fittizio che
+accetta i messaggi senza consegnarli (rifiuta i destinatari che contengono
+"rifiuta") ed esegue il job due volte: la seconda esecuzione non deve inviare
+nulla. Riporta messaggi al secondo, connessioni SMTP aperte e duplicati.
+
+Esempio:
+    DATABASE_URL=postgresql://localhost/avvocato_bench DATABASE_SSLMODE=disable \\
+        python -m benchmarks.reminders --quotes 20000 --rate 2000 --output reports/reminders.json
+
+Il benchmark scrive dati: usare un database dedicato.
+"""
+import argparse
+import os
+import random
+import socketserver
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from benchmarks.stats import environment_info, write_report
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Minimal SMTP server that accepts (and counts) messages without delivering them"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0)):
+        super().__init__(address, _SmtpHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.recipients = Counter()
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        self.reply('220 sink ESMTP')
+        recipients = []
+        for raw in self.rfile:
+            command = raw.decode(errors='replace').strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 sink')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                if 'rifiuta' in command:
+                    self.reply('550 Mailbox unavailable')
+                else:
+                    recipients.append(command.split(':', 1)[1].strip(' <>'))
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                with self.server.lock:
+                    self.server.recipients.update(recipients)
+                self.reply('250 OK')
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+def seed_quotes(count, refused_every, seed=0):
+    """count quotes inside the reminder window and count outside it; returns the ids inside"""
+    import database
+    from storage import get_storage
+    from utils.reminders import QUOTE_VALIDITY_DAYS, days_before
+
+    rng = random.Random(seed)
+    storage = get_storage()
+    database.initialize_database()
+
+    conn = storage.connect()
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM clients")
+    first_client = cur.fetchone()[0] + 1
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM quotes")
+    first_quote = cur.fetchone()[0] + 1
+    cur.close()
+    conn.close()
+
+    storage.copy_rows('clients', ('id', 'nome', 'cognome', 'email', 'telefono', 'codice_fiscale', 'indirizzo'), (
+        (first_client + i, f"Nome{i}", f"Cognome{i}",
+         f"rifiuta{i}@example.com" if refused_every and i % refused_every == 0 else f"cliente{i}@example.com",
+         None, "RSSMRA80A01H501U", None)
+        for i in range(count * 2)
+    ))
+
+    expiry_start = datetime.now() - timedelta(days=QUOTE_VALIDITY_DAYS)
+    window = days_before() * 86400
+    rows = []
+    for i in range(count * 2):
+        if i < count:
+            # Nella finestra, lontano dai bordi (il job legge l'ora corrente più tardi)
+            offset = rng.uniform(60, window - 60)
+        else:
+            # Già scaduti o con più giorni di validità rimasti
+            offset = rng.choice([-rng.uniform(60, 86400 * 30), window + rng.uniform(60, 86400 * 20)])
+        created_at = (expiry_start + timedelta(seconds=offset)).replace(microsecond=0)
+        rows.append((first_quote + i, first_client + i, 10000, 1234.56, created_at))
+
+    storage.ensure_partitions(since=(expiry_start - timedelta(days=31)).date())
+    storage.copy_rows('quotes', ('id', 'client_id', 'valore_bene', 'total_fee', 'created_at'), rows)
+    storage.reset_sequences()
+    return {row[0] for row in rows[:count]}
+
+
+def run(args):
+    from utils.email_sender import SmtpBatchSender
+    from utils.reminders import send_expiry_reminders
+
+    if 'DATABASE_URL' not in os.environ:
+        raise SystemExit("DATABASE_URL deve puntare a un database locale dedicato "
+                         "(PostgreSQL o sqlite:///percorso.db)")
+
+    expected = seed_quotes(args.quotes, args.refused_every, args.seed)
+    with SmtpSink() as sink:
+        sender = SmtpBatchSender(host='127.0.0.1', port=sink.server_address[1], starttls=False,
+                                 user='', password='', rate=args.rate, max_per_connection=args.max_per_connection)
+        first = send_expiry_reminders(page_size=args.page_size, sender=sender)
+        second = send_expiry_reminders(page_size=args.page_size, sender=sender)
+
+    duplicates = sum(1 for count in sink.recipients.values() if count > 1)
+    refused = sum(1 for i in range(args.quotes) if args.refused_every and i % args.refused_every == 0)
+    report = {
+        'environment': environment_info(),
+        'parameters': {key: getattr(args, key) for key in
+                       ('quotes', 'rate', 'page_size', 'max_per_connection', 'refused_every', 'seed')},
+        'first_run': first,
+        'second_run': second,
+        'messages_received': sum(sink.recipients.values()),
+        'smtp_connections': sink.connections,
+        'duplicates': duplicates,
+        'messages_per_second': first['sent'] / first['elapsed_seconds'] if first['elapsed_seconds'] else 0.0,
+    }
+    print(f"Prima esecuzione: {first['due']} in scadenza (attesi {len(expected)}), {first['sent']} inviati, "
+          f"{first['refused']} rifiutati (attesi {refused}) in {first['elapsed_seconds']:.1f} s "
+          f"({report['messages_per_second']:.0f} messaggi/s)")
+    print(f"Seconda esecuzione: {second['due']} in scadenza, {second['sent']} inviati")
+    print(f"Messaggi ricevuti dal server: {report['messages_received']}, connessioni SMTP: {sink.connections}, "
+          f"duplicati: {duplicates}")
+    if args.output:
+        write_report(report, args.output)
+    ok = first['due'] >= len(expected) and second['due'] == 0 and not duplicates
+    return 0 if ok else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Job dei promemoria di scadenza contro un server SMTP locale")
+    parser.add_argument('--quotes', type=int, default=5000, help="Preventivi in scadenza da generare")
+    parser.add_argument('--rate', type=float, default=1000, help="Messaggi al secondo (EMAIL_RATE_PER_SECOND)")
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--max-per-connection', type=int, default=100)
+    parser.add_argument('--refused-every', type=int, default=50,
+                        help="Un destinatario rifiutato ogni N preventivi (0: nessuno)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Percorso del report JSON")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
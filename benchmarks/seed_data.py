@@ -0,0 +1,398 @@
+"""
+Dataset sintetico per provare statistiche, elenchi ed esportazioni su volumi reali.
+
+Genera clienti, preventivi e collegamenti quote_services per lo studio corrente
+(--tenant, default DEFAULT_TENANT) e li carica con storage.copy_rows (COPY su
+PostgreSQL), un mese alla volta, senza tenere in memoria l'intero dataset:
+
+- valore del bene distribuito sugli scaglioni del DM 55/2014 (VALUE_BRACKETS),
+  log-uniforme all'interno dello scaglione e con coda di Pareto oltre € 520.000
+- servizi per preventivo secondo SERVICES_PER_QUOTE, scelti con popolarità di
+  Zipf sul catalogo dello studio (creato da data/services.json se è vuoto)
+- stagionalità per mese (MONTH_WEIGHTS: agosto e dicembre più scarsi), crescita
+  annua, giorni feriali e orari di studio; gli id seguono l'ordine di created_at
+- clienti ricorrenti: ogni cliente ha almeno un preventivo se --quotes >= --clients
+
+Lo stesso --seed produce sempre gli stessi dati (ogni mese ha un generatore proprio).
+Al termine le sequenze vengono riallineate, le tabelle analizzate e le cache
+delle statistiche dello studio invalidate.
+
+Esempio:
+    DATABASE_URL=postgresql://localhost/avvocato_bench DATABASE_SSLMODE=disable \\
+        python -m benchmarks.seed_data --quotes 2000000 --clients 1500000 --months 36 \\
+        --seed 42 --output reports/seed.json
+
+Il comando scrive dati: usare un database dedicato.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from bisect import bisect
+from collections import Counter
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+
+from benchmarks.stats import environment_info, write_report
+from utils.fee_calculator import LIMITI_SCAGLIONI, calculate_fees, get_scaglione
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES_PATH = os.path.join(ROOT_DIR, 'data', 'services.json')
+
+# Quota di preventivi per scaglione del DM 55/2014 (1: fino a € 1.100 ... 7: oltre € 520.000)
+VALUE_BRACKETS = (0.06, 0.18, 0.32, 0.16, 0.19, 0.06, 0.03)
+# Valore minimo del primo scaglione e parametro della coda oltre l'ultimo limite
+MIN_VALUE = 150
+TAIL_ALPHA = 2.2
+MAX_VALUE = 20_000_000
+
+# Quota di preventivi con 1, 2, 3, ... servizi
+SERVICES_PER_QUOTE = (0.52, 0.27, 0.12, 0.06, 0.03)
+# Esponente della popolarità dei servizi (rango 1 il più richiesto)
+SERVICE_POPULARITY = 0.9
+
+# Peso relativo di ogni mese dell'anno (gennaio ... dicembre)
+MONTH_WEIGHTS = (1.05, 1.10, 1.15, 1.00, 1.05, 1.00, 0.85, 0.35, 1.10, 1.15, 1.10, 0.70)
+# Peso relativo dei giorni della settimana (lunedì ... domenica) e delle ore 0-23
+WEEKDAY_WEIGHTS = (1.15, 1.1, 1.05, 1.05, 0.95, 0.12, 0.03)
+HOUR_WEIGHTS = (0, 0, 0, 0, 0, 0, 0, 0.1, 0.4, 1.0, 1.2, 1.2, 0.9, 0.4, 0.6, 1.0, 1.1, 1.0, 0.7, 0.3, 0.1, 0.05, 0, 0)
+
+VALUE_CUM_WEIGHTS = list(accumulate(VALUE_BRACKETS))
+SERVICES_CUM_WEIGHTS = list(accumulate(SERVICES_PER_QUOTE))
+HOUR_CUM_WEIGHTS = list(accumulate(HOUR_WEIGHTS))
+
+# Servizi aggiunti a data/services.json quando --services ne chiede di più
+EXTRA_SERVICES = (
+    ("Diritto di Famiglia", "Separazioni, divorzi, affidamento dei figli e assegni di mantenimento."),
+    ("Successioni", "Dichiarazioni di successione, divisioni ereditarie e impugnazioni di testamento."),
+    ("Diritto del Lavoro", "Licenziamenti, vertenze retributive e contrattazione individuale."),
+    ("Locazioni", "Contratti di locazione, sfratti per morosità e finita locazione."),
+    ("Condominio", "Impugnazione di delibere assembleari e rapporti con l'amministratore."),
+    ("Risarcimento Danni", "Sinistri stradali, responsabilità medica e danni da fatto illecito."),
+    ("Diritto Societario", "Costituzione di società, patti parasociali e operazioni straordinarie."),
+    ("Proprietà Intellettuale", "Marchi, brevetti e tutela del diritto d'autore."),
+    ("Diritto Tributario", "Ricorsi contro avvisi di accertamento e cartelle esattoriali."),
+    ("Crisi d'Impresa", "Composizione negoziata, concordato preventivo e liquidazione giudiziale."),
+    ("Privacy e GDPR", "Adeguamento al regolamento europeo e gestione dei data breach."),
+    ("Diritto Amministrativo", "Ricorsi al TAR, appalti pubblici e accesso agli atti."),
+)
+
+# I nomi femminili occupano le posizioni dispari (per il giorno del codice fiscale)
+FIRST_NAMES = (
+    "Marco", "Giulia", "Luca", "Francesca", "Alessandro", "Chiara", "Andrea", "Sara", "Matteo", "Valentina",
+    "Lorenzo", "Elena", "Davide", "Martina", "Simone", "Federica", "Stefano", "Laura", "Giuseppe", "Anna",
+    "Francesco", "Paola", "Roberto", "Silvia", "Paolo", "Alessia", "Antonio", "Elisa", "Giovanni", "Serena",
+    "Riccardo", "Claudia", "Fabio", "Giorgia", "Massimo", "Roberta", "Nicola", "Ilaria", "Daniele", "Monica",
+)
+LAST_NAMES = (
+    "Rossi", "Russo", "Ferrari", "Esposito", "Bianchi", "Romano", "Colombo", "Ricci", "Marino", "Greco",
+    "Bruno", "Gallo", "Conti", "De Luca", "Mancini", "Costa", "Giordano", "Rizzo", "Lombardi", "Moretti",
+    "Barbieri", "Fontana", "Santoro", "Mariani", "Rinaldi", "Caruso", "Ferrara", "Galli", "Martini", "Leone",
+    "Longo", "Gentile", "Martinelli", "Vitale", "Lombardo", "Serra", "Coppola", "De Santis", "D'Angelo", "Marchetti",
+)
+# (comune, codice catastale, peso)
+CITIES = (
+    ("Roma", "H501", 20), ("Milano", "F205", 18), ("Napoli", "F839", 12), ("Torino", "L219", 10),
+    ("Palermo", "G273", 6), ("Genova", "D969", 6), ("Bologna", "A944", 7), ("Firenze", "D612", 7),
+    ("Bari", "A662", 5), ("Verona", "L781", 4), ("Padova", "G224", 3), ("Brescia", "B157", 2),
+)
+STREETS = (
+    "Via Roma", "Via Garibaldi", "Corso Vittorio Emanuele", "Via Mazzini", "Via Dante", "Via Verdi",
+    "Piazza della Repubblica", "Via Cavour", "Viale Europa", "Via XX Settembre", "Via Marconi", "Corso Italia",
+)
+EMAIL_DOMAINS = ("gmail.com", "libero.it", "hotmail.it", "yahoo.it", "outlook.it", "pec.it", "tiscali.it")
+
+CF_MONTHS = "ABCDEHLMPRST"
+# Valori dei caratteri in posizione dispari per il carattere di controllo del codice fiscale
+CF_ODD = dict(zip("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ", (
+    1, 0, 5, 7, 9, 13, 15, 17, 19, 21,
+    1, 0, 5, 7, 9, 13, 15, 17, 19, 21, 2, 4, 18, 20, 11, 3, 6, 8, 12, 14, 16, 10, 22, 25, 24, 23,
+)))
+CF_EVEN = {char: (int(char) if char.isdigit() else ord(char) - ord('A')) for char in CF_ODD}
+
+CLIENT_COLUMNS = ('tenant_id', 'id', 'nome', 'cognome', 'email', 'telefono', 'codice_fiscale', 'indirizzo',
+                  'created_at')
+QUOTE_COLUMNS = ('tenant_id', 'id', 'client_id', 'valore_bene', 'total_fee', 'created_at')
+
+
+def _cf_letters(text, first_name=False):
+    letters = [c for c in text.upper() if c.isalpha()]
+    consonants = [c for c in letters if c not in "AEIOU"]
+    vowels = [c for c in letters if c in "AEIOU"]
+    if first_name and len(consonants) >= 4:
+        consonants = [consonants[0]] + consonants[2:4]
+    return "".join(consonants + vowels + ["X", "X", "X"])[:3]
+
+
+def codice_fiscale(nome, cognome, birth, female, city_code):
+    """Formally valid codice fiscale (letters, birth date, municipality and check character)"""
+    partial = (_cf_letters(cognome) + _cf_letters(nome, first_name=True) + f"{birth.year % 100:02d}"
+               + CF_MONTHS[birth.month - 1] + f"{birth.day + (40 if female else 0):02d}" + city_code)
+    total = sum(CF_ODD[c] if i % 2 == 0 else CF_EVEN[c] for i, c in enumerate(partial))
+    return partial + chr(ord('A') + total % 26)
+
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_plan(quotes, first_month, months, until, growth):
+    """
+    (first day, last day excluded, quotes) for each month: quotes split by
+    seasonality, yearly growth and the days available (the last month stops at until)
+    """
+    slots = []
+    for offset in range(months):
+        month = _add_months(first_month, offset)
+        end = min(_add_months(month, 1), until)
+        if end <= month:
+            break
+        fraction = (end - month).days / (_add_months(month, 1) - month).days
+        weight = MONTH_WEIGHTS[month.month - 1] * (1 + growth) ** (offset / 12) * fraction
+        slots.append((month, end, weight))
+
+    # Ripartizione con il metodo dei resti maggiori: il totale è esattamente quotes
+    total_weight = sum(weight for _, _, weight in slots)
+    shares = [quotes * weight / total_weight for _, _, weight in slots]
+    counts = [int(share) for share in shares]
+    by_remainder = sorted(range(len(slots)), key=lambda i: shares[i] - counts[i], reverse=True)
+    for i in by_remainder[:quotes - sum(counts)]:
+        counts[i] += 1
+    return [(month, end, count) for (month, end, _), count in zip(slots, counts)]
+
+
+def asset_value(rng):
+    """Asset value: DM 55/2014 bracket from VALUE_BRACKETS, log-uniform inside it"""
+    bracket = rng.choices(range(len(VALUE_BRACKETS)), cum_weights=VALUE_CUM_WEIGHTS)[0]
+    if bracket >= len(LIMITI_SCAGLIONI):
+        value = min(LIMITI_SCAGLIONI[-1] * rng.paretovariate(TAIL_ALPHA), MAX_VALUE)
+    else:
+        low = LIMITI_SCAGLIONI[bracket - 1] if bracket else MIN_VALUE
+        value = math.exp(rng.uniform(math.log(low), math.log(LIMITI_SCAGLIONI[bracket])))
+    # Importi tondi come quelli indicati dai clienti
+    step = 10 if value < 5000 else 100 if value < 100000 else 1000
+    return float(max(step, round(value / step) * step))
+
+
+def pick_services(rng, service_ids, cum_popularity):
+    count = min(len(service_ids), rng.choices(range(1, len(SERVICES_PER_QUOTE) + 1),
+                                              cum_weights=SERVICES_CUM_WEIGHTS)[0])
+    chosen = set()
+    while len(chosen) < count:
+        chosen.add(service_ids[bisect(cum_popularity, rng.random() * cum_popularity[-1])])
+    return sorted(chosen)
+
+
+def quote_times(rng, start, end, count):
+    """count sorted timestamps in [start, end) on working days and office hours"""
+    days = [start + timedelta(days=i) for i in range((end - start).days)]
+    cum_days = list(accumulate(WEEKDAY_WEIGHTS[day.weekday()] for day in days))
+    times = []
+    for _ in range(count):
+        day = days[bisect(cum_days, rng.random() * cum_days[-1])]
+        hour = bisect(HOUR_CUM_WEIGHTS, rng.random() * HOUR_CUM_WEIGHTS[-1])
+        times.append(datetime(day.year, day.month, day.day, hour, rng.randrange(60), rng.randrange(60)))
+    times.sort()
+    return times
+
+
+def client_rows(tenant_id, first_id, count, seed, created_at):
+    """Stream of count clients with plausible, unique contact data"""
+    rng = random.Random(f"{seed}:clients")
+    city_weights = list(accumulate(weight for _, _, weight in CITIES))
+    for i in range(count):
+        first = rng.randrange(len(FIRST_NAMES))
+        nome, cognome = FIRST_NAMES[first], rng.choice(LAST_NAMES)
+        city, city_code, _ = CITIES[bisect(city_weights, rng.random() * city_weights[-1])]
+        birth = date(1940, 1, 1) + timedelta(days=rng.randrange(365 * 65))
+        local = f"{nome}.{cognome}".lower().replace(" ", "").replace("'", "")
+        yield (
+            tenant_id, first_id + i, nome, cognome,
+            f"{local}{first_id + i}@{rng.choice(EMAIL_DOMAINS)}",
+            f"+39 3{rng.randrange(10, 50)} {rng.randrange(1000000, 10000000)}" if rng.random() < 0.85 else None,
+            codice_fiscale(nome, cognome, birth, first % 2 == 1, city_code),
+            f"{rng.choice(STREETS)} {rng.randint(1, 200)}, {city}" if rng.random() < 0.7 else None,
+            created_at,
+        )
+
+
+def ensure_services(tenant, count):
+    """Services of the tenant; when it has none, count services from data/services.json and EXTRA_SERVICES"""
+    import database
+
+    services = database.load_services_from_db(tenant_id=tenant.id)
+    if not services:
+        with open(SERVICES_PATH, encoding='utf-8') as f:
+            catalog = [(s['name'], s['description']) for s in json.load(f)]
+        catalog += [service for service in EXTRA_SERVICES if service[0] not in {name for name, _ in catalog}]
+        for name, description in catalog[:count]:
+            database.save_service_to_db(name, description, tenant_id=tenant.id)
+        services = database.load_services_from_db(tenant_id=tenant.id)
+    return [service['id'] for service in services]
+
+
+def _next_ids(storage, tenant_id):
+    conn = storage.connect()
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM clients")
+    first_client = cur.fetchone()[0] + 1
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM quotes")
+    first_quote = cur.fetchone()[0] + 1
+    cur.close()
+    conn.close()
+    return first_client, first_quote
+
+
+def _analyze(storage):
+    conn = storage.connect()
+    cur = conn.cursor()
+    for table in ('clients', 'quotes', 'quote_services'):
+        cur.execute(f"ANALYZE {table}")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def seed(tenant, quotes, clients, months, seed=0, until=None, growth=0.08, services=12):
+    """
+    Load the synthetic dataset for tenant and return the report dictionary
+
+    Args:
+        tenant (Tenant): Studio a cui appartengono i dati
+        quotes (int): Preventivi da generare
+        clients (int): Clienti da generare (i preventivi in più vanno a clienti già generati)
+        months (int): Mesi coperti, fino al giorno prima di until
+        seed (int): Seed dei generatori
+        until (date): Primo giorno escluso (default oggi)
+        growth (float): Crescita annua del numero di preventivi
+        services (int): Servizi da creare se lo studio non ne ha
+    """
+    import database
+    from storage import get_storage
+    from utils.cache import get_cache
+
+    storage = get_storage()
+    database.initialize_database()
+    service_ids = ensure_services(tenant, services)
+    # Popolarità di Zipf su un ordine dei servizi che dipende dal seed
+    ranked = sorted(service_ids, key=lambda service_id: random.Random(f"{seed}:service:{service_id}").random())
+    cum_popularity = list(accumulate(1 / rank ** SERVICE_POPULARITY for rank in range(1, len(ranked) + 1)))
+    tariff = tenant.tariff
+
+    until = until or date.today()
+    first_month = _add_months(date(until.year, until.month, 1), -(months - 1) if until.day > 1 else -months)
+    plan = month_plan(quotes, first_month, months, until, growth)
+    first_client, first_quote = _next_ids(storage, tenant.id)
+    storage.ensure_partitions(since=first_month)
+
+    timings = {}
+    start = time.perf_counter()
+    storage.copy_rows('clients', CLIENT_COLUMNS,
+                      client_rows(tenant.id, first_client, clients, seed, datetime.combine(first_month, datetime.min.time())))
+    timings['clients'] = time.perf_counter() - start
+
+    brackets = Counter()
+    services_per_quote = Counter()
+    per_month = {}
+    links_total = 0
+    quote_id = first_quote
+    timings['generate'] = timings['copy'] = 0.0
+    for month, month_end, count in plan:
+        month_started = time.perf_counter()
+        rng = random.Random(f"{seed}:{month:%Y-%m}")
+        quote_rows = []
+        links = []
+        for created_at in quote_times(rng, month, month_end, count):
+            index = quote_id - first_quote
+            client_id = first_client + (index if index < clients else rng.randrange(clients))
+            value = asset_value(rng)
+            chosen = pick_services(rng, ranked, cum_popularity)
+            total = round(calculate_fees(value, len(chosen), tariff)['total'], 2)
+            quote_rows.append((tenant.id, quote_id, client_id, value, total, created_at))
+            links.extend((tenant.id, quote_id, created_at, service_id) for service_id in chosen)
+            brackets[get_scaglione(value)] += 1
+            services_per_quote[len(chosen)] += 1
+            quote_id += 1
+
+        copy_started = time.perf_counter()
+        timings['generate'] += copy_started - month_started
+        storage.copy_rows('quotes', QUOTE_COLUMNS, quote_rows)
+        if storage.dialect == 'postgresql':
+            # Su PostgreSQL i collegamenti sono partizionati per data del preventivo
+            storage.copy_rows('quote_services', ('tenant_id', 'quote_id', 'quote_created_at', 'service_id'), links)
+        else:
+            storage.copy_rows('quote_services', ('tenant_id', 'quote_id', 'service_id'),
+                              ((link[0], link[1], link[3]) for link in links))
+        timings['copy'] += time.perf_counter() - copy_started
+        per_month[f"{month:%Y-%m}"] = count
+        links_total += len(links)
+        print(f"{month:%Y-%m}: {count} preventivi, {len(links)} servizi", file=sys.stderr)
+
+    started = time.perf_counter()
+    storage.reset_sequences()
+    _analyze(storage)
+    timings['analyze'] = time.perf_counter() - started
+    get_cache().delete(database.tenant_cache_key(database.STATISTICS_CACHE_KEY, tenant.id))
+
+    elapsed = time.perf_counter() - start
+    return {
+        'tenant': tenant.slug,
+        'rows': {'clients': clients, 'quotes': quotes, 'quote_services': links_total},
+        'ids': {'clients': [first_client, first_client + clients - 1], 'quotes': [first_quote, quote_id - 1]},
+        'elapsed_seconds': elapsed,
+        'rows_per_second': (clients + quotes + links_total) / elapsed if elapsed else 0.0,
+        'stage_seconds': timings,
+        'quotes_per_bracket': {str(bracket): brackets[bracket] for bracket in sorted(brackets)},
+        'services_per_quote': {str(count): services_per_quote[count] for count in sorted(services_per_quote)},
+        'quotes_per_month': per_month,
+    }
+
+
+def main(argv=None):
+    from utils import tenants
+
+    parser = argparse.ArgumentParser(description="Genera e carica un dataset sintetico di clienti e preventivi")
+    parser.add_argument('--quotes', type=int, default=1_000_000, help="Preventivi da generare")
+    parser.add_argument('--clients', type=int, help="Clienti da generare (default: 80%% dei preventivi)")
+    parser.add_argument('--months', type=int, default=36, help="Mesi coperti, fino a ieri")
+    parser.add_argument('--until', type=date.fromisoformat, help="Primo giorno escluso (AAAA-MM-GG, default oggi)")
+    parser.add_argument('--growth', type=float, default=0.08, help="Crescita annua dei preventivi")
+    parser.add_argument('--services', type=int, default=12, help="Servizi da creare se lo studio non ne ha")
+    parser.add_argument('--tenant', help="Slug dello studio (default DEFAULT_TENANT)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Percorso del report JSON")
+    args = parser.parse_args(argv)
+
+    if 'DATABASE_URL' not in os.environ:
+        raise SystemExit("DATABASE_URL deve puntare a un database locale dedicato "
+                         "(PostgreSQL o sqlite:///percorso.db)")
+    clients = args.clients if args.clients is not None else max(1, int(args.quotes * 0.8))
+    if args.quotes and clients < 1:
+        parser.error("Con --quotes serve almeno un cliente (--clients)")
+
+    import database
+
+    database.initialize_database()
+    try:
+        tenant = tenants.resolve(args.tenant)
+    except tenants.UnknownTenant as e:
+        parser.error(str(e))
+
+    report = seed(tenant, args.quotes, clients, args.months, args.seed, args.until, args.growth, args.services)
+    report['environment'] = environment_info()
+    report['parameters'] = {key: getattr(args, key) for key in ('quotes', 'months', 'growth', 'services', 'seed')}
+    report['parameters'].update(clients=clients, until=(args.until or date.today()).isoformat())
+    print(f"Caricati {report['rows']['clients']} clienti, {report['rows']['quotes']} preventivi e "
+          f"{report['rows']['quote_services']} servizi in {report['elapsed_seconds']:.1f} s "
+          f"({report['rows_per_second']:.0f} righe/s)")
+    if args.output:
+        write_report(report, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
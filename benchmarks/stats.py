@@ -0,0 +1,103 @@
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime
+
+
+def percentile(sorted_values, pct):
+    """Return the pct-th percentile of an already sorted list (linear interpolation)"""
+    if not sorted_values:
+        return 0.0
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+
+    rank = (len(sorted_values) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    weight = rank - lower
+    return sorted_values[lower] * (1 - weight) + sorted_values[upper] * weight
+
+
+def summarize(samples):
+    """Summarize a list of durations (seconds) into count, mean and p50/p95/p99 in milliseconds"""
+    values = sorted(samples)
+    if not values:
+        return {'count': 0, 'mean_ms': 0.0, 'min_ms': 0.0, 'p50_ms': 0.0,
+                'p95_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+
+    return {
+        'count': len(values),
+        'mean_ms': sum(values) / len(values) * 1000,
+        'min_ms': values[0] * 1000,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': values[-1] * 1000,
+    }
+
+
+def environment_info():
+    """Collect the metadata needed to compare reports across releases"""
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def write_report(report, path):
+    """Write a report as JSON"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+
+
+def load_report(path):
+    """Load a JSON report written by write_report"""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compare_metric(name, baseline, current, threshold):
+    """
+    Compare a single metric (lower is better) and return a result row.
+    A regression is flagged when current exceeds baseline by more than threshold (ratio).
+    """
+    if baseline:
+        change = (current - baseline) / baseline
+    else:
+        change = 0.0 if not current else float('inf')
+
+    return {
+        'name': name,
+        'baseline': baseline,
+        'current': current,
+        'change': change,
+        'regression': change > threshold,
+    }
+
+
+def print_comparison(rows):
+    """Print comparison rows as a table and return True if any regression was found"""
+    width = max([len(row['name']) for row in rows] + [10])
+    print(f"{'metrica'.ljust(width)}  {'baseline':>12}  {'attuale':>12}  {'delta':>9}")
+    for row in rows:
+        flag = "  REGRESSIONE" if row['regression'] else ""
+        print(
+            f"{row['name'].ljust(width)}  {row['baseline']:>12.3f}  {row['current']:>12.3f}  "
+            f"{row['change'] * 100:>8.1f}%{flag}"
+        )
+    return any(row['regression'] for row in rows)
@@ -1,311 +1,188 @@
-import os
-import psycopg2
-import psycopg2.extras
-from datetime import datetime
+import logging
+import time
+import uuid
+
+from storage import get_storage
+from utils import archive, metrics, tenants
+from utils.cache import get_cache
+
+# Le funzioni di questo modulo delegano al backend selezionato da DATABASE_URL
+# (PostgreSQL o SQLite embedded, vedi il pacchetto storage). Operano sui dati
+# di uno studio: tenant_id, se non indicato, è quello dello studio corrente
+# (utils.tenants)
+
+logger = logging.getLogger("avvocato.database")
+
+# Catalogo e statistiche passano dalla cache condivisa (utils.cache, CACHE_URL):
+# il catalogo viene invalidato a ogni modifica, le statistiche scadono da sole.
+# Le chiavi di catalogo e statistiche sono per studio (suffisso :tenant_id).
+# La versione del catalogo cambia a ogni modifica e a ogni rilettura dal
+# database: utils.catalog la confronta invece di rileggere i servizi
+SERVICES_CACHE_KEY = "services"
+SERVICES_CACHE_TTL = 300
+SERVICES_VERSION_CACHE_KEY = "services_version"
+STATISTICS_CACHE_KEY = "service_statistics"
+STATISTICS_CACHE_TTL = 60
+TENANTS_CACHE_KEY = "tenants"
+TENANTS_CACHE_TTL = 300
+
+def _tenant_id(tenant_id):
+    return tenants.current_id() if tenant_id is None else tenant_id
+
+def tenant_cache_key(key, tenant_id=None):
+    """Shared cache key of a per-tenant entry"""
+    return f"{key}:{_tenant_id(tenant_id)}"
 
 # Database connection
 def get_connection():
-    """Create a connection to the PostgreSQL database"""
-    conn = psycopg2.connect(
-        os.environ["DATABASE_URL"],
-        sslmode='require'
-    )
-    return conn
+    """Create a connection to the configured database"""
+    return get_storage().connect()
 
+@metrics.timed("db_call_seconds")
 def initialize_database():
     """Create tables if they don't exist"""
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    # Create services table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS services (
-        id SERIAL PRIMARY KEY,
-        name VARCHAR(255) NOT NULL,
-        description TEXT NOT NULL,
-        file_content TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-    
-    # Create clients table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS clients (
-        id SERIAL PRIMARY KEY,
-        nome VARCHAR(255) NOT NULL,
-        cognome VARCHAR(255) NOT NULL,
-        email VARCHAR(255) NOT NULL,
-        telefono VARCHAR(100),
-        codice_fiscale VARCHAR(16) NOT NULL,
-        indirizzo TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-    
-    # Create quotes table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS quotes (
-        id SERIAL PRIMARY KEY,
-        client_id INTEGER REFERENCES clients(id),
-        valore_bene NUMERIC(15, 2) NOT NULL,
-        total_fee NUMERIC(15, 2) NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-    
-    # Create quote_services (junction table)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS quote_services (
-        quote_id INTEGER REFERENCES quotes(id),
-        service_id INTEGER REFERENCES services(id),
-        PRIMARY KEY (quote_id, service_id)
-    );
-    """)
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-
-def load_services_from_db():
+    get_storage().initialize()
+
+@metrics.timed("db_call_seconds")
+def load_tenants():
+    """Load every tenant (id, slug, name, branding, tariff)"""
+    return get_cache().get_or_set(TENANTS_CACHE_KEY, get_storage().load_tenants, TENANTS_CACHE_TTL)
+
+@metrics.timed("db_call_seconds")
+def save_tenant(slug, name, branding=None):
+    """Create or update (by slug) a tenant and return its id"""
+    tenant_id = get_storage().save_tenant(slug, name, branding)
+    get_cache().delete(TENANTS_CACHE_KEY)
+    return tenant_id
+
+@metrics.timed("db_call_seconds")
+def save_tariff(tenant_id, tariff):
+    """Set the tariff of a tenant (None: the default DM 55/2014 tariff)"""
+    get_storage().save_tariff(tenant_id, tariff)
+    get_cache().delete(TENANTS_CACHE_KEY)
+
+def _new_services_version(tenant_id):
+    version = uuid.uuid4().hex
+    get_cache().set(tenant_cache_key(SERVICES_VERSION_CACHE_KEY, tenant_id), version, SERVICES_CACHE_TTL)
+    return version
+
+def _services_changed(tenant_id):
+    get_cache().delete(tenant_cache_key(SERVICES_CACHE_KEY, tenant_id))
+    _new_services_version(tenant_id)
+
+def services_version(tenant_id=None):
+    """Token that changes whenever the services of a tenant are written or reloaded"""
+    tenant_id = _tenant_id(tenant_id)
+    version = get_cache().get(tenant_cache_key(SERVICES_VERSION_CACHE_KEY, tenant_id))
+    return version if version is not None else _new_services_version(tenant_id)
+
+@metrics.timed("db_call_seconds")
+def load_services_from_db(tenant_id=None):
     """Load services from the database"""
-    conn = get_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    cur.execute("SELECT * FROM services ORDER BY name")
-    services = [dict(service) for service in cur.fetchall()]
-    
-    cur.close()
-    conn.close()
-    
-    return services
-
-def save_service_to_db(name, description, file_content=None):
+    tenant_id = _tenant_id(tenant_id)
+
+    def load():
+        services = get_storage().load_services(tenant_id)
+        # Servizi riletti: chi ha costruito il catalogo con la versione precedente lo ricostruisce
+        _new_services_version(tenant_id)
+        return services
+
+    return get_cache().get_or_set(tenant_cache_key(SERVICES_CACHE_KEY, tenant_id), load, SERVICES_CACHE_TTL)
+
+@metrics.timed("db_call_seconds")
+def save_service_to_db(name, description, file_content=None, tenant_id=None):
     """Save a service to the database"""
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-    INSERT INTO services (name, description, file_content) 
-    VALUES (%s, %s, %s) RETURNING id
-    """, (name, description, file_content))
-    
-    service_id = cur.fetchone()[0]
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    
+    tenant_id = _tenant_id(tenant_id)
+    service_id = get_storage().save_service(tenant_id, name, description, file_content)
+    _services_changed(tenant_id)
     return service_id
 
-def delete_service_from_db(service_id):
+@metrics.timed("db_call_seconds")
+def delete_service_from_db(service_id, tenant_id=None):
     """Delete a service from the database"""
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    # First delete from junction table if there are any references
-    cur.execute("DELETE FROM quote_services WHERE service_id = %s", (service_id,))
-    
-    # Then delete the service
-    cur.execute("DELETE FROM services WHERE id = %s", (service_id,))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-
-def save_quote_to_db(client_data, selected_services, fees):
+    tenant_id = _tenant_id(tenant_id)
+    get_storage().delete_service(tenant_id, service_id)
+    _services_changed(tenant_id)
+
+@metrics.timed("db_call_seconds")
+def save_quote_to_db(client_data, selected_services, fees, tenant_id=None):
     """Save quote and client data to the database"""
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    # Insert client data
-    cur.execute("""
-    INSERT INTO clients (nome, cognome, email, telefono, codice_fiscale, indirizzo)
-    VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
-    """, (
-        client_data['nome'], 
-        client_data['cognome'], 
-        client_data['email'], 
-        client_data['telefono'], 
-        client_data['codice_fiscale'], 
-        client_data['indirizzo']
-    ))
-    
-    client_id = cur.fetchone()[0]
-    
-    # Insert quote
-    cur.execute("""
-    INSERT INTO quotes (client_id, valore_bene, total_fee)
-    VALUES (%s, %s, %s) RETURNING id
-    """, (client_id, client_data['valore_bene'], fees['total']))
-    
-    quote_id = cur.fetchone()[0]
-    
-    # Insert quote-service relationships
-    for service in selected_services:
-        cur.execute("""
-        INSERT INTO quote_services (quote_id, service_id)
-        VALUES (%s, %s)
-        """, (quote_id, service['id']))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    
-    return quote_id
-
-def get_recent_quotes(limit=10):
+    return get_storage().save_quote(_tenant_id(tenant_id), client_data, selected_services, fees)
+
+@metrics.timed("db_call_seconds")
+def save_quotes_to_db(quotes, tenant_id=None):
+    """Save many (client_data, selected_services, fees) quotes in one transaction; return their ids"""
+    return get_storage().save_quotes(_tenant_id(tenant_id), quotes)
+
+@metrics.timed("db_call_seconds")
+def get_quote(quote_id, tenant_id=None):
+    """Get a quote with client data and services (id, name, description), or None"""
+    return get_storage().get_quote(_tenant_id(tenant_id), quote_id)
+
+@metrics.timed("db_call_seconds")
+def save_quote_pdf(quote_id, pdf_bytes, tenant_id=None):
+    """Store the rendered PDF of a quote (deduplicated by content and compressed)"""
+    get_storage().save_quote_pdf(_tenant_id(tenant_id), quote_id, pdf_bytes)
+
+@metrics.timed("db_call_seconds")
+def save_quote_pdfs(pdfs, tenant_id=None):
+    """Store the rendered PDFs of many (quote_id, pdf bytes) pairs in one transaction"""
+    get_storage().save_quote_pdfs(_tenant_id(tenant_id), pdfs)
+
+@metrics.timed("db_call_seconds")
+def get_quote_pdf(quote_id, tenant_id=None):
+    """Get the stored PDF of a quote, or None if it was never stored"""
+    return get_storage().get_quote_pdf(_tenant_id(tenant_id), quote_id)
+
+@metrics.timed("db_call_seconds")
+def quotes_with_pdf(quote_ids, tenant_id=None):
+    """Get the ids, among quote_ids, of the quotes with a stored PDF"""
+    return get_storage().quotes_with_pdf(_tenant_id(tenant_id), quote_ids)
+
+@metrics.timed("db_call_seconds")
+def get_recent_quotes(limit=10, tenant_id=None):
     """Get recent quotes with client information"""
-    conn = get_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    cur.execute("""
-    SELECT q.id, q.valore_bene, q.total_fee, q.created_at,
-           c.nome, c.cognome, c.email
-    FROM quotes q
-    JOIN clients c ON q.client_id = c.id
-    ORDER BY q.created_at DESC
-    LIMIT %s
-    """, (limit,))
-    
-    quotes = [dict(quote) for quote in cur.fetchall()]
-    
-    # For each quote, get the services
-    for quote in quotes:
-        cur.execute("""
-        SELECT s.name
-        FROM services s
-        JOIN quote_services qs ON s.id = qs.service_id
-        WHERE qs.quote_id = %s
-        """, (quote['id'],))
-        
-        quote['services'] = [row[0] for row in cur.fetchall()]
-    
-    cur.close()
-    conn.close()
-    
-    return quotes
-
-def import_json_services(services):
-    """Import services from JSON to database"""
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    for service in services:
-        cur.execute("""
-        INSERT INTO services (id, name, description, file_content) 
-        VALUES (%s, %s, %s, %s)
-        ON CONFLICT (id) DO UPDATE 
-        SET name = EXCLUDED.name, 
-            description = EXCLUDED.description, 
-            file_content = EXCLUDED.file_content
-        """, (service['id'], service['name'], service['description'], service['file_content']))
-    
-    # Reset the sequence to max id + 1
-    cur.execute("""
-    SELECT setval('services_id_seq', (SELECT MAX(id) FROM services))
-    """)
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-
-def get_service_statistics():
-    """Get statistics about most requested services"""
-    conn = get_connection()
-    if conn:
-        try:
-            # Create cursor
-            cur = conn.cursor()
-            
-            # Get service request counts
-            cur.execute("""
-                SELECT s.id, s.name, COUNT(qs.service_id) as count
-                FROM services s
-                LEFT JOIN quote_services qs ON s.id = qs.service_id
-                GROUP BY s.id, s.name
-                ORDER BY count DESC
-            """)
-            
-            service_counts = [
-                {'id': row[0], 'name': row[1], 'count': row[2]} 
-                for row in cur.fetchall()
-            ]
-            
-            # Get average quote value by service
-            cur.execute("""
-                SELECT s.id, s.name, AVG(q.valore_bene) as avg_value, AVG(q.total_fee) as avg_fee
-                FROM services s
-                JOIN quote_services qs ON s.id = qs.service_id
-                JOIN quotes q ON qs.quote_id = q.id
-                GROUP BY s.id, s.name
-                ORDER BY s.name
-            """)
-            
-            service_values = [
-                {'id': row[0], 'name': row[1], 'avg_value': row[2], 'avg_fee': row[3]} 
-                for row in cur.fetchall()
-            ]
-            
-            # Get monthly quote counts
-            cur.execute("""
-                SELECT 
-                    EXTRACT(YEAR FROM created_at) as year,
-                    EXTRACT(MONTH FROM created_at) as month,
-                    COUNT(*) as count
-                FROM quotes
-                GROUP BY year, month
-                ORDER BY year, month
-            """)
-            
-            monthly_counts = [
-                {'year': int(row[0]), 'month': int(row[1]), 'count': row[2]} 
-                for row in cur.fetchall()
-            ]
-            
-            # Get total statistics
-            cur.execute("""
-                SELECT 
-                    COUNT(*) as total_quotes, 
-                    AVG(valore_bene) as avg_value,
-                    AVG(total_fee) as avg_fee
-                FROM quotes
-            """)
-            
-            total_stats = cur.fetchone()
-            if total_stats:
-                total_stats = {
-                    'total_quotes': total_stats[0],
-                    'avg_value': total_stats[1] or 0,
-                    'avg_fee': total_stats[2] or 0
-                }
-            else:
-                total_stats = {
-                    'total_quotes': 0,
-                    'avg_value': 0,
-                    'avg_fee': 0
-                }
-            
-            # Close cursor
-            cur.close()
-            
-            return {
-                'service_counts': service_counts,
-                'service_values': service_values,
-                'monthly_counts': monthly_counts,
-                'total_stats': total_stats
-            }
-            
-        except psycopg2.Error as e:
-            print(f"Database error: {e}")
-            if conn:
-                conn.rollback()
-        finally:
-            if conn:
-                conn.close()
-    
-    return {
-        'service_counts': [],
-        'service_values': [],
-        'monthly_counts': [],
-        'total_stats': {'total_quotes': 0, 'avg_value': 0, 'avg_fee': 0}
-    }
\ No newline at end of file
+    return get_storage().get_recent_quotes(_tenant_id(tenant_id), limit)
+
+@metrics.timed("db_call_seconds")
+def search_quotes(text, page=1, page_size=20, tenant_id=None):
+    """
+    Search quotes by client name, surname, email, tax code or service name
+
+    Returns:
+        dict: 'quotes' (same keys as get_recent_quotes), 'page', 'page_size', 'has_more'
+    """
+    return get_storage().search_quotes(_tenant_id(tenant_id), text, page, page_size)
+
+@metrics.timed("db_call_seconds")
+def import_json_services(services, tenant_id=None):
+    """
+    Sync services from JSON (a list or a stream such as utils.catalog.iter_json_services)
+    to the database, writing only new or changed rows
+
+    Returns:
+        dict: 'inserted', 'updated', 'unchanged' and 'elapsed_seconds'
+    """
+    start = time.perf_counter()
+    tenant_id = _tenant_id(tenant_id)
+    report = get_storage().import_services(tenant_id, services)
+    if report['inserted'] or report['updated']:
+        _services_changed(tenant_id)
+    report['elapsed_seconds'] = time.perf_counter() - start
+    logger.info("Catalogo dello studio %s sincronizzato: %d inseriti, %d aggiornati, %d invariati in %.3f s",
+                tenant_id, report['inserted'], report['updated'], report['unchanged'], report['elapsed_seconds'])
+    return report
+
+@metrics.timed("db_call_seconds")
+def get_service_statistics(tenant_id=None):
+    """Get statistics about most requested services, including archived quotes"""
+    tenant_id = _tenant_id(tenant_id)
+    return get_cache().get_or_set(
+        tenant_cache_key(STATISTICS_CACHE_KEY, tenant_id),
+        lambda: archive.include_archived_statistics(get_storage().get_service_statistics(tenant_id), tenant_id),
+        STATISTICS_CACHE_TTL
+    )
+
+def iter_quotes_for_export(chunk_size=5000, tenant_id=None):
+    """Stream all quotes with client data and service names, chunk_size rows at a time"""
+    return get_storage().iter_quotes_for_export(_tenant_id(tenant_id), chunk_size)
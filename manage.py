@@ -0,0 +1,306 @@
+"""
+Comandi di amministrazione.
+
+    python manage.py export-quotes --format csv --output preventivi.csv
+    python manage.py partitions --months-ahead 6 --detach-before 2023-01
+    python manage.py archive-quotes --older-than-days 365
+    python manage.py tariff-impact --tariff nuove_tariffe.json --output impatto.json
+    python manage.py batch-quotes --input pratiche.xlsx --output-dir preventivi --persist
+    python manage.py sync-services --json data/services.json
+    python manage.py quote-reminders --days-before 7
+    python manage.py tenants add rossi --name "Studio Legale Rossi" --logo rossi.png --tariff tariffe_rossi.json
+    python manage.py tenants api-key rossi
+    python manage.py --tenant rossi sync-services --json rossi/services.json
+
+--tenant (slug) sceglie lo studio su cui opera il comando (default DEFAULT_TENANT);
+quote-reminders senza --tenant elabora tutti gli studi.
+"""
+import argparse
+import sys
+from datetime import datetime
+
+
+def export_quotes_command(args):
+    from utils.exporter import export_quotes
+
+    if args.output == '-':
+        count = export_quotes(sys.stdout.buffer, args.format, args.chunk_size)
+    else:
+        with open(args.output, 'wb') as f:
+            count = export_quotes(f, args.format, args.chunk_size)
+    print(f"Esportati {count} preventivi", file=sys.stderr)
+    return 0
+
+
+def partitions_command(args):
+    from storage import get_storage
+
+    storage = get_storage()
+    storage.initialize()
+
+    for name in storage.ensure_partitions(months_ahead=args.months_ahead):
+        print(f"Creata la partizione {name}")
+
+    if args.detach_before:
+        try:
+            detached = storage.detach_partitions(args.detach_before, drop=args.drop)
+        except NotImplementedError:
+            print("Il database configurato non è partizionato", file=sys.stderr)
+            return 1
+        action = "Eliminata" if args.drop else "Staccata"
+        for name in detached:
+            print(f"{action} la partizione {name}")
+        if not detached:
+            print("Nessuna partizione da staccare")
+    return 0
+
+
+def archive_quotes_command(args):
+    from utils.archive import archive_quotes
+
+    archived = archive_quotes(args.older_than_days, args.archive_dir, args.chunk_size)
+    for month in archived:
+        print(f"{month['month']}: {month['quotes']} preventivi archiviati in {month['path']}")
+    print(f"Archiviati {sum(month['quotes'] for month in archived)} preventivi", file=sys.stderr)
+    return 0
+
+
+def _print_impact_table(title, rows, label):
+    print(f"\n{title}")
+    print(f"{label:<28} {'Preventivi':>10} {'Attuale €':>15} {'Candidato €':>15} {'Delta €':>14} "
+          f"{'Delta %':>8} {'Medio €':>10} {'Min €':>10} {'Max €':>10} {'+/-':>13}")
+    for row in rows:
+        print(f"{str(row.get('name', row['key']))[:28]:<28} {row['quotes']:>10} {row['current']:>15,.2f} "
+              f"{row['candidate']:>15,.2f} {row['delta']:>14,.2f} {row['delta_pct']:>7.2f}% "
+              f"{row['delta_mean']:>10,.2f} {row['delta_min']:>10,.2f} {row['delta_max']:>10,.2f} "
+              f"{row['increased']:>6}/{row['decreased']:<6}")
+
+
+def tariff_impact_command(args):
+    import json
+
+    from utils.tariff_impact import load_tariff, tariff_impact
+
+    report = tariff_impact(load_tariff(args.tariff), args.chunk_size, include_archive=not args.no_archive)
+    if report['total'] is None:
+        print("Nessun preventivo da ricalcolare")
+        return 0
+
+    _print_impact_table("Per scaglione attuale", report['by_bracket'], "Scaglione")
+    _print_impact_table("Per servizio (ogni preventivo conta per ciascun servizio)", report['by_service'], "Servizio")
+    _print_impact_table("Per mese", report['by_month'], "Mese")
+    _print_impact_table("Totale", [dict(report['total'], key="Tutti i preventivi")], "")
+    print(f"\n{report['quotes']} preventivi ricalcolati in {report['elapsed_seconds']:.2f} s", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+def batch_quotes_command(args):
+    from utils.batch_quotes import batch_quotes
+
+    if args.persist:
+        import database
+
+        # Crea le tabelle mancanti (anche quelle dei PDF archiviati) prima di salvare
+        database.initialize_database()
+    report = batch_quotes(args.input, args.output_dir, persist=args.persist, render_pdfs=not args.no_pdf,
+                          workers=args.workers, chunk_size=args.chunk_size, summary_path=args.summary)
+    print(f"Righe lette: {report['rows']}, calcolate: {report['priced']}, scartate: {report['errors']}")
+    if args.persist:
+        print(f"Preventivi salvati: {report['saved']}")
+    if not args.no_pdf:
+        print(f"PDF generati: {report['pdfs']} (errori: {report['pdf_errors']})")
+    print(f"Totale preventivato: € {report['total_fees']:,.2f}")
+    print(f"Riepilogo in {report['summary_path']} ({report['elapsed_seconds']:.2f} s)", file=sys.stderr)
+    return 1 if report['errors'] or report['pdf_errors'] else 0
+
+
+def sync_services_command(args):
+    import database
+    from utils.catalog import iter_json_services
+
+    database.initialize_database()
+    report = database.import_json_services(iter_json_services(args.json))
+    print(f"Servizi inseriti: {report['inserted']}, aggiornati: {report['updated']}, "
+          f"invariati: {report['unchanged']} ({report['elapsed_seconds']:.3f} s)")
+    return 0
+
+
+def quote_reminders_command(args):
+    import database
+    from utils import metrics
+    from utils.reminders import send_expiry_reminders
+
+    metrics.setup_from_env()
+    database.initialize_database()
+    report = send_expiry_reminders(days=args.days_before, page_size=args.page_size, limit=args.limit,
+                                   dry_run=args.dry_run)
+    if report['dry_run']:
+        if not args.dry_run:
+            print("SMTP_HOST non configurato: nessun promemoria inviato né registrato", file=sys.stderr)
+        print(f"Preventivi in scadenza senza promemoria: {report['due']}")
+    else:
+        print(f"Promemoria inviati: {report['sent']}, rifiutati: {report['refused']}, "
+              f"rinviati per errori temporanei: {report['deferred']}")
+    print(f"Completato in {report['elapsed_seconds']:.1f} s", file=sys.stderr)
+    return 0
+
+
+def tenants_command(args):
+    import database
+    from utils.tariff_impact import load_tariff
+
+    database.initialize_database()
+    if args.action == 'list':
+        for tenant in database.load_tenants():
+            tariff = "proprio" if tenant['tariff'] else "DM 55/2014"
+            print(f"{tenant['id']:>4}  {tenant['slug']:<20} {tenant['name']:<40} tariffario {tariff}")
+        return 0
+
+    if args.action == 'api-key':
+        import secrets
+
+        if not any(tenant['slug'] == args.slug for tenant in database.load_tenants()):
+            print(f"Studio '{args.slug}' inesistente", file=sys.stderr)
+            return 1
+        # La chiave non viene salvata: va aggiunta ad API_KEYS dell'API e consegnata al partner
+        print(f"{args.slug}:{secrets.token_urlsafe(32)}")
+        print("Aggiungi la voce ad API_KEYS (separata da virgole dalle altre) e riavvia l'API", file=sys.stderr)
+        return 0
+
+    if args.action == 'add':
+        branding = {key: getattr(args, key) for key in ('intestazione', 'recapiti', 'logo', 'logo_width_cm')
+                    if getattr(args, key) is not None}
+        tenant_id = database.save_tenant(args.slug.strip().lower(), args.name, branding)
+        print(f"Studio {args.slug} salvato (id {tenant_id})")
+    else:
+        tenant = next((tenant for tenant in database.load_tenants() if tenant['slug'] == args.slug), None)
+        if tenant is None:
+            print(f"Studio '{args.slug}' inesistente", file=sys.stderr)
+            return 1
+        tenant_id = tenant['id']
+
+    if args.tariff:
+        database.save_tariff(tenant_id, None if args.tariff == 'default' else load_tariff(args.tariff))
+        print(f"Tariffario dello studio {args.slug} aggiornato")
+    return 0
+
+
+def _month(value):
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Comandi di amministrazione del preventivatore")
+    parser.add_argument('--tenant', metavar='SLUG',
+                        help="Studio su cui opera il comando (default DEFAULT_TENANT)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export-quotes', help="Esporta tutti i preventivi in CSV o XLSX")
+    export_parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+    export_parser.add_argument('--output', required=True, help="File di destinazione ('-' per stdout)")
+    export_parser.add_argument('--chunk-size', type=int, default=5000,
+                               help="Righe lette dal database per ogni blocco")
+    export_parser.set_defaults(handler=export_quotes_command)
+
+    partitions_parser = subparsers.add_parser(
+        'partitions', help="Crea le partizioni mensili future e stacca quelle vecchie")
+    partitions_parser.add_argument('--months-ahead', type=int, default=None,
+                                   help="Mesi futuri da preparare (default PARTITION_MONTHS_AHEAD)")
+    partitions_parser.add_argument('--detach-before', type=_month, metavar='AAAA-MM',
+                                   help="Stacca i mesi precedenti a quello indicato")
+    partitions_parser.add_argument('--drop', action='store_true',
+                                   help="Elimina le partizioni staccate invece di conservarle come tabelle")
+    partitions_parser.set_defaults(handler=partitions_command)
+
+    archive_parser = subparsers.add_parser(
+        'archive-quotes', help="Sposta i preventivi vecchi dal database in file Parquet")
+    archive_parser.add_argument('--older-than-days', type=int, default=None,
+                                help="Età minima dei preventivi da archiviare (default ARCHIVE_AFTER_DAYS, 30)")
+    archive_parser.add_argument('--archive-dir', default=None,
+                                help="Cartella dell'archivio (default ARCHIVE_DIR, data/archive)")
+    archive_parser.add_argument('--chunk-size', type=int, default=5000,
+                                help="Righe lette dal database per ogni blocco")
+    archive_parser.set_defaults(handler=archive_quotes_command)
+
+    impact_parser = subparsers.add_parser(
+        'tariff-impact', help="Ricalcola i preventivi storici con un tariffario candidato")
+    impact_parser.add_argument('--tariff', required=True,
+                               help="File JSON con tariffe_base (e facoltativamente limiti_scaglioni)")
+    impact_parser.add_argument('--output', help="Salva il report completo in JSON")
+    impact_parser.add_argument('--chunk-size', type=int, default=50000,
+                               help="Preventivi ricalcolati per ogni blocco")
+    impact_parser.add_argument('--no-archive', action='store_true',
+                               help="Esclude i preventivi archiviati in Parquet")
+    impact_parser.set_defaults(handler=tariff_impact_command)
+
+    batch_parser = subparsers.add_parser(
+        'batch-quotes', help="Calcola i preventivi di un file CSV/XLSX e genera i PDF")
+    batch_parser.add_argument('--input', required=True,
+                              help="File CSV o XLSX con clienti, valore del bene e servizi (separati da ';')")
+    batch_parser.add_argument('--output-dir', required=True, help="Cartella dei PDF e del riepilogo")
+    batch_parser.add_argument('--summary', help="Percorso del riepilogo CSV (default OUTPUT_DIR/riepilogo.csv)")
+    batch_parser.add_argument('--persist', action='store_true', help="Salva i preventivi nel database")
+    batch_parser.add_argument('--no-pdf', action='store_true', help="Non genera i PDF")
+    batch_parser.add_argument('--workers', type=int, default=None,
+                              help="Processi per la generazione dei PDF (default: numero di core)")
+    batch_parser.add_argument('--chunk-size', type=int, default=500,
+                              help="Righe elaborate (e salvate) per ogni blocco")
+    batch_parser.set_defaults(handler=batch_quotes_command)
+
+    sync_parser = subparsers.add_parser(
+        'sync-services', help="Sincronizza il catalogo dei servizi con un file JSON")
+    sync_parser.add_argument('--json', default='data/services.json',
+                             help="Lista JSON di servizi con id, name, description, file_content")
+    sync_parser.set_defaults(handler=sync_services_command)
+
+    reminders_parser = subparsers.add_parser(
+        'quote-reminders', help="Invia i promemoria dei preventivi in scadenza (job giornaliero)")
+    reminders_parser.add_argument('--days-before', type=int, default=None,
+                                  help="Giorni di anticipo sulla scadenza (default REMINDER_DAYS_BEFORE, 7)")
+    reminders_parser.add_argument('--page-size', type=int, default=1000,
+                                  help="Preventivi letti e registrati per ogni blocco")
+    reminders_parser.add_argument('--limit', type=int, default=None,
+                                  help="Numero massimo di promemoria in questa esecuzione")
+    reminders_parser.add_argument('--dry-run', action='store_true',
+                                  help="Conta i preventivi in scadenza senza inviare nulla")
+    reminders_parser.set_defaults(handler=quote_reminders_command)
+
+    tenants_parser = subparsers.add_parser('tenants', help="Elenca, crea e configura gli studi")
+    tenants_actions = tenants_parser.add_subparsers(dest='action', required=True)
+    tenants_actions.add_parser('list', help="Elenca gli studi")
+    add_parser = tenants_actions.add_parser('add', help="Crea o aggiorna uno studio")
+    add_parser.add_argument('slug', help="Identificativo dello studio (TENANT_HOSTS, API_KEYS e --tenant)")
+    add_parser.add_argument('--name', required=True, help="Nome dello studio")
+    add_parser.add_argument('--intestazione', help="Intestazione dei PDF")
+    add_parser.add_argument('--recapiti', help="Recapiti sotto l'intestazione dei PDF")
+    add_parser.add_argument('--logo', help="Logo dei PDF (PNG, JPEG o SVG)")
+    add_parser.add_argument('--logo-width-cm', type=float, help="Larghezza del logo in centimetri")
+    add_parser.add_argument('--tariff', help="File JSON del tariffario (come per tariff-impact)")
+    tariff_parser = tenants_actions.add_parser('set-tariff', help="Imposta il tariffario di uno studio")
+    tariff_parser.add_argument('slug')
+    tariff_parser.add_argument('--tariff', required=True,
+                               help="File JSON del tariffario, o 'default' per il DM 55/2014")
+    key_parser = tenants_actions.add_parser('api-key', help="Genera una chiave API per un partner dello studio")
+    key_parser.add_argument('slug')
+    tenants_parser.set_defaults(handler=tenants_command)
+
+    args = parser.parse_args(argv)
+    if args.tenant:
+        import database
+        from utils import tenants
+
+        database.initialize_database()
+        try:
+            tenants.activate(tenants.resolve(args.tenant))
+        except tenants.UnknownTenant as e:
+            print(e, file=sys.stderr)
+            return 2
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
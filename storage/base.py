@@ -0,0 +1,367 @@
+import hashlib
+import json
+import zlib
+from decimal import ROUND_HALF_UP, Decimal
+
+# Studio a cui appartengono le righe create prima del supporto multi-studio
+# (e default di tenant_id in ogni tabella)
+DEFAULT_TENANT_ID = 1
+DEFAULT_TENANT_SLUG = 'default'
+
+
+class Storage:
+    """
+    Interfaccia comune dei backend di persistenza.
+
+    Ogni backend espone le stesse operazioni su servizi, preventivi e statistiche;
+    i dizionari restituiti hanno le stesse chiavi indipendentemente dal database.
+    Le operazioni su dati di uno studio ricevono il suo tenant_id come primo
+    argomento e non vedono (né modificano) le righe degli altri studi.
+    """
+
+    # Nome del dialetto SQL ('postgresql' o 'sqlite')
+    dialect = None
+
+    def connect(self):
+        """Open a new DB-API connection"""
+        raise NotImplementedError
+
+    def read_connect(self):
+        """Open a connection for read-only analytical queries (a replica, when the backend has one)"""
+        return self.connect()
+
+    def initialize(self):
+        """Create tables if they don't exist"""
+        raise NotImplementedError
+
+    def load_tenants(self):
+        """
+        Return every tenant as a dict with id, slug, name, branding (dict) and tariff
+        ({'limiti_scaglioni': [...], 'tariffe_base': [...]}, or None for the default tariff)
+        """
+        raise NotImplementedError
+
+    def save_tenant(self, slug, name, branding=None):
+        """Insert or update (by slug) a tenant and return its id"""
+        raise NotImplementedError
+
+    def save_tariff(self, tenant_id, tariff):
+        """Replace the tariff brackets of a tenant (None: back to the default tariff)"""
+        raise NotImplementedError
+
+    def load_services(self, tenant_id):
+        """Return all services of a tenant ordered by name"""
+        raise NotImplementedError
+
+    def save_service(self, tenant_id, name, description, file_content=None):
+        """Insert a service and return its id"""
+        raise NotImplementedError
+
+    def delete_service(self, tenant_id, service_id):
+        """Delete a service and its quote references"""
+        raise NotImplementedError
+
+    def save_quote(self, tenant_id, client_data, selected_services, fees):
+        """Insert client, quote and quote-service links in one transaction; return the quote id"""
+        raise NotImplementedError
+
+    def save_quotes(self, tenant_id, quotes):
+        """
+        Insert many (client_data, selected_services, fees) quotes in one transaction;
+        return the quote ids in input order
+        """
+        return [self.save_quote(tenant_id, client_data, selected_services, fees)
+                for client_data, selected_services, fees in quotes]
+
+    def get_quote(self, tenant_id, quote_id):
+        """
+        Return one quote with client data and its services (id, name, description),
+        or None if it does not exist
+        """
+        raise NotImplementedError
+
+    def save_quote_pdfs(self, tenant_id, pdfs):
+        """
+        Store the rendered PDFs of many (quote_id, pdf bytes) pairs in one transaction:
+        each distinct PDF is written once (content-addressed, see pack_pdf) and linked
+        to its quote, replacing a previous link
+        """
+        raise NotImplementedError
+
+    def save_quote_pdf(self, tenant_id, quote_id, pdf_bytes):
+        """Store the rendered PDF of one quote"""
+        self.save_quote_pdfs(tenant_id, [(quote_id, pdf_bytes)])
+
+    def get_quote_pdf(self, tenant_id, quote_id):
+        """Return the stored PDF of a quote, or None if it was never stored"""
+        raise NotImplementedError
+
+    def quotes_with_pdf(self, tenant_id, quote_ids):
+        """Return the subset of quote_ids that have a stored PDF"""
+        raise NotImplementedError
+
+    def get_expiring_quotes(self, tenant_id, start, end, after=None, limit=1000):
+        """
+        Return up to limit quotes created in [start, end) with no recorded reminder, as
+        dicts with id, created_at, total_fee, nome, cognome and email, ordered by
+        (created_at, id) and following the (created_at, id) key `after` (keyset paging)
+        """
+        raise NotImplementedError
+
+    def record_reminders(self, tenant_id, reminders):
+        """Record (quote_id, email, status) expiry reminders; quotes already recorded are left as they are"""
+        raise NotImplementedError
+
+    def get_recent_quotes(self, tenant_id, limit=10):
+        """Return the most recent quotes with client data and service names"""
+        raise NotImplementedError
+
+    def search_quotes(self, tenant_id, text, page=1, page_size=20):
+        """
+        Return one page of quotes whose client (nome, cognome, email, codice_fiscale)
+        or requested services match text, most recent first, as
+        {'quotes': [...], 'page': n, 'page_size': n, 'has_more': bool}
+        """
+        raise NotImplementedError
+
+    def import_services(self, tenant_id, services):
+        """
+        Sync the services of a tenant (with explicit ids, unique within the tenant) from an
+        iterable of dictionaries: only rows whose content hash differs from the table are
+        written, in one statement and one transaction
+
+        Returns:
+            dict: 'inserted', 'updated' and 'unchanged' counts
+        """
+        raise NotImplementedError
+
+    def get_service_statistics(self, tenant_id):
+        """Return service counts, average values, monthly counts and totals"""
+        raise NotImplementedError
+
+    def iter_quotes_for_export(self, tenant_id, chunk_size=5000):
+        """
+        Yield every quote as a tuple in EXPORT_COLUMNS order, reading chunk_size rows
+        at a time so memory use does not depend on the number of quotes
+        """
+        raise NotImplementedError
+
+    def iter_quote_pricing(self, tenant_id, chunk_size=50000):
+        """
+        Yield (valore_bene as float, year, month, service ids) for every quote,
+        reading chunk_size rows at a time: the inputs needed to reprice it
+        """
+        raise NotImplementedError
+
+    def oldest_quote_date(self):
+        """Return the created_at of the oldest quote, or None when there are no quotes"""
+        raise NotImplementedError
+
+    def iter_quotes_for_archive(self, start, end, chunk_size=5000):
+        """
+        Yield the quotes of every tenant created in [start, end) as tuples in
+        ARCHIVE_COLUMNS order, reading chunk_size rows at a time
+        """
+        raise NotImplementedError
+
+    def purge_quotes(self, start, end, max_id):
+        """
+        Delete the quotes created in [start, end) with id <= max_id, their service links,
+        reminders and stored PDFs (blobs no longer linked to any quote included) and
+        the clients left without quotes, in one transaction
+        """
+        raise NotImplementedError
+
+    def ensure_partitions(self, since=None, months_ahead=None):
+        """
+        Create the monthly partitions of quotes from the month of `since` (default: the
+        current one) to months_ahead months ahead; return the names of the new partitions.
+        Backends without partitioning have nothing to do.
+        """
+        return []
+
+    def detach_partitions(self, before, drop=False):
+        """
+        Detach the monthly partitions that end on or before the month of `before`
+        (dropping them if drop is true) and return their names
+        """
+        raise NotImplementedError
+
+    def copy_rows(self, table, columns, rows):
+        """Bulk-load an iterable of tuples into table using the fastest path of the backend"""
+        raise NotImplementedError
+
+    def reset_sequences(self):
+        """Align id generators with the current maximum ids after explicit-id inserts"""
+        raise NotImplementedError
+
+
+# Colonne prodotte da iter_quotes_for_export
+EXPORT_COLUMNS = (
+    'quote_id', 'created_at', 'valore_bene', 'total_fee',
+    'nome', 'cognome', 'email', 'telefono', 'codice_fiscale', 'indirizzo', 'services'
+)
+
+
+# Colonne prodotte da iter_quotes_for_archive: dati del cliente denormalizzati
+# e servizi (id e nomi) come liste
+ARCHIVE_COLUMNS = (
+    'quote_id', 'created_at', 'valore_bene', 'total_fee', 'client_id',
+    'nome', 'cognome', 'email', 'telefono', 'codice_fiscale', 'indirizzo',
+    'service_ids', 'services', 'tenant_id'
+)
+
+
+# Separatore dei campi e segnaposto di NULL nell'hash del contenuto di un servizio
+HASH_FIELD_SEPARATOR = '\x1f'
+HASH_NULL_MARKER = '\x1e'
+
+
+def service_content_hash(name, description, file_content):
+    """
+    md5 (hex) of name, description and file_content, as the databases compute it
+    in import_services; used only to detect changed rows
+    """
+    text = HASH_FIELD_SEPARATOR.join(
+        HASH_NULL_MARKER if value is None else str(value) for value in (name, description, file_content)
+    )
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def diff_services(current, services):
+    """
+    Compare incoming services with the table, given as {id: content hash}
+
+    Returns:
+        tuple: (rows to write as (id, name, description, file_content) sorted by id,
+                {'inserted': n, 'updated': n, 'unchanged': n})
+    """
+    rows = {}
+    unchanged = set()
+    # A parità di id vale l'ultima occorrenza, come con le upsert una alla volta
+    for service in services:
+        row = (int(service['id']), service['name'], service['description'], service.get('file_content'))
+        if current.get(row[0]) == service_content_hash(*row[1:]):
+            rows.pop(row[0], None)
+            unchanged.add(row[0])
+        else:
+            rows[row[0]] = row
+            unchanged.discard(row[0])
+
+    inserted = sum(1 for service_id in rows if service_id not in current)
+    report = {'inserted': inserted, 'updated': len(rows) - inserted, 'unchanged': len(unchanged)}
+    return [rows[service_id] for service_id in sorted(rows)], report
+
+
+def money(value):
+    """
+    Amount rounded to cents as PostgreSQL stores it in NUMERIC(15, 2) (halves away
+    from zero), for backends that would otherwise keep every decimal
+    """
+    return float(Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+
+# Codifica dei PDF archiviati in pdf_blobs
+PDF_ENCODING_ZLIB = 'zlib'
+PDF_ENCODING_IDENTITY = 'identity'
+
+
+def pack_pdf(pdf_bytes):
+    """
+    Content address and stored form of a PDF
+
+    Returns:
+        tuple: (sha256 hex of the PDF, encoding, stored bytes); the PDF streams are
+               already compressed, zlib on the whole file is kept only when it saves space
+    """
+    pdf_bytes = bytes(pdf_bytes)
+    packed = zlib.compress(pdf_bytes, 9)
+    if len(packed) < len(pdf_bytes):
+        return hashlib.sha256(pdf_bytes).hexdigest(), PDF_ENCODING_ZLIB, packed
+    return hashlib.sha256(pdf_bytes).hexdigest(), PDF_ENCODING_IDENTITY, pdf_bytes
+
+
+def unpack_pdf(encoding, data):
+    """Original PDF bytes from a pdf_blobs row"""
+    data = bytes(data)
+    if encoding == PDF_ENCODING_ZLIB:
+        return zlib.decompress(data)
+    if encoding == PDF_ENCODING_IDENTITY:
+        return data
+    raise ValueError(f"Codifica del PDF archiviato non riconosciuta: {encoding}")
+
+
+def pack_pdfs(pdfs):
+    """
+    Split (quote_id, pdf bytes) pairs into {hash: (hash, encoding, size, stored bytes)}
+    and {quote_id: hash}; the last PDF of a quote wins
+    """
+    blobs = {}
+    links = {}
+    for quote_id, pdf_bytes in pdfs:
+        pdf_hash, encoding, data = pack_pdf(pdf_bytes)
+        blobs.setdefault(pdf_hash, (pdf_hash, encoding, len(pdf_bytes), data))
+        links[quote_id] = pdf_hash
+    return blobs, links
+
+
+def tariff_rows(tenant_id, tariff):
+    """(tenant_id, scaglione, limite, tariffa_base) rows of a tariff; the last bracket has no limit"""
+    limits = list(tariff['limiti_scaglioni']) + [None]
+    return [(tenant_id, scaglione, limit, fee)
+            for scaglione, (limit, fee) in enumerate(zip(limits, tariff['tariffe_base']), start=1)]
+
+
+def build_tenants(tenant_rows, tariff_rows):
+    """
+    Tenant dicts (see Storage.load_tenants) from (id, slug, name, branding JSON) rows and
+    (tenant_id, limite, tariffa_base) rows ordered by tenant and bracket
+    """
+    tariffs = {}
+    for tenant_id, limit, fee in tariff_rows:
+        tariff = tariffs.setdefault(tenant_id, {'limiti_scaglioni': [], 'tariffe_base': []})
+        if limit is not None:
+            tariff['limiti_scaglioni'].append(float(limit))
+        tariff['tariffe_base'].append(float(fee))
+    return [
+        {'id': tenant_id, 'slug': slug, 'name': name,
+         'branding': (json.loads(branding) if isinstance(branding, str) else branding) or {},
+         'tariff': tariffs.get(tenant_id)}
+        for tenant_id, slug, name, branding in tenant_rows
+    ]
+
+
+def search_page(quotes, page, page_size):
+    """Build the search_quotes result from page_size + 1 fetched rows"""
+    return {
+        'quotes': quotes[:page_size],
+        'page': page,
+        'page_size': page_size,
+        'has_more': len(quotes) > page_size
+    }
+
+
+def escape_like(text):
+    """Escape LIKE wildcards in user input (use with ESCAPE '\\')"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def empty_statistics():
+    """Statistics returned when the database is empty or unavailable"""
+    return {
+        'service_counts': [],
+        'service_values': [],
+        'monthly_counts': [],
+        'total_stats': {'total_quotes': 0, 'avg_value': 0, 'avg_fee': 0}
+    }
+
+
+def build_total_stats(row):
+    """Normalize the (total_quotes, avg_value, avg_fee) row of the totals query"""
+    if not row:
+        return empty_statistics()['total_stats']
+    return {
+        'total_quotes': row[0],
+        'avg_value': row[1] or 0,
+        'avg_fee': row[2] or 0
+    }
@@ -0,0 +1,1487 @@
+import csv
+import io
+import logging
+import os
+import re
+import select
+import threading
+import time
+from datetime import date, datetime
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.extras
+
+from storage.base import (
+    DEFAULT_TENANT_ID, DEFAULT_TENANT_SLUG, HASH_FIELD_SEPARATOR, HASH_NULL_MARKER, Storage, build_tenants,
+    build_total_stats, diff_services, empty_statistics, escape_like, pack_pdfs, search_page, tariff_rows,
+    unpack_pdf
+)
+from utils import metrics
+
+logger = logging.getLogger("avvocato.storage")
+
+# Ritardo di replica in secondi (0 se il server non è in recovery o ha già applicato tutto il WAL ricevuto)
+REPLICA_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class _TimedExecuteMixin:
+    """Record the duration of every statement executed through the cursor"""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            metrics.observe_sql(query, time.perf_counter() - start)
+
+
+class TimedCursor(_TimedExecuteMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class TimedDictCursor(_TimedExecuteMixin, psycopg2.extras.DictCursor):
+    pass
+
+
+class _CsvStream(io.RawIOBase):
+    """Read-only file object producing CSV lines from an iterable of rows, for COPY FROM STDIN"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = b""
+        self._text = io.StringIO()
+        self._writer = csv.writer(self._text, lineterminator="\n")
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while len(self._buffer) < len(target):
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                break
+            self._writer.writerow(["\\N" if value is None else value for value in row])
+            self._buffer += self._text.getvalue().encode()
+            self._text.seek(0)
+            self._text.truncate()
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+# Istruzioni eseguite a ogni invio di preventivo o visualizzazione dell'elenco:
+# vengono preparate una volta per connessione del pool ed eseguite per nome.
+# Le colonne sono sempre elencate: con SELECT * un ALTER TABLE cambierebbe il
+# risultato del piano già preparato.
+# nome -> (tipi dei parametri, SQL con segnaposto $n)
+PREPARED_STATEMENTS = {
+    'list_services': ("(integer)", """
+        SELECT id, name, description, file_content, created_at, tenant_id
+        FROM services WHERE tenant_id = $1 ORDER BY name
+    """),
+    'insert_client': ("(integer, varchar, varchar, varchar, varchar, varchar, text)", """
+        INSERT INTO clients (tenant_id, nome, cognome, email, telefono, codice_fiscale, indirizzo)
+        VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id
+    """),
+    'insert_quote': ("(integer, integer, numeric, numeric)", """
+        INSERT INTO quotes (tenant_id, client_id, valore_bene, total_fee)
+        VALUES ($1, $2, $3, $4) RETURNING id, created_at
+    """),
+    'insert_quote_service': ("(integer, integer, timestamp, integer)", """
+        INSERT INTO quote_services (tenant_id, quote_id, quote_created_at, service_id)
+        VALUES ($1, $2, $3, $4)
+    """),
+}
+
+
+# Testo del cliente indicizzato per la ricerca: le query devono usare la stessa
+# espressione degli indici perché il planner possa sceglierli
+CLIENT_SEARCH_TEXT = "(nome || ' ' || cognome || ' ' || email || ' ' || codice_fiscale)"
+
+# tsquery con ogni parola cercata come prefisso ('ross' trova 'rossi'), tokenizzata
+# dallo stesso parser di search_vector; i lessemi vengono quotati per to_tsquery
+PREFIX_TSQUERY = r"""
+to_tsquery('simple', (
+    SELECT string_agg('''' || replace(replace(lexeme, '\', '\\'), '''', '''''') || ''':*', ' & ')
+    FROM unnest(to_tsvector('simple', %(text)s))
+))
+"""
+
+
+# Partizioni mensili create da _create_partitions (quotes_p2025_01, quote_services_p2025_01, ...)
+PARTITION_NAME = re.compile(r"quotes_p(\d{4})_(\d{2})")
+
+
+def _add_months(month, months):
+    """First day of the month `months` after the given one"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def plain_sql(name):
+    """SQL of a registered statement with psycopg2 placeholders, for non-prepared execution"""
+    return re.sub(r"\$\d+", "%s", PREPARED_STATEMENTS[name][1])
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    Connection that returns to its pool on close() instead of disconnecting,
+    and remembers which registered statements it has already prepared.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.prepared = set()
+        self.released_at = None
+        # True quando le istruzioni preparate non sono più affidabili: la connessione non torna nel pool
+        self.stale = False
+
+    def close(self):
+        if self.pool is not None and not self.closed:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def disconnect(self):
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Thread-safe LIFO cache of idle connections.
+
+    Non limita le connessioni aperte contemporaneamente: ne conserva al massimo
+    max_idle inattive e chiude le eccedenti. Una connessione non restituita
+    (ad esempio dopo un'eccezione) viene chiusa dal garbage collector. Prima di
+    consegnare una connessione inattiva ne verifica lo stato: se il server l'ha
+    chiusa (riavvio, timeout) il socket risulta leggibile e la connessione viene
+    provata con SELECT 1, come quelle inattive da più di ping_after secondi;
+    quelle morte vengono scartate.
+    """
+
+    def __init__(self, connect, max_idle, ping_after=30.0):
+        self._connect = connect
+        self._max_idle = max_idle
+        self._ping_after = ping_after
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _alive(self, conn):
+        if conn.closed:
+            return False
+        try:
+            readable, _, _ = select.select([conn], [], [], 0)
+            if readable or time.monotonic() - conn.released_at > self._ping_after:
+                cur = conn.cursor()
+                cur.execute("SELECT 1")
+                cur.fetchone()
+                cur.close()
+                conn.rollback()
+        except (psycopg2.Error, OSError, ValueError):
+            return False
+        return True
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+                break
+            if self._alive(conn):
+                break
+            logger.info("Connessione del pool non più valida (server riavviato?): scartata")
+            conn.disconnect()
+        conn.pool = self
+        return conn
+
+    def release(self, conn):
+        try:
+            status = conn.info.transaction_status
+            if status in (psycopg2.extensions.TRANSACTION_STATUS_INTRANS,
+                          psycopg2.extensions.TRANSACTION_STATUS_INERROR):
+                conn.rollback()
+                status = conn.info.transaction_status
+            reusable = status == psycopg2.extensions.TRANSACTION_STATUS_IDLE and not conn.stale
+        except psycopg2.Error:
+            reusable = False
+
+        with self._lock:
+            if reusable and len(self._idle) < self._max_idle:
+                conn.released_at = time.monotonic()
+                self._idle.append(conn)
+                return
+        conn.disconnect()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.disconnect()
+
+
+class PostgresStorage(Storage):
+    """
+    PostgreSQL backend.
+
+    Se DATABASE_REPLICA_URL è impostato, le query analitiche e di amministrazione
+    vengono eseguite sulla replica finché il suo ritardo resta entro
+    REPLICA_MAX_STALENESS_SECONDS; altrimenti (o se la replica non risponde)
+    si ripiega sul primario. L'esito del controllo viene riutilizzato per
+    REPLICA_CHECK_INTERVAL secondi.
+
+    Le connessioni provengono da un pool per processo (al massimo DB_POOL_SIZE
+    connessioni inattive, default 10): conn.close() restituisce la connessione
+    al pool. Una connessione inattiva da più di DB_POOL_PING_AFTER secondi
+    (default 30), o chiusa dal server, viene verificata prima dell'uso. Le
+    istruzioni di PREPARED_STATEMENTS vengono preparate una volta per
+    connessione; impostare DB_PREPARED_STATEMENTS=0 dietro un pooler in
+    modalità transaction (es. PgBouncer). Se un ALTER TABLE invalida un piano
+    preparato ("cached plan must not change result type") le istruzioni della
+    connessione vengono rifatte e l'esecuzione ripetuta, se era la prima della
+    transazione; altrimenti l'errore arriva al chiamante e la connessione non
+    torna nel pool.
+
+    quotes e quote_services sono partizionate per mese di created_at: la
+    partizione del mese corrente e delle PARTITION_MONTHS_AHEAD (default 3)
+    successive viene creata da initialize, una volta al mese per processo;
+    quelle di default raccolgono le righe fuori dai mesi esistenti.
+
+    Ogni tabella ha una colonna tenant_id (lo studio) e gli indici usati dalle
+    query di uno studio iniziano con tenant_id; services ha chiave (tenant_id, id).
+    Un database creato prima del supporto multi-studio viene convertito da
+    initialize (righe esistenti allo studio DEFAULT_TENANT_ID), una volta.
+    """
+
+    dialect = "postgresql"
+
+    # Tabelle con chiave SERIAL da riallineare dopo inserimenti con id espliciti
+    SERIAL_TABLES = ("tenants", "services", "clients", "quotes")
+
+    def __init__(self, url):
+        self.url = url
+        self.sslmode = os.environ.get("DATABASE_SSLMODE", "require")
+        self.replica_url = os.environ.get("DATABASE_REPLICA_URL")
+        self.replica_max_staleness = float(os.environ.get("REPLICA_MAX_STALENESS_SECONDS", "30"))
+        self.replica_check_interval = float(os.environ.get("REPLICA_CHECK_INTERVAL", "5"))
+        self._replica_lock = threading.Lock()
+        self._replica_usable_until = 0.0
+        self._replica_retry_at = 0.0
+        self.use_prepared = os.environ.get("DB_PREPARED_STATEMENTS", "1") != "0"
+        pool_size = int(os.environ.get("DB_POOL_SIZE", "10"))
+        ping_after = float(os.environ.get("DB_POOL_PING_AFTER", "30"))
+        self.pool = ConnectionPool(lambda: self._open(self.url), pool_size, ping_after)
+        self.replica_pool = ConnectionPool(lambda: self._open(self.replica_url, readonly=True), pool_size,
+                                           ping_after)
+        self._trigram_search = None
+        self.partition_months_ahead = int(os.environ.get("PARTITION_MONTHS_AHEAD", "3"))
+        self._partitions_month = None
+        self._tenant_columns_ready = False
+
+    def _open(self, url, readonly=False):
+        conn = psycopg2.connect(
+            url,
+            sslmode=self.sslmode,
+            cursor_factory=TimedCursor,
+            connection_factory=PooledConnection,
+            connect_timeout=int(os.environ.get("DATABASE_CONNECT_TIMEOUT", "10"))
+        )
+        if readonly:
+            conn.set_session(readonly=True)
+        return conn
+
+    def connect(self):
+        """Take a connection to the PostgreSQL database from the pool (close() gives it back)"""
+        return self.pool.acquire()
+
+    def execute_prepared(self, cur, name, params=()):
+        """Execute a statement of PREPARED_STATEMENTS by name, preparing it on first use per connection"""
+        if not self.use_prepared:
+            cur.execute(plain_sql(name), params)
+            return
+
+        conn = cur.connection
+        first_in_transaction = conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        try:
+            self._execute_named(cur, name, params)
+        except psycopg2.errors.FeatureNotSupported as e:
+            if "cached plan must not change result type" not in str(e):
+                raise
+            if not first_in_transaction:
+                # La transazione del chiamante è già annullata: niente ripetizione
+                conn.stale = True
+                raise
+            logger.info("Piano preparato di %s invalidato da una modifica dello schema: istruzioni rifatte", name)
+            conn.rollback()
+            cur.execute("DEALLOCATE ALL")
+            conn.prepared.clear()
+            self._execute_named(cur, name, params)
+
+    @staticmethod
+    def _execute_named(cur, name, params):
+        conn = cur.connection
+        if name not in conn.prepared:
+            types, sql = PREPARED_STATEMENTS[name]
+            cur.execute(f"PREPARE {name} {types} AS {sql}")
+            conn.prepared.add(name)
+
+        if params:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+        else:
+            cur.execute(f"EXECUTE {name}")
+
+    def read_connect(self):
+        """Connection for read-only analytical queries: the replica when fresh enough, else the primary"""
+        if not self.replica_url:
+            return self.connect()
+
+        now = time.monotonic()
+        with self._replica_lock:
+            if now < self._replica_retry_at:
+                return self.connect()
+            needs_check = now >= self._replica_usable_until
+
+        try:
+            conn = self.replica_pool.acquire()
+        except psycopg2.Error as e:
+            self._mark_replica_unusable(f"connessione fallita: {e}")
+            return self.connect()
+
+        if needs_check:
+            try:
+                cur = conn.cursor()
+                cur.execute(REPLICA_LAG_QUERY)
+                lag = float(cur.fetchone()[0])
+                cur.close()
+                conn.rollback()
+            except psycopg2.Error as e:
+                conn.close()
+                self._mark_replica_unusable(f"controllo del ritardo fallito: {e}")
+                return self.connect()
+
+            if lag > self.replica_max_staleness:
+                conn.close()
+                self._mark_replica_unusable(f"ritardo di {lag:.1f}s oltre il limite")
+                return self.connect()
+
+            with self._replica_lock:
+                self._replica_usable_until = time.monotonic() + self.replica_check_interval
+
+        return conn
+
+    def _mark_replica_unusable(self, reason):
+        logger.warning("Replica di lettura non utilizzata (%s): uso il primario", reason)
+        with self._replica_lock:
+            self._replica_usable_until = 0.0
+            self._replica_retry_at = time.monotonic() + self.replica_check_interval
+
+    def initialize(self):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # Studi serviti dall'istanza e tariffari propri (senza righe vale quello di utils.fee_calculator)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS tenants (
+            id SERIAL PRIMARY KEY,
+            slug VARCHAR(64) NOT NULL UNIQUE,
+            name VARCHAR(255) NOT NULL,
+            branding JSONB NOT NULL DEFAULT '{}',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+        cur.execute("""
+        INSERT INTO tenants (id, slug, name) VALUES (%s, %s, 'Studio legale')
+        ON CONFLICT DO NOTHING
+        RETURNING id
+        """, (DEFAULT_TENANT_ID, DEFAULT_TENANT_SLUG))
+        if cur.fetchone() is not None:
+            cur.execute("SELECT setval('tenants_id_seq', (SELECT MAX(id) FROM tenants))")
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS tariffs (
+            tenant_id INTEGER NOT NULL REFERENCES tenants(id),
+            scaglione INTEGER NOT NULL,
+            limite NUMERIC(15, 2),
+            tariffa_base NUMERIC(15, 2) NOT NULL,
+            PRIMARY KEY (tenant_id, scaglione)
+        );
+        """)
+
+        # Create services table
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS services (
+            id SERIAL,
+            name VARCHAR(255) NOT NULL,
+            description TEXT NOT NULL,
+            file_content TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            tenant_id INTEGER NOT NULL DEFAULT {DEFAULT_TENANT_ID} REFERENCES tenants(id),
+            PRIMARY KEY (tenant_id, id)
+        );
+        """)
+
+        # Create clients table
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS clients (
+            id SERIAL PRIMARY KEY,
+            nome VARCHAR(255) NOT NULL,
+            cognome VARCHAR(255) NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            telefono VARCHAR(100),
+            codice_fiscale VARCHAR(16) NOT NULL,
+            indirizzo TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            tenant_id INTEGER NOT NULL DEFAULT {DEFAULT_TENANT_ID} REFERENCES tenants(id)
+        );
+        """)
+        self._add_tenant_columns(cur, ("services", "clients"))
+
+        # quotes e quote_services sono partizionate per mese di created_at
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('quotes')")
+        row = cur.fetchone()
+        if row is None or row[0] != 'p':
+            # Un solo processo crea (o converte) le tabelle; gli altri attendono e ricontrollano
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('avvocato.quotes_schema'))")
+            cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('quotes')")
+            row = cur.fetchone()
+            if row is None:
+                self._create_quote_tables(cur)
+            elif row[0] != 'p':
+                self._partition_existing_quotes(cur)
+
+        current_month = self._current_month(cur)
+        if self._partitions_month != current_month:
+            self._create_partitions(cur, current_month, self.partition_months_ahead)
+            self._partitions_month = current_month
+
+        self._create_pdf_tables(cur)
+        self._create_reminder_table(cur)
+        self._add_tenant_columns(cur, ("quotes", "quote_services", "quote_pdfs", "quote_reminders"))
+
+        # Indici guidati da tenant_id: ogni query di uno studio legge solo le sue righe
+        cur.execute("CREATE INDEX IF NOT EXISTS quotes_tenant_created_at_idx ON quotes (tenant_id, created_at)")
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS quote_services_tenant_service_idx ON quote_services (tenant_id, service_id)
+        """)
+        # Archiviazione per intervallo di date su tutti gli studi
+        cur.execute("CREATE INDEX IF NOT EXISTS quotes_created_at_idx ON quotes (created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS quotes_client_id_idx ON quotes (client_id)")
+        self._create_search_indexes(cur)
+
+        conn.commit()
+        cur.close()
+        conn.close()
+        self._tenant_columns_ready = True
+
+    def _add_tenant_columns(self, cur, tables):
+        """
+        Add tenant_id to tables created before multi-tenancy: the existing rows belong
+        to the default tenant. services gets the (tenant_id, id) key, which the
+        references from quote_services follow. Checked once per process.
+        """
+        if self._tenant_columns_ready:
+            return
+        cur.execute("""
+        SELECT t FROM unnest(%s::text[]) t
+        WHERE NOT EXISTS (
+            SELECT 1 FROM information_schema.columns c
+            WHERE c.table_schema = current_schema() AND c.table_name = t AND c.column_name = 'tenant_id'
+        )
+        """, (list(tables),))
+        if not cur.fetchall():
+            return
+
+        # Un solo processo converte le tabelle; gli altri attendono e ricontrollano
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('avvocato.tenant_schema'))")
+        for table in tables:
+            cur.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = %s AND column_name = 'tenant_id'
+            )
+            """, (table,))
+            if cur.fetchone()[0]:
+                continue
+
+            logger.warning("Aggiunta di tenant_id a %s (righe esistenti allo studio %s)", table, DEFAULT_TENANT_ID)
+            # Valore costante: aggiunta senza riscrivere la tabella
+            references = "" if table in ("quote_pdfs", "quote_reminders") else " REFERENCES tenants(id)"
+            cur.execute(f"""
+            ALTER TABLE {table} ADD COLUMN tenant_id INTEGER NOT NULL DEFAULT {DEFAULT_TENANT_ID}{references}
+            """)
+            if table == "services":
+                # I riferimenti a services(id) vanno tolti prima di cambiarne la chiave
+                cur.execute("""
+                SELECT conrelid::regclass::text, conname FROM pg_constraint
+                WHERE confrelid = 'services'::regclass AND contype = 'f' AND conparentid = 0
+                """)
+                for referencing, constraint in cur.fetchall():
+                    cur.execute(f'ALTER TABLE {referencing} DROP CONSTRAINT "{constraint}"')
+                cur.execute("ALTER TABLE services DROP CONSTRAINT services_pkey")
+                cur.execute("ALTER TABLE services ADD PRIMARY KEY (tenant_id, id)")
+            elif table == "quote_services":
+                cur.execute("DROP INDEX IF EXISTS quote_services_service_id_idx")
+                cur.execute("""
+                ALTER TABLE quote_services
+                ADD FOREIGN KEY (tenant_id, service_id) REFERENCES services (tenant_id, id)
+                """)
+
+    def _create_quote_tables(self, cur):
+        """Create quotes and quote_services as tables partitioned by month, with default partitions"""
+        # Sequenza esplicita (invece di SERIAL) per poterla riassegnare durante la conversione
+        cur.execute("CREATE SEQUENCE IF NOT EXISTS quotes_id_seq AS integer")
+        cur.execute(f"""
+        CREATE TABLE quotes (
+            id INTEGER NOT NULL DEFAULT nextval('quotes_id_seq'),
+            client_id INTEGER REFERENCES clients(id),
+            valore_bene NUMERIC(15, 2) NOT NULL,
+            total_fee NUMERIC(15, 2) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            tenant_id INTEGER NOT NULL DEFAULT {DEFAULT_TENANT_ID} REFERENCES tenants(id),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        """)
+        cur.execute("ALTER SEQUENCE quotes_id_seq OWNED BY quotes.id")
+        cur.execute("CREATE TABLE quotes_default PARTITION OF quotes DEFAULT")
+
+        # La data del preventivo è ripetuta nel collegamento per partizionarlo allo stesso modo
+        cur.execute(f"""
+        CREATE TABLE quote_services (
+            quote_id INTEGER NOT NULL,
+            quote_created_at TIMESTAMP NOT NULL,
+            service_id INTEGER NOT NULL,
+            tenant_id INTEGER NOT NULL DEFAULT {DEFAULT_TENANT_ID},
+            PRIMARY KEY (quote_id, quote_created_at, service_id),
+            FOREIGN KEY (quote_id, quote_created_at) REFERENCES quotes (id, created_at),
+            FOREIGN KEY (tenant_id, service_id) REFERENCES services (tenant_id, id)
+        ) PARTITION BY RANGE (quote_created_at);
+        """)
+        cur.execute("CREATE TABLE quote_services_default PARTITION OF quote_services DEFAULT")
+
+    def _create_pdf_tables(self, cur):
+        """Content-addressed PDF blobs and their links to quotes"""
+        cur.execute("SELECT to_regclass('pdf_blobs') IS NULL")
+        if cur.fetchone()[0]:
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS pdf_blobs (
+                hash CHAR(64) PRIMARY KEY,
+                encoding VARCHAR(16) NOT NULL,
+                size INTEGER NOT NULL,
+                data BYTEA NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """)
+            # I blob sono già compressi (pack_pdf): TOAST fuori riga senza ricomprimerli
+            cur.execute("ALTER TABLE pdf_blobs ALTER COLUMN data SET STORAGE EXTERNAL")
+
+        # Nessuna chiave esterna verso quotes: la sua chiave primaria comprende created_at (partizioni)
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS quote_pdfs (
+            quote_id INTEGER PRIMARY KEY,
+            pdf_hash CHAR(64) NOT NULL REFERENCES pdf_blobs(hash),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            tenant_id INTEGER NOT NULL DEFAULT {DEFAULT_TENANT_ID}
+        );
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS quote_pdfs_pdf_hash_idx ON quote_pdfs (pdf_hash)")
+
+    def _create_reminder_table(self, cur):
+        """Expiry reminders sent (or refused by the mail server), one per quote"""
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS quote_reminders (
+            quote_id INTEGER PRIMARY KEY,
+            email VARCHAR(255) NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            tenant_id INTEGER NOT NULL DEFAULT {DEFAULT_TENANT_ID}
+        );
+        """)
+
+    def _partition_existing_quotes(self, cur):
+        """Convert unpartitioned quotes and quote_services tables, copying their rows"""
+        logger.warning("Conversione di quotes e quote_services in tabelle partizionate per mese")
+        cur.execute("LOCK TABLE quotes, quote_services IN ACCESS EXCLUSIVE MODE")
+        cur.execute("ALTER SEQUENCE quotes_id_seq OWNED BY NONE")
+        cur.execute("ALTER TABLE quote_services RENAME TO quote_services_unpartitioned")
+        cur.execute("ALTER TABLE quotes RENAME TO quotes_unpartitioned")
+        for index in ("quotes_pkey", "quotes_created_at_idx", "quotes_client_id_idx",
+                      "quote_services_pkey", "quote_services_service_id_idx"):
+            cur.execute(f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_unpartitioned")
+
+        self._create_quote_tables(cur)
+        cur.execute("SELECT date_trunc('month', MIN(created_at))::date FROM quotes_unpartitioned")
+        first_month = cur.fetchone()[0] or self._current_month(cur)
+        self._create_partitions(cur, first_month, self.partition_months_ahead)
+
+        cur.execute("""
+        INSERT INTO quotes (id, client_id, valore_bene, total_fee, created_at)
+        SELECT id, client_id, valore_bene, total_fee, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM quotes_unpartitioned
+        """)
+        cur.execute("""
+        INSERT INTO quote_services (quote_id, quote_created_at, service_id)
+        SELECT qs.quote_id, q.created_at, qs.service_id
+        FROM quote_services_unpartitioned qs
+        JOIN quotes q ON q.id = qs.quote_id
+        """)
+        cur.execute("DROP TABLE quote_services_unpartitioned, quotes_unpartitioned")
+
+    @staticmethod
+    def _current_month(cur):
+        # Il mese del server, lo stesso usato da DEFAULT CURRENT_TIMESTAMP
+        cur.execute("SELECT date_trunc('month', LOCALTIMESTAMP)::date")
+        return cur.fetchone()[0]
+
+    def _create_partitions(self, cur, first_month, months_ahead):
+        """Create the missing monthly partitions from first_month to months_ahead after the current month"""
+        last_month = _add_months(self._current_month(cur), months_ahead)
+        created = []
+        month = date(first_month.year, first_month.month, 1)
+        while month <= last_month:
+            suffix = f"p{month.year}_{month.month:02d}"
+            cur.execute("SELECT to_regclass(%s), to_regclass(%s)", (f"quotes_{suffix}", f"quote_services_{suffix}"))
+            if None not in cur.fetchone():
+                month = _add_months(month, 1)
+                continue
+
+            bounds = f"FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+            # Le righe del mese già finite nella partizione di default impedirebbero la creazione
+            cur.execute("""
+            SELECT EXISTS (SELECT 1 FROM quotes_default WHERE created_at >= %s AND created_at < %s)
+            """, (month, _add_months(month, 1)))
+            if cur.fetchone()[0]:
+                logger.warning("Partizione %s non creata: quotes_default contiene già righe del mese", suffix)
+            else:
+                cur.execute(f"CREATE TABLE IF NOT EXISTS quotes_{suffix} PARTITION OF quotes FOR VALUES {bounds}")
+                cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS quote_services_{suffix} PARTITION OF quote_services FOR VALUES {bounds}
+                """)
+                created.append(f"quotes_{suffix}")
+            month = _add_months(month, 1)
+        return created
+
+    def ensure_partitions(self, since=None, months_ahead=None):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        first_month = since or self._current_month(cur)
+        created = self._create_partitions(
+            cur, first_month, self.partition_months_ahead if months_ahead is None else months_ahead
+        )
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return created
+
+    def detach_partitions(self, before, drop=False):
+        cutoff = date(before.year, before.month, 1)
+
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'quotes'::regclass
+        ORDER BY c.relname
+        """)
+        detached = []
+        for (name,) in cur.fetchall():
+            match = PARTITION_NAME.fullmatch(name)
+            if not match:
+                continue
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            if _add_months(month, 1) > cutoff:
+                continue
+
+            self._detach_month(cur, f"p{match.group(1)}_{match.group(2)}", drop)
+            detached.append(name)
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return detached
+
+    @staticmethod
+    def _detach_month(cur, suffix, drop):
+        """Detach (and optionally drop) the quotes and quote_services partitions of one month"""
+        links = f"quote_services_{suffix}"
+        cur.execute("SELECT to_regclass(%s)", (links,))
+        if cur.fetchone()[0] is not None:
+            cur.execute(f"ALTER TABLE quote_services DETACH PARTITION {links}")
+            # Il vincolo verso quotes resta sulla tabella staccata e bloccherebbe il distacco del mese
+            cur.execute("""
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'f' AND confrelid = 'quotes'::regclass
+            """, (links,))
+            for (constraint,) in cur.fetchall():
+                cur.execute(f'ALTER TABLE {links} DROP CONSTRAINT "{constraint}"')
+            if drop:
+                cur.execute(f"DROP TABLE {links}")
+
+        cur.execute(f"ALTER TABLE quotes DETACH PARTITION quotes_{suffix}")
+        if drop:
+            cur.execute(f"DROP TABLE quotes_{suffix}")
+
+    def _create_search_indexes(self, cur):
+        """
+        Full-text column and GIN index on clients, plus trigram indexes when pg_trgm
+        can be enabled. Skipped once the indexes exist, since initialize runs on every rerun.
+        """
+        cur.execute("SELECT to_regclass('clients_search_idx'), to_regclass('clients_search_trgm_idx')")
+        fulltext_index, trigram_index = cur.fetchone()
+
+        if fulltext_index is None:
+            # Colonna generata: PostgreSQL la aggiorna a ogni INSERT/UPDATE del cliente
+            cur.execute(f"""
+            ALTER TABLE clients ADD COLUMN IF NOT EXISTS search_vector tsvector
+                GENERATED ALWAYS AS (to_tsvector('simple', {CLIENT_SEARCH_TEXT})) STORED
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS clients_search_idx ON clients USING gin (search_vector)")
+
+        # Un tentativo fallito non viene ripetuto a ogni rerun dello stesso processo
+        if trigram_index is None and self._trigram_search is not False:
+            cur.execute("SAVEPOINT trgm")
+            try:
+                cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            except psycopg2.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT trgm")
+                logger.warning("pg_trgm non disponibile, la ricerca userà solo i prefissi delle parole: %s",
+                               str(e).splitlines()[0])
+                self._trigram_search = False
+                return
+            cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS clients_search_trgm_idx
+            ON clients USING gin ({CLIENT_SEARCH_TEXT} gin_trgm_ops)
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS services_name_trgm_idx ON services USING gin (name gin_trgm_ops)")
+            self._trigram_search = True
+
+    def _has_trigram_search(self):
+        """Whether the trigram indexes exist (checked once per process)"""
+        if self._trigram_search is None:
+            conn = self.connect()
+            cur = conn.cursor()
+            cur.execute("SELECT to_regclass('clients_search_trgm_idx') IS NOT NULL")
+            self._trigram_search = cur.fetchone()[0]
+            cur.close()
+            conn.close()
+        return self._trigram_search
+
+    def load_tenants(self):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("SELECT id, slug, name, branding FROM tenants ORDER BY id")
+        tenant_rows = cur.fetchall()
+        cur.execute("SELECT tenant_id, limite, tariffa_base FROM tariffs ORDER BY tenant_id, scaglione")
+        tenants = build_tenants(tenant_rows, cur.fetchall())
+
+        cur.close()
+        conn.close()
+
+        return tenants
+
+    def save_tenant(self, slug, name, branding=None):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("""
+        INSERT INTO tenants (slug, name, branding)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (slug) DO UPDATE SET name = EXCLUDED.name, branding = EXCLUDED.branding
+        RETURNING id
+        """, (slug, name, psycopg2.extras.Json(branding or {})))
+        tenant_id = cur.fetchone()[0]
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return tenant_id
+
+    def save_tariff(self, tenant_id, tariff):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("DELETE FROM tariffs WHERE tenant_id = %s", (tenant_id,))
+        if tariff is not None:
+            psycopg2.extras.execute_values(cur, """
+            INSERT INTO tariffs (tenant_id, scaglione, limite, tariffa_base)
+            VALUES %s
+            """, tariff_rows(tenant_id, tariff))
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def load_services(self, tenant_id):
+        conn = self.connect()
+        cur = conn.cursor(cursor_factory=TimedDictCursor)
+
+        self.execute_prepared(cur, 'list_services', (tenant_id,))
+        services = [dict(service) for service in cur.fetchall()]
+
+        cur.close()
+        conn.close()
+
+        return services
+
+    def save_service(self, tenant_id, name, description, file_content=None):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("""
+        INSERT INTO services (tenant_id, name, description, file_content)
+        VALUES (%s, %s, %s, %s) RETURNING id
+        """, (tenant_id, name, description, file_content))
+
+        service_id = cur.fetchone()[0]
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return service_id
+
+    def delete_service(self, tenant_id, service_id):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # First delete from junction table if there are any references
+        cur.execute("DELETE FROM quote_services WHERE tenant_id = %s AND service_id = %s", (tenant_id, service_id))
+
+        # Then delete the service
+        cur.execute("DELETE FROM services WHERE tenant_id = %s AND id = %s", (tenant_id, service_id))
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def save_quote(self, tenant_id, client_data, selected_services, fees):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # Insert client data
+        self.execute_prepared(cur, 'insert_client', (
+            tenant_id,
+            client_data['nome'],
+            client_data['cognome'],
+            client_data['email'],
+            client_data['telefono'],
+            client_data['codice_fiscale'],
+            client_data['indirizzo']
+        ))
+
+        client_id = cur.fetchone()[0]
+
+        # Insert quote
+        self.execute_prepared(cur, 'insert_quote', (tenant_id, client_id, client_data['valore_bene'], fees['total']))
+
+        quote_id, created_at = cur.fetchone()
+
+        # Insert quote-service relationships (created_at selects the month partition)
+        for service in selected_services:
+            self.execute_prepared(cur, 'insert_quote_service', (tenant_id, quote_id, created_at, service['id']))
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return quote_id
+
+    def save_quotes(self, tenant_id, quotes):
+        if not quotes:
+            return []
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # Un'istruzione per tabella: VALUES ... RETURNING restituisce le righe nell'ordine di inserimento
+        client_ids = psycopg2.extras.execute_values(cur, """
+        INSERT INTO clients (tenant_id, nome, cognome, email, telefono, codice_fiscale, indirizzo)
+        VALUES %s
+        RETURNING id
+        """, [
+            (tenant_id, client_data['nome'], client_data['cognome'], client_data['email'],
+             client_data['telefono'], client_data['codice_fiscale'], client_data['indirizzo'])
+            for client_data, _, _ in quotes
+        ], page_size=len(quotes), fetch=True)
+
+        inserted = psycopg2.extras.execute_values(cur, """
+        INSERT INTO quotes (tenant_id, client_id, valore_bene, total_fee)
+        VALUES %s
+        RETURNING id, created_at
+        """, [
+            (tenant_id, client_id, client_data['valore_bene'], fees['total'])
+            for (client_id,), (client_data, _, fees) in zip(client_ids, quotes)
+        ], page_size=len(quotes), fetch=True)
+
+        links = [
+            (tenant_id, quote_id, created_at, service['id'])
+            for (quote_id, created_at), (_, selected_services, _) in zip(inserted, quotes)
+            for service in selected_services
+        ]
+        if links:
+            psycopg2.extras.execute_values(cur, """
+            INSERT INTO quote_services (tenant_id, quote_id, quote_created_at, service_id)
+            VALUES %s
+            """, links, page_size=len(links))
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return [quote_id for quote_id, _ in inserted]
+
+    def get_quote(self, tenant_id, quote_id):
+        # Primario e non replica: il preventivo può essere appena stato salvato
+        conn = self.connect()
+        cur = conn.cursor(cursor_factory=TimedDictCursor)
+
+        cur.execute("""
+        SELECT q.id, q.valore_bene, q.total_fee, q.created_at,
+               c.nome, c.cognome, c.email, c.telefono, c.codice_fiscale, c.indirizzo
+        FROM quotes q
+        JOIN clients c ON q.client_id = c.id
+        WHERE q.id = %s AND q.tenant_id = %s
+        """, (quote_id, tenant_id))
+        row = cur.fetchone()
+
+        quote = None
+        if row is not None:
+            quote = dict(row)
+            cur.execute("""
+            SELECT s.id, s.name, s.description
+            FROM services s
+            JOIN quote_services qs ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+            WHERE qs.quote_id = %s AND qs.quote_created_at = %s
+            ORDER BY s.name
+            """, (quote['id'], quote['created_at']))
+            quote['services'] = [dict(service) for service in cur.fetchall()]
+
+        cur.close()
+        conn.close()
+
+        return quote
+
+    def save_quote_pdfs(self, tenant_id, pdfs):
+        blobs, links = pack_pdfs(pdfs)
+        if not links:
+            return
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # I PDF già archiviati (stesso contenuto) non vengono trasferiti di nuovo
+        cur.execute("SELECT hash FROM pdf_blobs WHERE hash = ANY(%s)", (list(blobs),))
+        for (pdf_hash,) in cur.fetchall():
+            del blobs[pdf_hash]
+
+        if blobs:
+            psycopg2.extras.execute_values(cur, """
+            INSERT INTO pdf_blobs (hash, encoding, size, data)
+            VALUES %s
+            ON CONFLICT (hash) DO NOTHING
+            """, [(pdf_hash, encoding, size, psycopg2.Binary(data))
+                  for pdf_hash, encoding, size, data in blobs.values()], page_size=len(blobs))
+        # I blob sono condivisi (solo per contenuto), i collegamenti appartengono allo studio
+        psycopg2.extras.execute_values(cur, """
+        INSERT INTO quote_pdfs (tenant_id, quote_id, pdf_hash)
+        VALUES %s
+        ON CONFLICT (quote_id) DO UPDATE SET pdf_hash = EXCLUDED.pdf_hash
+        WHERE quote_pdfs.tenant_id = EXCLUDED.tenant_id
+        """, [(tenant_id, quote_id, pdf_hash) for quote_id, pdf_hash in links.items()], page_size=len(links))
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def get_quote_pdf(self, tenant_id, quote_id):
+        # Primario e non replica: il PDF può essere appena stato salvato
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("""
+        SELECT b.encoding, b.data
+        FROM quote_pdfs p
+        JOIN pdf_blobs b ON b.hash = p.pdf_hash
+        WHERE p.quote_id = %s AND p.tenant_id = %s
+        """, (quote_id, tenant_id))
+        row = cur.fetchone()
+
+        cur.close()
+        conn.close()
+
+        return unpack_pdf(*row) if row is not None else None
+
+    def quotes_with_pdf(self, tenant_id, quote_ids):
+        quote_ids = list(quote_ids)
+        if not quote_ids:
+            return set()
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("""
+        SELECT quote_id FROM quote_pdfs WHERE tenant_id = %s AND quote_id = ANY(%s)
+        """, (tenant_id, quote_ids))
+        found = {row[0] for row in cur.fetchall()}
+
+        cur.close()
+        conn.close()
+
+        return found
+
+    def get_expiring_quotes(self, tenant_id, start, end, after=None, limit=1000):
+        after_created_at, after_id = after or (start, 0)
+        # Primario e non replica: i promemoria appena registrati devono essere esclusi
+        conn = self.connect()
+        cur = conn.cursor(cursor_factory=TimedDictCursor)
+
+        # Intervallo costante su created_at: partizioni escluse dal planner e
+        # scansione di quotes_tenant_created_at_idx, a pagine per chiave (created_at, id)
+        cur.execute("""
+        SELECT q.id, q.created_at, q.total_fee, c.nome, c.cognome, c.email
+        FROM quotes q
+        JOIN clients c ON c.id = q.client_id
+        WHERE q.tenant_id = %(tenant_id)s AND q.created_at >= %(start)s AND q.created_at < %(end)s
+          AND (q.created_at, q.id) > (%(after_created_at)s, %(after_id)s)
+          AND NOT EXISTS (SELECT 1 FROM quote_reminders r WHERE r.quote_id = q.id)
+        ORDER BY q.created_at, q.id
+        LIMIT %(limit)s
+        """, {'tenant_id': tenant_id, 'start': start, 'end': end, 'after_created_at': after_created_at,
+              'after_id': after_id, 'limit': limit})
+        quotes = [dict(quote) for quote in cur.fetchall()]
+
+        cur.close()
+        conn.close()
+
+        return quotes
+
+    def record_reminders(self, tenant_id, reminders):
+        reminders = [(tenant_id,) + tuple(reminder) for reminder in reminders]
+        if not reminders:
+            return
+        conn = self.connect()
+        cur = conn.cursor()
+
+        psycopg2.extras.execute_values(cur, """
+        INSERT INTO quote_reminders (tenant_id, quote_id, email, status)
+        VALUES %s
+        ON CONFLICT (quote_id) DO NOTHING
+        """, reminders, page_size=len(reminders))
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def get_recent_quotes(self, tenant_id, limit=10):
+        conn = self.read_connect()
+        cur = conn.cursor(cursor_factory=TimedDictCursor)
+
+        # Prima solo i due mesi più recenti: con un limite costante il planner
+        # esclude le altre partizioni (un piano generico le bloccherebbe tutte).
+        # Se non bastano a riempire il limite, si ripete la query senza limite di data.
+        today = date.today()
+        for since in (_add_months(date(today.year, today.month, 1), -1), date.min):
+            cur.execute("""
+            SELECT q.id, q.valore_bene, q.total_fee, q.created_at,
+                   c.nome, c.cognome, c.email,
+                   ARRAY(
+                       SELECT s.name
+                       FROM services s
+                       JOIN quote_services qs ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+                       WHERE qs.quote_id = q.id AND qs.quote_created_at = q.created_at
+                         AND qs.quote_created_at >= %(since)s
+                   ) AS services
+            FROM quotes q
+            JOIN clients c ON q.client_id = c.id
+            WHERE q.tenant_id = %(tenant_id)s AND q.created_at >= %(since)s
+            ORDER BY q.created_at DESC
+            LIMIT %(limit)s
+            """, {'tenant_id': tenant_id, 'since': since, 'limit': limit})
+
+            quotes = [dict(quote) for quote in cur.fetchall()]
+            if len(quotes) >= limit:
+                break
+
+        cur.close()
+        conn.close()
+
+        return quotes
+
+    def search_quotes(self, tenant_id, text, page=1, page_size=20):
+        text = text.strip()
+        if not text:
+            return search_page([], page, page_size)
+
+        # Prefissi di parola sull'indice full-text; con pg_trgm anche sottostringhe
+        # (ILIKE) ed errori di battitura (somiglianza per parola, <%) sugli indici trigram
+        client_filter = f"search_vector @@ {PREFIX_TSQUERY}"
+        service_filter = f"to_tsvector('simple', name) @@ {PREFIX_TSQUERY}"
+        if self._has_trigram_search():
+            client_filter += f"""
+                OR {CLIENT_SEARCH_TEXT} ILIKE %(like)s
+                OR %(text)s <%% {CLIENT_SEARCH_TEXT}
+            """
+            service_filter += " OR name ILIKE %(like)s OR %(text)s <%% name"
+
+        conn = self.read_connect()
+        cur = conn.cursor(cursor_factory=TimedDictCursor)
+
+        cur.execute(f"""
+        WITH matching_quotes AS (
+            SELECT q.id
+            FROM quotes q
+            WHERE q.client_id IN (SELECT id FROM clients WHERE tenant_id = %(tenant_id)s AND ({client_filter}))
+            UNION
+            SELECT qs.quote_id
+            FROM quote_services qs
+            WHERE qs.tenant_id = %(tenant_id)s
+              AND qs.service_id IN (SELECT id FROM services WHERE tenant_id = %(tenant_id)s AND ({service_filter}))
+        )
+        SELECT q.id, q.valore_bene, q.total_fee, q.created_at,
+               c.nome, c.cognome, c.email,
+               ARRAY(
+                   SELECT s.name
+                   FROM services s
+                   JOIN quote_services qs ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+                   WHERE qs.quote_id = q.id AND qs.quote_created_at = q.created_at
+               ) AS services
+        FROM quotes q
+        JOIN matching_quotes m ON m.id = q.id
+        JOIN clients c ON q.client_id = c.id
+        WHERE q.tenant_id = %(tenant_id)s
+        ORDER BY q.created_at DESC, q.id DESC
+        LIMIT %(limit)s OFFSET %(offset)s
+        """, {
+            'tenant_id': tenant_id,
+            'text': text,
+            'like': f"%{escape_like(text)}%",
+            'limit': page_size + 1,
+            'offset': (page - 1) * page_size
+        })
+
+        quotes = [dict(quote) for quote in cur.fetchall()]
+
+        cur.close()
+        conn.close()
+
+        return search_page(quotes, page, page_size)
+
+    def import_services(self, tenant_id, services):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # Hash calcolato dal server: i documenti allegati non vengono trasferiti
+        cur.execute("""
+        SELECT id, md5(concat_ws(%(separator)s, name, COALESCE(description, %(null)s),
+                                 COALESCE(file_content, %(null)s)))
+        FROM services
+        WHERE tenant_id = %(tenant_id)s
+        """, {'separator': HASH_FIELD_SEPARATOR, 'null': HASH_NULL_MARKER, 'tenant_id': tenant_id})
+        rows, report = diff_services(dict(cur.fetchall()), services)
+
+        if rows:
+            psycopg2.extras.execute_values(cur, """
+            INSERT INTO services (tenant_id, id, name, description, file_content)
+            VALUES %s
+            ON CONFLICT (tenant_id, id) DO UPDATE
+            SET name = EXCLUDED.name,
+                description = EXCLUDED.description,
+                file_content = EXCLUDED.file_content
+            """, [(tenant_id,) + tuple(row) for row in rows], page_size=len(rows))
+
+            # Reset the sequence to max id + 1 (over every tenant: new ids never collide)
+            cur.execute("""
+            SELECT setval('services_id_seq', (SELECT MAX(id) FROM services))
+            """)
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return report
+
+    def get_service_statistics(self, tenant_id):
+        conn = self.read_connect()
+        try:
+            cur = conn.cursor()
+
+            # Aggregazioni parziali calcolate partizione per partizione (un mese alla volta)
+            cur.execute("SET LOCAL enable_partitionwise_aggregate = on")
+
+            # Get service request counts
+            cur.execute("""
+                SELECT s.id, s.name, COUNT(qs.service_id) as count
+                FROM services s
+                LEFT JOIN quote_services qs ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+                WHERE s.tenant_id = %s
+                GROUP BY s.id, s.name
+                ORDER BY count DESC
+            """, (tenant_id,))
+
+            service_counts = [
+                {'id': row[0], 'name': row[1], 'count': row[2]}
+                for row in cur.fetchall()
+            ]
+
+            # Get average quote value by service
+            cur.execute("""
+                SELECT s.id, s.name, AVG(q.valore_bene) as avg_value, AVG(q.total_fee) as avg_fee
+                FROM services s
+                JOIN quote_services qs ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+                JOIN quotes q ON qs.quote_id = q.id AND qs.quote_created_at = q.created_at
+                WHERE s.tenant_id = %s
+                GROUP BY s.id, s.name
+                ORDER BY s.name
+            """, (tenant_id,))
+
+            service_values = [
+                {'id': row[0], 'name': row[1], 'avg_value': row[2], 'avg_fee': row[3]}
+                for row in cur.fetchall()
+            ]
+
+            # Get monthly quote counts
+            cur.execute("""
+                SELECT
+                    EXTRACT(YEAR FROM created_at) as year,
+                    EXTRACT(MONTH FROM created_at) as month,
+                    COUNT(*) as count
+                FROM quotes
+                WHERE tenant_id = %s
+                GROUP BY year, month
+                ORDER BY year, month
+            """, (tenant_id,))
+
+            monthly_counts = [
+                {'year': int(row[0]), 'month': int(row[1]), 'count': row[2]}
+                for row in cur.fetchall()
+            ]
+
+            # Get total statistics
+            cur.execute("""
+                SELECT
+                    COUNT(*) as total_quotes,
+                    AVG(valore_bene) as avg_value,
+                    AVG(total_fee) as avg_fee
+                FROM quotes
+                WHERE tenant_id = %s
+            """, (tenant_id,))
+
+            total_stats = build_total_stats(cur.fetchone())
+
+            cur.close()
+
+            return {
+                'service_counts': service_counts,
+                'service_values': service_values,
+                'monthly_counts': monthly_counts,
+                'total_stats': total_stats
+            }
+
+        except psycopg2.Error as e:
+            print(f"Database error: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+        return empty_statistics()
+
+    def iter_quotes_for_export(self, tenant_id, chunk_size=5000):
+        conn = self.read_connect()
+        # Cursore con nome: le righe restano sul server e arrivano a blocchi di chunk_size
+        cur = conn.cursor(name="quote_export")
+        cur.itersize = chunk_size
+        try:
+            cur.execute("""
+            SELECT q.id, q.created_at, q.valore_bene, q.total_fee,
+                   c.nome, c.cognome, c.email, c.telefono, c.codice_fiscale, c.indirizzo,
+                   COALESCE((
+                       SELECT string_agg(s.name, '; ' ORDER BY s.name)
+                       FROM quote_services qs
+                       JOIN services s ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+                       WHERE qs.quote_id = q.id AND qs.quote_created_at = q.created_at
+                   ), '') AS services
+            FROM quotes q
+            JOIN clients c ON q.client_id = c.id
+            WHERE q.tenant_id = %s
+            ORDER BY q.id
+            """, (tenant_id,))
+
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cur.close()
+            conn.close()
+
+    def iter_quote_pricing(self, tenant_id, chunk_size=50000):
+        conn = self.read_connect()
+        cur = conn.cursor(name="quote_pricing")
+        cur.itersize = chunk_size
+        try:
+            cur.execute("""
+            SELECT q.valore_bene::float8,
+                   EXTRACT(YEAR FROM q.created_at)::int,
+                   EXTRACT(MONTH FROM q.created_at)::int,
+                   ARRAY(
+                       SELECT qs.service_id FROM quote_services qs
+                       WHERE qs.quote_id = q.id AND qs.quote_created_at = q.created_at
+                   )
+            FROM quotes q
+            WHERE q.tenant_id = %s
+            """, (tenant_id,))
+
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cur.close()
+            conn.close()
+
+    def oldest_quote_date(self):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("SELECT MIN(created_at) FROM quotes")
+        oldest = cur.fetchone()[0]
+
+        cur.close()
+        conn.close()
+
+        return oldest
+
+    def iter_quotes_for_archive(self, start, end, chunk_size=5000):
+        conn = self.connect()
+        cur = conn.cursor(name="quote_archive")
+        cur.itersize = chunk_size
+        try:
+            cur.execute("""
+            SELECT q.id, q.created_at, q.valore_bene, q.total_fee, q.client_id,
+                   c.nome, c.cognome, c.email, c.telefono, c.codice_fiscale, c.indirizzo,
+                   ARRAY(
+                       SELECT qs.service_id FROM quote_services qs
+                       WHERE qs.quote_id = q.id AND qs.quote_created_at = q.created_at
+                       ORDER BY qs.service_id
+                   ) AS service_ids,
+                   ARRAY(
+                       SELECT s.name FROM quote_services qs
+                       JOIN services s ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+                       WHERE qs.quote_id = q.id AND qs.quote_created_at = q.created_at
+                       ORDER BY qs.service_id
+                   ) AS services,
+                   q.tenant_id
+            FROM quotes q
+            LEFT JOIN clients c ON q.client_id = c.id
+            WHERE q.created_at >= %s AND q.created_at < %s
+            ORDER BY q.id
+            """, (start, end))
+
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cur.close()
+            conn.close()
+
+    def purge_quotes(self, start, end, max_id):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # Clienti dei preventivi eliminati, da raccogliere prima che la partizione venga staccata:
+        # quelli rimasti senza preventivi vengono eliminati nella stessa transazione
+        cur.execute("""
+        CREATE TEMP TABLE purged_clients ON COMMIT DROP AS
+        SELECT DISTINCT client_id FROM quotes WHERE created_at >= %s AND created_at < %s AND id <= %s
+        """, (start, end, max_id))
+
+        # Promemoria e PDF archiviati prima dei preventivi, finché le partizioni esistono ancora
+        for table in ("quote_reminders", "quote_pdfs"):
+            cur.execute(f"""
+            DELETE FROM {table} WHERE quote_id IN (
+                SELECT id FROM quotes WHERE created_at >= %s AND created_at < %s AND id <= %s
+            )
+            """, (start, end, max_id))
+        cur.execute("""
+        DELETE FROM pdf_blobs b
+        WHERE NOT EXISTS (SELECT 1 FROM quote_pdfs p WHERE p.pdf_hash = b.hash)
+        """)
+
+        # Un mese intero con la propria partizione si stacca ed elimina senza cancellare riga per riga
+        month = date(start.year, start.month, 1)
+        next_month = _add_months(month, 1)
+        if (start, end) == (datetime(month.year, month.month, 1), datetime(next_month.year, next_month.month, 1)):
+            partition = f"quotes_p{month.year}_{month.month:02d}"
+            cur.execute("""
+            SELECT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(%s))
+            """, (partition,))
+            if cur.fetchone()[0]:
+                cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {partition}")
+                if cur.fetchone()[0] <= max_id:
+                    self._detach_month(cur, f"p{month.year}_{month.month:02d}", drop=True)
+
+        # Righe rimaste (mese parziale, partizione di default o database non partizionato)
+        cur.execute("""
+        DELETE FROM quote_services
+        WHERE quote_created_at >= %s AND quote_created_at < %s AND quote_id <= %s
+        """, (start, end, max_id))
+        cur.execute("""
+        DELETE FROM quotes WHERE created_at >= %s AND created_at < %s AND id <= %s
+        """, (start, end, max_id))
+        cur.execute("""
+        DELETE FROM clients c
+        USING purged_clients p
+        WHERE c.id = p.client_id
+          AND NOT EXISTS (SELECT 1 FROM quotes q WHERE q.client_id = c.id)
+        """)
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def copy_rows(self, table, columns, rows):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            io.BufferedReader(_CsvStream(rows), buffer_size=1 << 16)
+        )
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def reset_sequences(self):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        for table in self.SERIAL_TABLES:
+            cur.execute(f"""
+            SELECT setval('{table}_id_seq', COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)
+            """)
+
+        conn.commit()
+        cur.close()
+        conn.close()
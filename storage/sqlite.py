@@ -0,0 +1,914 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+from storage.base import (
+    DEFAULT_TENANT_ID, DEFAULT_TENANT_SLUG, Storage, build_tenants, build_total_stats, diff_services,
+    empty_statistics, escape_like, money, pack_pdfs, search_page, service_content_hash, tariff_rows, unpack_pdf
+)
+from utils import metrics
+
+# Le colonne TIMESTAMP vengono restituite come datetime, come con PostgreSQL
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+
+# Tabelle con chiave composta (tenant_id, ...): SQLite non può modificare la chiave
+# primaria di una tabella esistente, quindi _add_tenant_columns le ricrea da qui
+SERVICES_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {{name}} (
+    id INTEGER NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    description TEXT NOT NULL,
+    file_content TEXT,
+    created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+    tenant_id INTEGER NOT NULL DEFAULT {DEFAULT_TENANT_ID} REFERENCES tenants(id),
+    PRIMARY KEY (tenant_id, id)
+)
+"""
+
+QUOTE_SERVICES_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {{name}} (
+    quote_id INTEGER REFERENCES quotes(id),
+    service_id INTEGER NOT NULL,
+    tenant_id INTEGER NOT NULL DEFAULT {DEFAULT_TENANT_ID},
+    PRIMARY KEY (quote_id, service_id),
+    FOREIGN KEY (tenant_id, service_id) REFERENCES services (tenant_id, id)
+)
+"""
+
+# Tabelle a cui _add_tenant_columns aggiunge solo la colonna
+TENANT_COLUMN_TABLES = ("clients", "quotes", "quote_pdfs", "quote_reminders")
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Record the duration of every statement executed through the cursor"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe_sql(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe_sql(sql, time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+
+class SqliteStorage(Storage):
+    """
+    Embedded SQLite backend (WAL mode).
+
+    Ogni operazione apre una connessione propria, come il backend PostgreSQL:
+    su SQLite l'apertura costa poche decine di microsecondi.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(self, url):
+        self.url = url
+        path = url[len("sqlite://"):]
+        if path.startswith("/"):
+            path = path[1:]
+        self._anchor = None
+
+        if path in ("", ":memory:"):
+            # Database in memoria condiviso tra le connessioni del processo:
+            # la connessione "anchor" lo mantiene in vita
+            self.database = f"file:avvocato-{uuid.uuid4().hex}?mode=memory&cache=shared"
+            self.uri = True
+            self._anchor = self.connect()
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.database = path
+            self.uri = False
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            uri=self.uri,
+            timeout=30,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            factory=TimedConnection,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def initialize(self):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # WAL: i lettori non bloccano lo scrittore (l'impostazione è persistente nel file)
+        cur.execute("PRAGMA journal_mode = WAL")
+
+        # Studi serviti dall'istanza e tariffari propri (senza righe vale quello di utils.fee_calculator)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS tenants (
+            id INTEGER PRIMARY KEY,
+            slug VARCHAR(64) NOT NULL UNIQUE,
+            name VARCHAR(255) NOT NULL,
+            branding TEXT NOT NULL DEFAULT '{}',
+            created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+        )
+        """)
+        cur.execute("""
+        INSERT INTO tenants (id, slug, name) VALUES (?, ?, 'Studio legale')
+        ON CONFLICT DO NOTHING
+        """, (DEFAULT_TENANT_ID, DEFAULT_TENANT_SLUG))
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS tariffs (
+            tenant_id INTEGER NOT NULL REFERENCES tenants(id),
+            scaglione INTEGER NOT NULL,
+            limite NUMERIC(15, 2),
+            tariffa_base NUMERIC(15, 2) NOT NULL,
+            PRIMARY KEY (tenant_id, scaglione)
+        )
+        """)
+
+        cur.execute(SERVICES_TABLE.format(name="services"))
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS clients (
+            id INTEGER PRIMARY KEY,
+            nome VARCHAR(255) NOT NULL,
+            cognome VARCHAR(255) NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            telefono VARCHAR(100),
+            codice_fiscale VARCHAR(16) NOT NULL,
+            indirizzo TEXT,
+            created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            tenant_id INTEGER NOT NULL DEFAULT 1 REFERENCES tenants(id)
+        )
+        """)
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS quotes (
+            id INTEGER PRIMARY KEY,
+            client_id INTEGER REFERENCES clients(id),
+            valore_bene NUMERIC(15, 2) NOT NULL,
+            total_fee NUMERIC(15, 2) NOT NULL,
+            created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            tenant_id INTEGER NOT NULL DEFAULT 1 REFERENCES tenants(id)
+        )
+        """)
+
+        cur.execute(QUOTE_SERVICES_TABLE.format(name="quote_services"))
+
+        # PDF dei preventivi: un blob per contenuto (sha256), collegato a uno o più preventivi
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS pdf_blobs (
+            hash CHAR(64) PRIMARY KEY,
+            encoding VARCHAR(16) NOT NULL,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+        )
+        """)
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS quote_pdfs (
+            quote_id INTEGER PRIMARY KEY REFERENCES quotes(id),
+            pdf_hash CHAR(64) NOT NULL REFERENCES pdf_blobs(hash),
+            created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            tenant_id INTEGER NOT NULL DEFAULT 1
+        )
+        """)
+
+        # Promemoria di scadenza inviati (o rifiutati dal server): uno per preventivo
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS quote_reminders (
+            quote_id INTEGER PRIMARY KEY REFERENCES quotes(id),
+            email VARCHAR(255) NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            sent_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            tenant_id INTEGER NOT NULL DEFAULT 1
+        )
+        """)
+
+        conn.commit()
+        self._add_tenant_columns(conn)
+
+        # Indici guidati da tenant_id: ogni query di uno studio legge solo le sue righe.
+        # SQLite non dispone di hash join: le aggregazioni per servizio richiedono un indice
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS quote_services_tenant_service_idx ON quote_services (tenant_id, service_id)
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS quotes_tenant_created_at_idx ON quotes (tenant_id, created_at)")
+        # Archiviazione e promemoria per intervallo di date su tutti gli studi
+        cur.execute("CREATE INDEX IF NOT EXISTS quotes_created_at_idx ON quotes (created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS quotes_client_id_idx ON quotes (client_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS quote_pdfs_pdf_hash_idx ON quote_pdfs (pdf_hash)")
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    @staticmethod
+    def _add_tenant_columns(conn):
+        """
+        Add tenant_id to the tables of a database created before multi-tenancy: the
+        existing rows belong to the default tenant. services and quote_services are
+        rebuilt with their composite keys, the other tables get the column.
+        """
+        def columns(table):
+            return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+        missing = [table for table in ("services",) + TENANT_COLUMN_TABLES if 'tenant_id' not in columns(table)]
+        if not missing:
+            return
+
+        # Le chiavi esterne non vengono verificate durante la ricostruzione (e
+        # PRAGMA foreign_keys non ha effetto dentro una transazione)
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if 'services' in missing:
+                conn.execute(SERVICES_TABLE.format(name="services_new"))
+                conn.execute("""
+                INSERT INTO services_new (id, name, description, file_content, created_at)
+                SELECT id, name, description, file_content, created_at FROM services
+                """)
+                conn.execute(QUOTE_SERVICES_TABLE.format(name="quote_services_new"))
+                conn.execute("""
+                INSERT INTO quote_services_new (quote_id, service_id)
+                SELECT quote_id, service_id FROM quote_services
+                """)
+                conn.execute("DROP TABLE quote_services")
+                conn.execute("DROP TABLE services")
+                conn.execute("ALTER TABLE services_new RENAME TO services")
+                conn.execute("ALTER TABLE quote_services_new RENAME TO quote_services")
+            for table in TENANT_COLUMN_TABLES:
+                if table in missing:
+                    conn.execute(f"""
+                    ALTER TABLE {table} ADD COLUMN tenant_id INTEGER NOT NULL DEFAULT {DEFAULT_TENANT_ID}
+                    """)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+
+    def load_tenants(self):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("SELECT id, slug, name, branding FROM tenants ORDER BY id")
+        tenant_rows = cur.fetchall()
+        cur.execute("SELECT tenant_id, limite, tariffa_base FROM tariffs ORDER BY tenant_id, scaglione")
+        tenants = build_tenants(tenant_rows, cur.fetchall())
+
+        cur.close()
+        conn.close()
+
+        return tenants
+
+    def save_tenant(self, slug, name, branding=None):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("""
+        INSERT INTO tenants (slug, name, branding)
+        VALUES (?, ?, ?)
+        ON CONFLICT (slug) DO UPDATE SET name = excluded.name, branding = excluded.branding
+        RETURNING id
+        """, (slug, name, json.dumps(branding or {})))
+        tenant_id = cur.fetchone()[0]
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return tenant_id
+
+    def save_tariff(self, tenant_id, tariff):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("DELETE FROM tariffs WHERE tenant_id = ?", (tenant_id,))
+        if tariff is not None:
+            cur.executemany("""
+            INSERT INTO tariffs (tenant_id, scaglione, limite, tariffa_base)
+            VALUES (?, ?, ?, ?)
+            """, tariff_rows(tenant_id, tariff))
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def load_services(self, tenant_id):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("SELECT * FROM services WHERE tenant_id = ? ORDER BY name", (tenant_id,))
+        services = [dict(service) for service in cur.fetchall()]
+
+        cur.close()
+        conn.close()
+
+        return services
+
+    def save_service(self, tenant_id, name, description, file_content=None):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # Con la chiave (tenant_id, id) id non è più un alias del rowid: lo si calcola
+        # nella stessa istruzione, unico tra tutti gli studi come con la sequenza di PostgreSQL
+        cur.execute("""
+        INSERT INTO services (tenant_id, id, name, description, file_content)
+        SELECT ?, COALESCE(MAX(id), 0) + 1, ?, ?, ? FROM services
+        RETURNING id
+        """, (tenant_id, name, description, file_content))
+
+        service_id = cur.fetchone()[0]
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return service_id
+
+    def delete_service(self, tenant_id, service_id):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("DELETE FROM quote_services WHERE tenant_id = ? AND service_id = ?", (tenant_id, service_id))
+        cur.execute("DELETE FROM services WHERE tenant_id = ? AND id = ?", (tenant_id, service_id))
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def save_quote(self, tenant_id, client_data, selected_services, fees):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("""
+        INSERT INTO clients (tenant_id, nome, cognome, email, telefono, codice_fiscale, indirizzo)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (
+            tenant_id,
+            client_data['nome'],
+            client_data['cognome'],
+            client_data['email'],
+            client_data['telefono'],
+            client_data['codice_fiscale'],
+            client_data['indirizzo']
+        ))
+
+        client_id = cur.lastrowid
+
+        cur.execute("""
+        INSERT INTO quotes (tenant_id, client_id, valore_bene, total_fee)
+        VALUES (?, ?, ?, ?)
+        """, (tenant_id, client_id, money(client_data['valore_bene']), money(fees['total'])))
+
+        quote_id = cur.lastrowid
+
+        cur.executemany("""
+        INSERT INTO quote_services (tenant_id, quote_id, service_id)
+        VALUES (?, ?, ?)
+        """, [(tenant_id, quote_id, service['id']) for service in selected_services])
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return quote_id
+
+    def save_quotes(self, tenant_id, quotes):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # Una sola transazione: con SQLite il costo è il commit, non le singole INSERT
+        quote_ids = []
+        for client_data, selected_services, fees in quotes:
+            cur.execute("""
+            INSERT INTO clients (tenant_id, nome, cognome, email, telefono, codice_fiscale, indirizzo)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (tenant_id, client_data['nome'], client_data['cognome'], client_data['email'],
+                  client_data['telefono'], client_data['codice_fiscale'], client_data['indirizzo']))
+            cur.execute("""
+            INSERT INTO quotes (tenant_id, client_id, valore_bene, total_fee)
+            VALUES (?, ?, ?, ?)
+            """, (tenant_id, cur.lastrowid, money(client_data['valore_bene']), money(fees['total'])))
+            quote_id = cur.lastrowid
+            cur.executemany("""
+            INSERT INTO quote_services (tenant_id, quote_id, service_id)
+            VALUES (?, ?, ?)
+            """, [(tenant_id, quote_id, service['id']) for service in selected_services])
+            quote_ids.append(quote_id)
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return quote_ids
+
+    def get_quote(self, tenant_id, quote_id):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("""
+        SELECT q.id, q.valore_bene, q.total_fee, q.created_at,
+               c.nome, c.cognome, c.email, c.telefono, c.codice_fiscale, c.indirizzo
+        FROM quotes q
+        JOIN clients c ON q.client_id = c.id
+        WHERE q.id = ? AND q.tenant_id = ?
+        """, (quote_id, tenant_id))
+        row = cur.fetchone()
+
+        quote = None
+        if row is not None:
+            quote = dict(row)
+            cur.execute("""
+            SELECT s.id, s.name, s.description
+            FROM services s
+            JOIN quote_services qs ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+            WHERE qs.quote_id = ?
+            ORDER BY s.name
+            """, (quote_id,))
+            quote['services'] = [dict(service) for service in cur.fetchall()]
+
+        cur.close()
+        conn.close()
+
+        return quote
+
+    def save_quote_pdfs(self, tenant_id, pdfs):
+        blobs, links = pack_pdfs(pdfs)
+        if not links:
+            return
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # I PDF già archiviati (stesso contenuto) non vengono riscritti
+        hashes = list(blobs)
+        cur.execute(f"""
+        SELECT hash FROM pdf_blobs WHERE hash IN ({', '.join('?' for _ in hashes)})
+        """, hashes)
+        for (pdf_hash,) in cur.fetchall():
+            del blobs[pdf_hash]
+
+        cur.executemany("""
+        INSERT INTO pdf_blobs (hash, encoding, size, data)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (hash) DO NOTHING
+        """, list(blobs.values()))
+        # I blob sono condivisi (solo per contenuto), i collegamenti appartengono allo studio
+        cur.executemany("""
+        INSERT INTO quote_pdfs (tenant_id, quote_id, pdf_hash)
+        VALUES (?, ?, ?)
+        ON CONFLICT (quote_id) DO UPDATE SET pdf_hash = excluded.pdf_hash
+        WHERE quote_pdfs.tenant_id = excluded.tenant_id
+        """, [(tenant_id, quote_id, pdf_hash) for quote_id, pdf_hash in links.items()])
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def get_quote_pdf(self, tenant_id, quote_id):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("""
+        SELECT b.encoding, b.data
+        FROM quote_pdfs p
+        JOIN pdf_blobs b ON b.hash = p.pdf_hash
+        WHERE p.quote_id = ? AND p.tenant_id = ?
+        """, (quote_id, tenant_id))
+        row = cur.fetchone()
+
+        cur.close()
+        conn.close()
+
+        return unpack_pdf(*row) if row is not None else None
+
+    def quotes_with_pdf(self, tenant_id, quote_ids):
+        quote_ids = list(quote_ids)
+        if not quote_ids:
+            return set()
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute(f"""
+        SELECT quote_id FROM quote_pdfs
+        WHERE tenant_id = ? AND quote_id IN ({', '.join('?' for _ in quote_ids)})
+        """, [tenant_id] + quote_ids)
+        found = {row[0] for row in cur.fetchall()}
+
+        cur.close()
+        conn.close()
+
+        return found
+
+    def get_expiring_quotes(self, tenant_id, start, end, after=None, limit=1000):
+        after_created_at, after_id = after or (start, 0)
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # Scansione per intervallo su quotes_tenant_created_at_idx, a pagine per chiave (created_at, id)
+        cur.execute("""
+        SELECT q.id, q.created_at, q.total_fee, c.nome, c.cognome, c.email
+        FROM quotes q
+        JOIN clients c ON c.id = q.client_id
+        WHERE q.tenant_id = ? AND q.created_at >= ? AND q.created_at < ?
+          AND (q.created_at, q.id) > (?, ?)
+          AND NOT EXISTS (SELECT 1 FROM quote_reminders r WHERE r.quote_id = q.id)
+        ORDER BY q.created_at, q.id
+        LIMIT ?
+        """, (tenant_id, start, end, after_created_at, after_id, limit))
+        quotes = [dict(quote) for quote in cur.fetchall()]
+
+        cur.close()
+        conn.close()
+
+        return quotes
+
+    def record_reminders(self, tenant_id, reminders):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.executemany("""
+        INSERT INTO quote_reminders (tenant_id, quote_id, email, status)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (quote_id) DO NOTHING
+        """, [(tenant_id,) + tuple(reminder) for reminder in reminders])
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def get_recent_quotes(self, tenant_id, limit=10):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("""
+        SELECT q.id, q.valore_bene, q.total_fee, q.created_at,
+               c.nome, c.cognome, c.email
+        FROM quotes q
+        JOIN clients c ON q.client_id = c.id
+        WHERE q.tenant_id = ?
+        ORDER BY q.created_at DESC
+        LIMIT ?
+        """, (tenant_id, limit))
+
+        quotes = [dict(quote) for quote in cur.fetchall()]
+
+        for quote in quotes:
+            cur.execute("""
+            SELECT s.name
+            FROM services s
+            JOIN quote_services qs ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+            WHERE qs.quote_id = ?
+            """, (quote['id'],))
+
+            quote['services'] = [row[0] for row in cur.fetchall()]
+
+        cur.close()
+        conn.close()
+
+        return quotes
+
+    def search_quotes(self, tenant_id, text, page=1, page_size=20):
+        text = text.strip()
+        if not text:
+            return search_page([], page, page_size)
+
+        # Nessun indice full-text: LIKE sulle sottostringhe (senza distinzione
+        # tra maiuscole e minuscole ASCII), adeguato alle installazioni locali
+        like = f"%{escape_like(text)}%"
+
+        conn = self.connect()
+        cur = conn.cursor()
+
+        cur.execute("""
+        WITH matching_quotes AS (
+            SELECT q.id
+            FROM quotes q
+            WHERE q.client_id IN (
+                SELECT id FROM clients
+                WHERE tenant_id = :tenant_id
+                  AND (nome || ' ' || cognome || ' ' || email || ' ' || codice_fiscale) LIKE :like ESCAPE '\\'
+            )
+            UNION
+            SELECT qs.quote_id
+            FROM quote_services qs
+            WHERE qs.tenant_id = :tenant_id
+              AND qs.service_id IN (
+                  SELECT id FROM services WHERE tenant_id = :tenant_id AND name LIKE :like ESCAPE '\\'
+              )
+        )
+        SELECT q.id, q.valore_bene, q.total_fee, q.created_at,
+               c.nome, c.cognome, c.email
+        FROM quotes q
+        JOIN matching_quotes m ON m.id = q.id
+        JOIN clients c ON q.client_id = c.id
+        WHERE q.tenant_id = :tenant_id
+        ORDER BY q.created_at DESC, q.id DESC
+        LIMIT :limit OFFSET :offset
+        """, {'tenant_id': tenant_id, 'like': like, 'limit': page_size + 1, 'offset': (page - 1) * page_size})
+
+        quotes = [dict(quote) for quote in cur.fetchall()]
+
+        for quote in quotes[:page_size]:
+            cur.execute("""
+            SELECT s.name
+            FROM services s
+            JOIN quote_services qs ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+            WHERE qs.quote_id = ?
+            """, (quote['id'],))
+
+            quote['services'] = [row[0] for row in cur.fetchall()]
+
+        cur.close()
+        conn.close()
+
+        return search_page(quotes, page, page_size)
+
+    def import_services(self, tenant_id, services):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        conn.create_function('service_content_hash', 3, service_content_hash, deterministic=True)
+        cur.execute("""
+        SELECT id, service_content_hash(name, description, file_content) FROM services WHERE tenant_id = ?
+        """, (tenant_id,))
+        rows, report = diff_services(dict(cur.fetchall()), services)
+
+        if rows:
+            cur.executemany("""
+            INSERT INTO services (tenant_id, id, name, description, file_content)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (tenant_id, id) DO UPDATE
+            SET name = excluded.name,
+                description = excluded.description,
+                file_content = excluded.file_content
+            """, [(tenant_id,) + row for row in rows])
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return report
+
+    def get_service_statistics(self, tenant_id):
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+
+            cur.execute("""
+                SELECT s.id, s.name, COUNT(qs.service_id) as count
+                FROM services s
+                LEFT JOIN quote_services qs ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+                WHERE s.tenant_id = ?
+                GROUP BY s.id, s.name
+                ORDER BY count DESC
+            """, (tenant_id,))
+
+            service_counts = [
+                {'id': row[0], 'name': row[1], 'count': row[2]}
+                for row in cur.fetchall()
+            ]
+
+            cur.execute("""
+                SELECT s.id, s.name, AVG(q.valore_bene) as avg_value, AVG(q.total_fee) as avg_fee
+                FROM services s
+                JOIN quote_services qs ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+                JOIN quotes q ON qs.quote_id = q.id
+                WHERE s.tenant_id = ?
+                GROUP BY s.id, s.name
+                ORDER BY s.name
+            """, (tenant_id,))
+
+            service_values = [
+                {'id': row[0], 'name': row[1], 'avg_value': row[2], 'avg_fee': row[3]}
+                for row in cur.fetchall()
+            ]
+
+            cur.execute("""
+                SELECT
+                    CAST(strftime('%Y', created_at) AS INTEGER) as year,
+                    CAST(strftime('%m', created_at) AS INTEGER) as month,
+                    COUNT(*) as count
+                FROM quotes
+                WHERE tenant_id = ?
+                GROUP BY year, month
+                ORDER BY year, month
+            """, (tenant_id,))
+
+            monthly_counts = [
+                {'year': int(row[0]), 'month': int(row[1]), 'count': row[2]}
+                for row in cur.fetchall()
+            ]
+
+            cur.execute("""
+                SELECT
+                    COUNT(*) as total_quotes,
+                    AVG(valore_bene) as avg_value,
+                    AVG(total_fee) as avg_fee
+                FROM quotes
+                WHERE tenant_id = ?
+            """, (tenant_id,))
+
+            total_stats = build_total_stats(cur.fetchone())
+
+            cur.close()
+
+            return {
+                'service_counts': service_counts,
+                'service_values': service_values,
+                'monthly_counts': monthly_counts,
+                'total_stats': total_stats
+            }
+
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+        return empty_statistics()
+
+    def iter_quotes_for_export(self, tenant_id, chunk_size=5000):
+        conn = self.connect()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+            SELECT q.id, q.created_at, q.valore_bene, q.total_fee,
+                   c.nome, c.cognome, c.email, c.telefono, c.codice_fiscale, c.indirizzo,
+                   COALESCE((
+                       SELECT group_concat(name, '; ')
+                       FROM (
+                           SELECT s.name
+                           FROM quote_services qs
+                           JOIN services s ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+                           WHERE qs.quote_id = q.id
+                           ORDER BY s.name
+                       )
+                   ), '') AS services
+            FROM quotes q
+            JOIN clients c ON q.client_id = c.id
+            WHERE q.tenant_id = ?
+            ORDER BY q.id
+            """, (tenant_id,))
+
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row)
+        finally:
+            cur.close()
+            conn.close()
+
+    def iter_quote_pricing(self, tenant_id, chunk_size=50000):
+        conn = self.connect()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+            SELECT CAST(q.valore_bene AS REAL),
+                   CAST(strftime('%Y', q.created_at) AS INTEGER),
+                   CAST(strftime('%m', q.created_at) AS INTEGER),
+                   (SELECT group_concat(service_id) FROM quote_services WHERE quote_id = q.id)
+            FROM quotes q
+            WHERE q.tenant_id = ?
+            """, (tenant_id,))
+
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for value, year, month, service_ids in rows:
+                    yield value, year, month, [int(i) for i in service_ids.split(',')] if service_ids else []
+        finally:
+            cur.close()
+            conn.close()
+
+    def oldest_quote_date(self):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # MIN() perderebbe il tipo dichiarato della colonna (e la conversione in datetime)
+        cur.execute("SELECT created_at FROM quotes ORDER BY created_at LIMIT 1")
+        row = cur.fetchone()
+
+        cur.close()
+        conn.close()
+
+        return row[0] if row else None
+
+    def iter_quotes_for_archive(self, start, end, chunk_size=5000):
+        conn = self.connect()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+            SELECT q.id, q.created_at, q.valore_bene, q.total_fee, q.client_id,
+                   c.nome, c.cognome, c.email, c.telefono, c.codice_fiscale, c.indirizzo,
+                   (
+                       SELECT json_group_array(service_id)
+                       FROM (SELECT service_id FROM quote_services WHERE quote_id = q.id ORDER BY service_id)
+                   ) AS service_ids,
+                   (
+                       SELECT json_group_array(name)
+                       FROM (
+                           SELECT s.name
+                           FROM quote_services qs
+                           JOIN services s ON s.tenant_id = qs.tenant_id AND s.id = qs.service_id
+                           WHERE qs.quote_id = q.id
+                           ORDER BY qs.service_id
+                       )
+                   ) AS services,
+                   q.tenant_id
+            FROM quotes q
+            LEFT JOIN clients c ON q.client_id = c.id
+            WHERE q.created_at >= ? AND q.created_at < ?
+            ORDER BY q.id
+            """, (start, end))
+
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row[:11]) + (json.loads(row[11]), json.loads(row[12]), row[13])
+        finally:
+            cur.close()
+            conn.close()
+
+    def purge_quotes(self, start, end, max_id):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        # Clienti dei preventivi eliminati: quelli rimasti senza preventivi vengono eliminati con loro
+        cur.execute("""
+        CREATE TEMP TABLE purged_clients AS
+        SELECT DISTINCT client_id FROM quotes WHERE created_at >= ? AND created_at < ? AND id <= ?
+        """, (start, end, max_id))
+        for table in ("quote_reminders", "quote_pdfs"):
+            cur.execute(f"""
+            DELETE FROM {table} WHERE quote_id IN (
+                SELECT id FROM quotes WHERE created_at >= ? AND created_at < ? AND id <= ?
+            )
+            """, (start, end, max_id))
+        cur.execute("""
+        DELETE FROM pdf_blobs
+        WHERE NOT EXISTS (SELECT 1 FROM quote_pdfs p WHERE p.pdf_hash = pdf_blobs.hash)
+        """)
+        cur.execute("""
+        DELETE FROM quote_services WHERE quote_id IN (
+            SELECT id FROM quotes WHERE created_at >= ? AND created_at < ? AND id <= ?
+        )
+        """, (start, end, max_id))
+        cur.execute("""
+        DELETE FROM quotes WHERE created_at >= ? AND created_at < ? AND id <= ?
+        """, (start, end, max_id))
+        cur.execute("""
+        DELETE FROM clients
+        WHERE id IN (SELECT client_id FROM purged_clients)
+          AND NOT EXISTS (SELECT 1 FROM quotes q WHERE q.client_id = clients.id)
+        """)
+        cur.execute("DROP TABLE purged_clients")
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def copy_rows(self, table, columns, rows):
+        conn = self.connect()
+        cur = conn.cursor()
+
+        placeholders = ", ".join("?" for _ in columns)
+        cur.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+            rows
+        )
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def reset_sequences(self):
+        # INTEGER PRIMARY KEY usa sempre MAX(id) + 1: nulla da riallineare
+        pass
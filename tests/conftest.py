@@ -0,0 +1,265 @@
+import re
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+
+import database
+from storage import create_storage
+from utils import cache
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    """One client connection: RESP arrays in, RESP replies out"""
+
+    def handle(self):
+        self.server.opened(self)
+        self.scan_keys = []
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                self.wfile.write(self.reply(args))
+        except (OSError, ValueError):
+            return
+        finally:
+            self.server.closed(self)
+
+    def reply(self, args):
+        server = self.server
+        command = args[0].upper()
+        if command != b'AUTH' and server.password and not getattr(self, 'authenticated', False):
+            return b'-NOAUTH Authentication required.\r\n'
+        if command == b'AUTH':
+            self.authenticated = args[1].decode() == server.password
+            return b'+OK\r\n' if self.authenticated else b'-WRONGPASS invalid password\r\n'
+        if command == b'SELECT':
+            server.selected.append(int(args[1]))
+            return b'+OK\r\n'
+        if command == b'GET':
+            return encode(server.get(args[1]))
+        if command == b'SET':
+            ttl = None
+            if len(args) > 3 and args[3].upper() == b'PX':
+                ttl = int(args[4]) / 1000
+            server.set(args[1], args[2], ttl)
+            return b'+OK\r\n'
+        if command == b'DEL':
+            return b':%d\r\n' % sum(server.delete(key) for key in args[1:])
+        if command == b'SCAN':
+            # Il cursore è la posizione in un'istantanea delle chiavi presa all'inizio della scansione
+            options = dict(zip((arg.upper() for arg in args[2::2]), args[3::2]))
+            start = int(args[1])
+            if start == 0:
+                self.scan_keys = server.keys()
+            count = int(options.get(b'COUNT', b'10'))
+            chunk = self.scan_keys[start:start + count]
+            pattern = glob_to_regex(options.get(b'MATCH', b'*'))
+            cursor = start + count if start + count < len(self.scan_keys) else 0
+            return encode([str(cursor).encode(), [key for key in chunk if pattern.fullmatch(key)]])
+        return b'-ERR unknown command\r\n'
+
+
+def glob_to_regex(pattern):
+    """Redis glob pattern (*, ? and backslash escapes) as a compiled bytes regex"""
+    parts = []
+    for escaped, wildcard, literal in re.findall(rb'\\(.)|([*?])|([^\\*?]+)', pattern, re.DOTALL):
+        if wildcard:
+            parts.append(b'.*' if wildcard == b'*' else b'.')
+        else:
+            parts.append(re.escape(escaped or literal))
+    return re.compile(b''.join(parts), re.DOTALL)
+
+
+def encode(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(encode(item) for item in value)
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """
+    In-process stand-in for Redis speaking the commands RedisCache uses
+    (AUTH, SELECT, GET, SET PX, DEL, SCAN MATCH COUNT), with key expiry
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password=None):
+        super().__init__(('127.0.0.1', 0), RespHandler)
+        self.password = password
+        self.selected = []
+        self.connections = 0
+        self._store = {}
+        self._handlers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def opened(self, handler):
+        with self._lock:
+            self.connections += 1
+            self._handlers.add(handler)
+
+    def closed(self, handler):
+        with self._lock:
+            self._handlers.discard(handler)
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self._store.get(key, (None, None))
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._store[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store[key] = (value, None if ttl is None else time.monotonic() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            return self._store.pop(key, None) is not None
+
+    def keys(self):
+        with self._lock:
+            return sorted(self._store)
+
+    def drop_connections(self):
+        """Close every client connection, as a restarted server would"""
+        with self._lock:
+            handlers = list(self._handlers)
+        for handler in handlers:
+            handler.connection.shutdown(socket.SHUT_RDWR)
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """One SMTP session, without STARTTLS or AUTH"""
+
+    def handle(self):
+        server = self.server
+        server.opened()
+        self.reply(b'220 localhost ESMTP test')
+        mail_from, recipients = None, []
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                command = line.strip().decode()
+                verb = command[:4].upper()
+                if verb in ('EHLO', 'HELO'):
+                    self.reply(b'250-localhost\r\n250 8BITMIME' if verb == 'EHLO' else b'250 localhost')
+                elif verb == 'MAIL':
+                    mail_from, recipients = command.split(':', 1)[1].strip(' <>'), []
+                    self.reply(b'250 OK')
+                elif verb == 'RCPT':
+                    address = command.split(':', 1)[1].strip(' <>')
+                    code = server.refuse.get(address)
+                    if code:
+                        self.reply(b'%d Recipient refused' % code)
+                    else:
+                        recipients.append(address)
+                        self.reply(b'250 OK')
+                elif verb == 'DATA':
+                    self.reply(b'354 End data with <CR><LF>.<CR><LF>')
+                    data = []
+                    for data_line in iter(self.rfile.readline, b''):
+                        if data_line == b'.\r\n':
+                            break
+                        data.append(data_line)
+                    server.received(mail_from, recipients, b''.join(data))
+                    self.reply(b'250 OK: queued')
+                    if server.drop_after and len(server.messages) == server.drop_after:
+                        # Connessione chiusa dal server senza QUIT, come un server riavviato
+                        return
+                elif verb == 'RSET':
+                    mail_from, recipients = None, []
+                    self.reply(b'250 OK')
+                elif verb == 'NOOP':
+                    self.reply(b'250 OK')
+                elif verb == 'QUIT':
+                    self.reply(b'221 Bye')
+                    return
+                else:
+                    self.reply(b'502 Command not implemented')
+        except OSError:
+            return
+
+    def reply(self, line):
+        self.wfile.write(line + b'\r\n')
+
+
+class SmtpServer(socketserver.ThreadingTCPServer):
+    """
+    In-process SMTP server recording the messages it accepts; refuse maps
+    recipient addresses to the RCPT reply code (e.g. 550 or 450)
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SmtpHandler)
+        self.refuse = {}
+        self.drop_after = None
+        self.connections = 0
+        self.messages = []
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def opened(self):
+        with self._lock:
+            self.connections += 1
+
+    def received(self, mail_from, recipients, data):
+        with self._lock:
+            self.messages.append((mail_from, recipients, data))
+
+    def recipients(self):
+        with self._lock:
+            return [recipient for _, recipients, _ in self.messages for recipient in recipients]
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    """A fresh in-memory SQLite backend behind the database module, with an empty cache"""
+    backend = create_storage('sqlite:///:memory:')
+    monkeypatch.setattr(database, 'get_storage', lambda: backend)
+    monkeypatch.setattr(cache, '_cache', cache.MemoryCache())
+    monkeypatch.setenv('ARCHIVE_DIR', str(tmp_path / 'archive'))
+    database.initialize_database()
+    return backend
+
+
+@pytest.fixture
+def resp_server():
+    yield from _serve(RespServer())
+
+
+@pytest.fixture
+def smtp_server():
+    yield from _serve(SmtpServer())
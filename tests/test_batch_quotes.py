@@ -0,0 +1,70 @@
+import math
+
+import pytest
+
+from utils import catalog
+from utils.batch_quotes import parse_amount, parse_row
+
+SERVICES = catalog.Catalog([
+    catalog.Service(1, 'Consulenza Legale', 'Consulenza'),
+    catalog.Service(2, 'Recupero Crediti', 'Recupero'),
+])
+
+
+def make_row(**fields):
+    row = {
+        'nome': 'Mario', 'cognome': 'Rossi', 'email': 'mario.rossi@example.com',
+        'codice_fiscale': 'RSSMRA80A01H501U', 'telefono': '', 'indirizzo': '',
+        'valore_bene': '250000', 'servizi': 'Consulenza Legale',
+    }
+    row.update(fields)
+    return row
+
+
+@pytest.mark.parametrize('value, expected', [
+    (250000, 250000.0),
+    (1500.5, 1500.5),
+    ('250000', 250000.0),
+    ('250000.50', 250000.5),
+    ('1.5', 1.5),
+    ('1.500', 1500.0),
+    ('€ 250.000', 250000.0),
+    ('1.234.567', 1234567.0),
+    ('€ 250.000,50', 250000.5),
+    ('250000,5', 250000.5),
+    ('1.500,00', 1500.0),
+])
+def test_parse_amount(value, expected):
+    assert parse_amount(value) == expected
+
+
+@pytest.mark.parametrize('value', [
+    '', None, 'abc', '1.5000', '1.2.3', '12.34.567', '1,234.56', '1.50,0,0', '25.0000,50', '1,',
+    'nan', 'NaN', 'inf', '-inf', 'Infinity', '1e400', float('nan'), float('inf'), True,
+])
+def test_parse_amount_rejects_ambiguous_and_non_finite(value):
+    with pytest.raises(ValueError):
+        parse_amount(value)
+
+
+def test_parse_row():
+    client_data, selected = parse_row(
+        make_row(valore_bene='€ 250.000', servizi='consulenza legale; Recupero Crediti;Consulenza Legale'),
+        SERVICES)
+    assert client_data['valore_bene'] == 250000.0
+    assert math.isfinite(client_data['valore_bene'])
+    assert [service.id for service in selected] == [1, 2]
+
+
+@pytest.mark.parametrize('fields, message', [
+    ({'email': ''}, 'Campi obbligatori mancanti: email'),
+    ({'email': 'non-valida'}, 'email non è valido'),
+    ({'valore_bene': '0'}, 'maggiore di zero'),
+    ({'valore_bene': 'nan'}, 'Valore del bene non valido'),
+    ({'valore_bene': '1.5000'}, 'Valore del bene non valido'),
+    ({'servizi': ' ; '}, 'Nessun servizio indicato'),
+    ({'servizi': 'Consulenza Legale;Divorzio'}, 'Servizi inesistenti: Divorzio'),
+])
+def test_parse_row_rejects_invalid_rows(fields, message):
+    with pytest.raises(ValueError, match=message):
+        parse_row(make_row(**fields), SERVICES)
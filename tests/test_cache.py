@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from utils.cache import RedisCache
+
+
+@pytest.fixture
+def redis_cache(resp_server):
+    return RedisCache(port=resp_server.port, max_value_bytes=1024, default_ttl=60)
+
+
+def test_set_and_get(redis_cache, resp_server):
+    assert redis_cache.set('services:1', [{'id': 1, 'name': 'Consulenza Legale'}])
+    assert redis_cache.get('services:1') == [{'id': 1, 'name': 'Consulenza Legale'}]
+    assert resp_server.keys() == [b'avvocato:services:1']
+
+    redis_cache.delete('services:1')
+    assert redis_cache.get('services:1', 'assente') == 'assente'
+
+
+def test_ttl(redis_cache):
+    redis_cache.set('breve', 1, ttl=0.05)
+    redis_cache.set('predefinito', 2)
+    assert redis_cache.get('breve') == 1
+
+    time.sleep(0.1)
+    assert redis_cache.get('breve') is None
+    assert redis_cache.get('predefinito') == 2
+
+
+def test_values_larger_than_the_limit_are_not_stored(redis_cache, resp_server):
+    assert not redis_cache.set('grande', b'x' * 2048)
+    assert resp_server.keys() == []
+    assert redis_cache.get_or_set('grande', lambda: b'x' * 2048) == b'x' * 2048
+    assert redis_cache.stats()['sets'] == 0
+
+
+def test_hit_and_miss_counters(redis_cache):
+    loads = []
+    for _ in range(3):
+        redis_cache.get_or_set('statistiche:1', lambda: loads.append(1) or {'total_quotes': 2})
+    redis_cache.get('assente')
+
+    stats = redis_cache.stats()
+    assert len(loads) == 1
+    assert (stats['hits'], stats['misses'], stats['sets'], stats['errors']) == (2, 2, 1, 0)
+    assert stats['hit_ratio'] == 0.5
+
+
+def test_clear_removes_only_the_prefix(resp_server):
+    cache = RedisCache(port=resp_server.port, prefix='avvocato*')
+    for n in range(25):
+        cache.set(f'chiave{n}', n)
+    for key in (b'altra_app:x', b'avvocatoX', b'avvocato:x'):
+        resp_server.set(key, b'1')
+
+    cache.clear()
+
+    assert resp_server.keys() == [b'altra_app:x', b'avvocato:x', b'avvocatoX']
+    assert cache.get('chiave1') is None
+
+
+def test_one_connection_per_thread_with_auth_and_select(resp_server):
+    resp_server.password = 's3gret0'
+    cache = RedisCache.from_url(f'redis://:s3gret0@127.0.0.1:{resp_server.port}/2')
+    for n in range(10):
+        cache.set(f'chiave{n}', n)
+        assert cache.get(f'chiave{n}') == n
+
+    assert resp_server.connections == 1
+    assert resp_server.selected == [2]
+
+
+def test_reconnects_after_the_server_drops_the_connection(redis_cache, resp_server):
+    redis_cache.set('chiave', 1)
+    resp_server.drop_connections()
+
+    # La richiesta sulla connessione chiusa fallisce come un mancato riscontro, la successiva si riconnette
+    assert redis_cache.get('chiave') is None
+    assert redis_cache.get('chiave') == 1
+    assert resp_server.connections == 2
+    assert redis_cache.stats()['errors'] == 1
@@ -0,0 +1,14 @@
+import pytest
+
+from utils.fee_calculator import calculate_fees, fees_from_total
+
+
+@pytest.mark.parametrize('asset_value, num_services', [(1000, 1), (30000, 2), (300000, 3), (1000000, 5)])
+def test_fees_from_total(asset_value, num_services):
+    fees = calculate_fees(asset_value, num_services)
+    rebuilt = fees_from_total(round(fees['total'], 2))
+
+    assert rebuilt['total'] == round(fees['total'], 2)
+    assert sum(rebuilt[key] for key in ('professional_fee', 'expenses', 'cpa', 'iva')) == pytest.approx(rebuilt['total'])
+    for key in ('professional_fee', 'expenses', 'cpa', 'iva'):
+        assert rebuilt[key] == pytest.approx(fees[key], abs=0.01)
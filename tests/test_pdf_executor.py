@@ -0,0 +1,68 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils import pdf_executor, tenants
+
+TENANT = tenants.Tenant(1, 'default', 'Studio legale')
+CLIENT = {'nome': 'Mario', 'cognome': 'Rossi', 'valore_bene': 1000}
+SERVICES = [{'id': 1, 'name': 'Consulenza Legale', 'description': 'Consulenza'}]
+FEES = {'total': 100}
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """A one-thread pool whose renders wait for release.set()"""
+    release = threading.Event()
+    executor = ThreadPoolExecutor(1)
+    monkeypatch.setenv('PDF_EXECUTOR', 'process')
+    monkeypatch.setattr(pdf_executor, '_get_executor', lambda: executor)
+    monkeypatch.setattr(pdf_executor, 'generate_pdf', lambda *args: release.wait(5) and b'%PDF-1.4')
+    yield release
+    release.set()
+    executor.shutdown()
+
+
+def queue_empties(timeout=1):
+    # Il callback di completamento può girare appena dopo il ritorno di result()
+    deadline = time.monotonic() + timeout
+    while pdf_executor._in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return pdf_executor._in_flight == 0
+
+
+def submit():
+    return pdf_executor.submit(CLIENT, SERVICES, FEES, tenant=TENANT)
+
+
+def test_full_queue_rejects_new_pdfs(pool, monkeypatch):
+    monkeypatch.setenv('PDF_MAX_QUEUE', '2')
+    jobs = [submit(), submit()]
+    with pytest.raises(pdf_executor.PdfRejected):
+        submit()
+
+    pool.set()
+    assert [job.result(5) for job in jobs] == [b'%PDF-1.4', b'%PDF-1.4']
+    assert queue_empties()
+    assert submit().result(5) == b'%PDF-1.4'
+
+
+def test_pdf_waiting_past_the_limit_fails(pool, monkeypatch):
+    monkeypatch.setenv('PDF_MAX_QUEUE_WAIT', '0.05')
+    running, queued = submit(), submit()
+    time.sleep(0.1)
+
+    assert queued.done()
+    with pytest.raises(pdf_executor.PdfRejected):
+        queued.result()
+
+    pool.set()
+    assert running.result(5) == b'%PDF-1.4'
+    assert queue_empties()
+
+
+def test_render_refuses_a_pdf_started_after_its_deadline():
+    with pytest.raises(pdf_executor.PdfRejected):
+        pdf_executor._render(CLIENT, SERVICES, FEES, deadline=time.time() - 1)
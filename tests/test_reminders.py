@@ -0,0 +1,105 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from utils import reminders, tenants
+from utils.email_sender import SmtpBatchSender
+
+
+@pytest.fixture
+def sender(smtp_server):
+    return SmtpBatchSender(host='127.0.0.1', port=smtp_server.port, user='', password='', starttls=False,
+                           rate=1000)
+
+
+def send_all(sender, count):
+    with sender:
+        for n in range(count):
+            sender.send(sender.message(f'cliente{n}@example.com', 'Preventivo', 'Testo'))
+
+
+def test_one_connection_for_many_messages(sender, smtp_server):
+    send_all(sender, 5)
+
+    assert smtp_server.connections == 1
+    assert smtp_server.recipients() == [f'cliente{n}@example.com' for n in range(5)]
+
+
+def test_connection_renewed_after_max_per_connection(sender, smtp_server):
+    sender.max_per_connection = 2
+    send_all(sender, 5)
+
+    assert smtp_server.connections == 3
+    assert len(smtp_server.messages) == 5
+
+
+def test_reconnects_once_after_a_dropped_connection(sender, smtp_server):
+    smtp_server.drop_after = 2
+    send_all(sender, 5)
+
+    assert smtp_server.connections == 2
+    assert smtp_server.recipients() == [f'cliente{n}@example.com' for n in range(5)]
+
+
+def test_rate_limit(sender, smtp_server):
+    sender.rate = 20
+    start = time.monotonic()
+    send_all(sender, 5)
+
+    # Quattro intervalli da 1/20 s tra cinque messaggi
+    assert time.monotonic() - start >= 0.19
+    assert len(smtp_server.messages) == 5
+
+
+def test_simulation_without_smtp_host(smtp_server):
+    sender = SmtpBatchSender(host='', rate=1000)
+    assert not sender.configured
+    send_all(sender, 2)
+    assert smtp_server.connections == 0
+
+
+def save_quote(email):
+    client_data = {
+        'nome': 'Mario', 'cognome': 'Rossi', 'email': email, 'codice_fiscale': 'RSSMRA80A01H501U',
+        'telefono': '', 'indirizzo': '', 'valore_bene': 250000,
+    }
+    return database.save_quote_to_db(client_data, [{'id': 1}], {'total': 7564.08})
+
+
+def test_reminders_sent_once(storage, monkeypatch, sender, smtp_server):
+    monkeypatch.setattr(reminders, 'get_storage', lambda: storage)
+    database.import_json_services([{'id': 1, 'name': 'Consulenza Legale', 'description': 'Consulenza'}])
+    for email in ('uno@example.com', 'due@example.com', 'rifiutato@example.com', 'rinviato@example.com'):
+        save_quote(email)
+    smtp_server.refuse = {'rifiutato@example.com': 550, 'rinviato@example.com': 450}
+    # Preventivi di oggi, a cinque giorni dalla scadenza
+    now = datetime.now() + timedelta(days=reminders.QUOTE_VALIDITY_DAYS - 5)
+
+    report = reminders.send_expiry_reminders(days=7, sender=sender, now=now, tenant_list=tenants.all_tenants())
+    assert {key: report[key] for key in ('due', 'sent', 'refused', 'deferred', 'dry_run')} == {
+        'due': 4, 'sent': 2, 'refused': 1, 'deferred': 1, 'dry_run': False}
+    assert smtp_server.recipients() == ['uno@example.com', 'due@example.com']
+    assert smtp_server.connections == 1
+    assert b'Gentile Mario Rossi' in smtp_server.messages[0][2]
+
+    # Seconda esecuzione: solo il rifiuto temporaneo viene ritentato, nessun doppio invio
+    smtp_server.refuse = {}
+    report = reminders.send_expiry_reminders(days=7, sender=sender, now=now, tenant_list=tenants.all_tenants())
+    assert (report['due'], report['sent'], report['refused'], report['deferred']) == (1, 1, 0, 0)
+    assert smtp_server.recipients() == ['uno@example.com', 'due@example.com', 'rinviato@example.com']
+
+    report = reminders.send_expiry_reminders(days=7, sender=sender, now=now, tenant_list=tenants.all_tenants())
+    assert report['due'] == 0
+    assert len(smtp_server.messages) == 3
+
+
+def test_reminders_outside_the_window_are_not_due(storage, monkeypatch, sender, smtp_server):
+    monkeypatch.setattr(reminders, 'get_storage', lambda: storage)
+    database.import_json_services([{'id': 1, 'name': 'Consulenza Legale', 'description': 'Consulenza'}])
+    save_quote('uno@example.com')
+
+    report = reminders.send_expiry_reminders(days=7, sender=sender, tenant_list=tenants.all_tenants())
+    assert (report['due'], report['sent']) == (0, 0)
+    assert smtp_server.connections == 0
@@ -0,0 +1,188 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+import database
+from storage.base import DEFAULT_TENANT_ID, money
+
+SERVICES = [
+    {'id': 1, 'name': 'Consulenza Legale', 'description': 'Consulenza'},
+    {'id': 2, 'name': 'Recupero Crediti', 'description': 'Recupero', 'file_content': 'modello'},
+]
+
+
+def make_client(**fields):
+    client_data = {
+        'nome': 'Mario', 'cognome': 'Rossi', 'email': 'mario.rossi@example.com',
+        'codice_fiscale': 'RSSMRA80A01H501U', 'telefono': '', 'indirizzo': '',
+        'valore_bene': 250000,
+    }
+    client_data.update(fields)
+    return client_data
+
+
+def test_initialize_is_idempotent(storage):
+    database.initialize_database()
+    assert [tenant['id'] for tenant in database.load_tenants()] == [DEFAULT_TENANT_ID]
+
+
+def test_import_services_writes_only_changes(storage):
+    assert database.import_json_services(SERVICES)['inserted'] == 2
+
+    report = database.import_json_services([SERVICES[0], dict(SERVICES[1], description='Recupero crediti')])
+    assert (report['inserted'], report['updated'], report['unchanged']) == (0, 1, 1)
+    services = {service['id']: service for service in database.load_services_from_db()}
+    assert services[2]['description'] == 'Recupero crediti'
+    assert services[2]['file_content'] == 'modello'
+
+
+@pytest.mark.parametrize('value, expected', [
+    (7564.07808, 7564.08), (0.125, 0.13), (2.675, 2.68), (-1.005, -1.01), (100, 100.0),
+])
+def test_money(value, expected):
+    assert money(value) == expected
+
+
+def test_save_and_get_quote(storage):
+    database.import_json_services(SERVICES)
+    quote_id = database.save_quote_to_db(make_client(valore_bene=1000.005), SERVICES, {'total': 7564.07808})
+
+    quote = database.get_quote(quote_id)
+    assert quote['nome'] == 'Mario'
+    assert quote['valore_bene'] == 1000.01
+    assert quote['total_fee'] == 7564.08
+    assert [service['name'] for service in quote['services']] == ['Consulenza Legale', 'Recupero Crediti']
+    assert database.get_quote(quote_id, tenant_id=DEFAULT_TENANT_ID + 1) is None
+
+
+def test_save_quotes_in_one_transaction(storage):
+    database.import_json_services(SERVICES)
+    quote_ids = database.save_quotes_to_db([
+        (make_client(nome=f'Cliente {n}'), SERVICES[:1], {'total': 1000 + n / 3}) for n in range(3)
+    ])
+
+    assert len(set(quote_ids)) == 3
+    assert [database.get_quote(quote_id)['total_fee'] for quote_id in quote_ids] == [1000.0, 1000.33, 1000.67]
+
+
+def test_search_quotes(storage):
+    database.import_json_services(SERVICES)
+    rossi = database.save_quote_to_db(make_client(), SERVICES[:1], {'total': 100})
+    bianchi = database.save_quote_to_db(
+        make_client(cognome='Bianchi', email='bianchi@example.com', codice_fiscale='BNCLRA80A01H501U'),
+        SERVICES[1:], {'total': 200})
+
+    assert [quote['id'] for quote in database.search_quotes('rossi')['quotes']] == [rossi]
+    assert [quote['id'] for quote in database.search_quotes('recupero')['quotes']] == [bianchi]
+    assert database.search_quotes('100%')['quotes'] == []
+    assert database.search_quotes('  ')['quotes'] == []
+
+    page = database.search_quotes('example.com', page=1, page_size=1)
+    assert len(page['quotes']) == 1 and page['has_more']
+    assert not database.search_quotes('example.com', page=2, page_size=1)['has_more']
+
+
+def test_quote_pdfs(storage):
+    database.import_json_services(SERVICES)
+    first, second, third = (database.save_quote_to_db(make_client(), SERVICES[:1], {'total': 100})
+                            for _ in range(3))
+
+    database.save_quote_pdf(first, b'%PDF-1.4 primo')
+    database.save_quote_pdfs([(second, b'%PDF-1.4 primo'), (first, b'%PDF-1.4 rigenerato')])
+
+    assert database.get_quote_pdf(first) == b'%PDF-1.4 rigenerato'
+    assert database.get_quote_pdf(second) == b'%PDF-1.4 primo'
+    assert database.get_quote_pdf(third) is None
+    assert database.quotes_with_pdf([first, second, third]) == {first, second}
+    assert database.quotes_with_pdf([]) == set()
+
+
+def test_service_statistics(storage):
+    database.import_json_services(SERVICES)
+    database.save_quote_to_db(make_client(valore_bene=1000), SERVICES, {'total': 100})
+    database.save_quote_to_db(make_client(valore_bene=3000), SERVICES[:1], {'total': 300})
+
+    stats = database.get_service_statistics()
+    assert [(row['name'], row['count']) for row in stats['service_counts']] == [
+        ('Consulenza Legale', 2), ('Recupero Crediti', 1)]
+    assert stats['service_values'][0]['avg_fee'] == 200
+    assert sum(row['count'] for row in stats['monthly_counts']) == 2
+    assert stats['total_stats'] == {'total_quotes': 2, 'avg_value': 2000, 'avg_fee': 200}
+
+
+def test_service_statistics_of_an_empty_database(storage):
+    stats = database.get_service_statistics()
+    assert stats['service_counts'] == []
+    assert stats['total_stats']['total_quotes'] == 0
+
+
+def make_old(storage, quote_ids, created_at):
+    conn = storage.connect()
+    conn.executemany("UPDATE quotes SET created_at = ? WHERE id = ?", [(created_at, quote_id) for quote_id in quote_ids])
+    conn.commit()
+    conn.close()
+
+
+def count_rows(storage, table):
+    conn = storage.connect()
+    count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_archive_round_trip(storage, monkeypatch, tmp_path):
+    pytest.importorskip('pyarrow')
+    pytest.importorskip('duckdb')
+    from utils import archive
+    monkeypatch.setattr(archive, 'get_storage', lambda: storage)
+
+    database.import_json_services(SERVICES)
+    old = [database.save_quote_to_db(make_client(nome=f'Cliente {n}', valore_bene=1000), SERVICES, {'total': 100.005})
+           for n in range(2)]
+    recent = database.save_quote_to_db(make_client(nome='Recente', valore_bene=3000), SERVICES[:1], {'total': 300})
+    database.save_quote_pdf(old[0], b'%PDF-1.4 archiviato')
+    make_old(storage, old, datetime(2024, 3, 10, 12))
+
+    archived = archive.archive_quotes(older_than_days=30)
+    assert [(month['month'], month['quotes']) for month in archived] == [('2024-03', 2)]
+
+    # Nel database restano il preventivo recente e il suo cliente, senza PDF né blob orfani
+    assert [database.get_quote(quote_id) for quote_id in old] == [None, None]
+    assert database.get_quote(recent)['nome'] == 'Recente'
+    assert count_rows(storage, 'clients') == 1
+    assert count_rows(storage, 'pdf_blobs') == 0
+
+    rows = list(archive.iter_archived_quotes_for_export(DEFAULT_TENANT_ID))
+    assert [row[0] for row in rows] == old
+    assert rows[0][3] == Decimal('100.01')
+    assert rows[0][4] == 'Cliente 0'
+    assert rows[0][10] == 'Consulenza Legale; Recupero Crediti'
+    assert list(archive.iter_archived_quotes_for_export(DEFAULT_TENANT_ID + 1)) == []
+
+    # Le statistiche sommano i preventivi archiviati a quelli nel database (lettura con DuckDB)
+    stats = database.get_service_statistics()
+    assert [(row['name'], row['count']) for row in stats['service_counts']] == [
+        ('Consulenza Legale', 3), ('Recupero Crediti', 2)]
+    assert {(row['year'], row['month']): row['count'] for row in stats['monthly_counts']}[(2024, 3)] == 2
+    assert stats['total_stats']['total_quotes'] == 3
+    assert stats['total_stats']['avg_value'] == pytest.approx(5000 / 3)
+    assert stats['total_stats']['avg_fee'] == pytest.approx((100.01 * 2 + 300) / 3)
+
+
+def test_purge_keeps_clients_with_other_quotes(storage):
+    database.import_json_services(SERVICES)
+    old, kept = (database.save_quote_to_db(make_client(), SERVICES[:1], {'total': 100}) for _ in range(2))
+    make_old(storage, [old], datetime(2024, 3, 10, 12))
+    # Un cliente con un preventivo archiviato e uno ancora nel database
+    conn = storage.connect()
+    conn.execute("UPDATE quotes SET client_id = (SELECT client_id FROM quotes WHERE id = ?) WHERE id = ?", (old, kept))
+    conn.execute("DELETE FROM clients WHERE id NOT IN (SELECT client_id FROM quotes)")
+    conn.commit()
+    conn.close()
+
+    storage.purge_quotes(datetime(2024, 3, 1), datetime(2024, 4, 1), old)
+
+    assert database.get_quote(old) is None
+    assert database.get_quote(kept)['nome'] == 'Mario'
+    assert count_rows(storage, 'clients') == 1
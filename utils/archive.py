@@ -0,0 +1,311 @@
+"""
+Archivio dei preventivi in file Parquet.
+
+I preventivi più vecchi di ARCHIVE_AFTER_DAYS giorni (default 30, la validità
+indicata nel PDF del preventivo) vengono spostati dal database in file Parquet
+compressi con zstd, partizionati per mese:
+
+    ARCHIVE_DIR/quotes/year=2024/month=3/part-<primo id>-<ultimo id>.parquet
+
+I file contengono i preventivi di tutti gli studi (colonna tenant_id; i file
+scritti prima del supporto multi-studio appartengono allo studio predefinito).
+Le statistiche e le esportazioni di uno studio includono i suoi preventivi
+archiviati leggendo i file con DuckDB. pyarrow (scrittura) e duckdb (lettura) vengono importati solo
+quando servono.
+"""
+import itertools
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from storage import get_storage
+from storage.base import ARCHIVE_COLUMNS, DEFAULT_TENANT_ID
+
+logger = logging.getLogger("avvocato.archive")
+
+DEFAULT_ARCHIVE_DIR = os.path.join("data", "archive")
+
+CENTS = Decimal("0.01")
+
+
+def archive_dir():
+    """Root directory of the archive (ARCHIVE_DIR, default data/archive)"""
+    return os.environ.get("ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR)
+
+
+def _quotes_dir(directory=None):
+    return os.path.join(directory or archive_dir(), "quotes")
+
+
+def _month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def _next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _schema():
+    import pyarrow as pa
+
+    money = pa.decimal128(15, 2)
+    types = {
+        'quote_id': pa.int64(),
+        'created_at': pa.timestamp('us'),
+        'valore_bene': money,
+        'total_fee': money,
+        'client_id': pa.int64(),
+        'service_ids': pa.list_(pa.int64()),
+        'services': pa.list_(pa.string()),
+        'tenant_id': pa.int64(),
+    }
+    return pa.schema([(column, types.get(column, pa.string())) for column in ARCHIVE_COLUMNS])
+
+
+def _to_decimal(value):
+    # SQLite restituisce i NUMERIC come float
+    if value is None or isinstance(value, Decimal):
+        return value
+    return Decimal(str(value)).quantize(CENTS)
+
+
+def _archive_range(storage, start, end, directory, chunk_size):
+    """Write the quotes created in [start, end) to one Parquet file, then delete them from the database"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    month_dir = os.path.join(_quotes_dir(directory), f"year={start.year}", f"month={start.month}")
+    os.makedirs(month_dir, exist_ok=True)
+    temp_path = os.path.join(month_dir, f".part-{uuid.uuid4().hex}.tmp")
+
+    schema = _schema()
+    money_columns = {ARCHIVE_COLUMNS.index('valore_bene'), ARCHIVE_COLUMNS.index('total_fee')}
+    count = 0
+    first_id = last_id = None
+
+    rows = storage.iter_quotes_for_archive(start, end, chunk_size)
+    writer = None
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            columns = [
+                [_to_decimal(value) for value in values] if i in money_columns else list(values)
+                for i, values in enumerate(zip(*chunk))
+            ]
+            if writer is None:
+                writer = pq.ParquetWriter(temp_path, schema, compression='zstd')
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            count += len(chunk)
+            # Le righe arrivano ordinate per id
+            first_id = chunk[0][0] if first_id is None else first_id
+            last_id = chunk[-1][0]
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.unlink(temp_path)
+        raise
+
+    if writer is None:
+        return None
+    writer.close()
+
+    # Nome deterministico: se l'eliminazione fallisce, la ripetizione riscrive lo stesso file
+    path = os.path.join(month_dir, f"part-{first_id}-{last_id}.parquet")
+    os.replace(temp_path, path)
+    storage.purge_quotes(start, end, last_id)
+
+    return {'month': f"{start.year}-{start.month:02d}", 'quotes': count, 'path': path}
+
+
+def archive_quotes(older_than_days=None, directory=None, chunk_size=5000):
+    """
+    Move the quotes older than older_than_days days (default ARCHIVE_AFTER_DAYS)
+    from the database to the Parquet archive, one month at a time
+
+    Returns:
+        list: One dictionary per archived month with 'month', 'quotes' and 'path'
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise RuntimeError("L'archiviazione dei preventivi richiede il pacchetto pyarrow")
+
+    if older_than_days is None:
+        older_than_days = int(os.environ.get("ARCHIVE_AFTER_DAYS", "30"))
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+
+    storage = get_storage()
+    oldest = storage.oldest_quote_date()
+    archived = []
+    if oldest is None:
+        return archived
+
+    month = _month_start(oldest)
+    while month < cutoff:
+        result = _archive_range(storage, month, min(_next_month(month), cutoff), directory, chunk_size)
+        if result:
+            logger.info("Archiviati %d preventivi di %s in %s", result['quotes'], result['month'], result['path'])
+            archived.append(result)
+        month = _next_month(month)
+
+    return archived
+
+
+def has_archive(directory=None):
+    """Whether the archive contains at least one Parquet file"""
+    for _, _, files in os.walk(_quotes_dir(directory)):
+        if any(name.endswith(".parquet") for name in files):
+            return True
+    return False
+
+
+def _connect():
+    try:
+        import duckdb
+    except ImportError:
+        raise RuntimeError("La lettura dell'archivio dei preventivi richiede il pacchetto duckdb")
+    return duckdb.connect()
+
+
+def _source(directory=None):
+    """DuckDB table expression over every archived quote (year and month come from the path)"""
+    pattern = os.path.join(_quotes_dir(directory), "**", "*.parquet").replace("'", "''")
+    # union_by_name: i file senza tenant_id si leggono insieme agli altri (colonna NULL)
+    return f"read_parquet('{pattern}', hive_partitioning = true, union_by_name = true)"
+
+
+def _tenant_source(con, tenant_id, directory=None):
+    """DuckDB table expression over the archived quotes of one tenant"""
+    source = _source(directory)
+    columns = {column[0] for column in con.execute(f"SELECT * FROM {source} LIMIT 0").description}
+    tenant = f"COALESCE(tenant_id, {DEFAULT_TENANT_ID})" if 'tenant_id' in columns else str(DEFAULT_TENANT_ID)
+    return f"(SELECT * FROM {source} WHERE {tenant} = {int(tenant_id)})"
+
+
+def archived_statistics(tenant_id, directory=None):
+    """
+    Aggregate the archive of a tenant with DuckDB: per service (count, value and
+    fee sums), per month (count) and overall (count, value and fee sums)
+    """
+    con = _connect()
+    try:
+        source = _tenant_source(con, tenant_id, directory)
+        services = con.execute(f"""
+        SELECT service_id, any_value(service_name), COUNT(*), SUM(valore_bene), SUM(total_fee)
+        FROM (
+            SELECT UNNEST(service_ids) AS service_id, UNNEST(services) AS service_name,
+                   valore_bene, total_fee
+            FROM {source}
+        )
+        GROUP BY service_id
+        """).fetchall()
+        monthly = con.execute(f"SELECT year, month, COUNT(*) FROM {source} GROUP BY year, month").fetchall()
+        totals = con.execute(f"SELECT COUNT(*), SUM(valore_bene), SUM(total_fee) FROM {source}").fetchone()
+    finally:
+        con.close()
+
+    return {'services': services, 'monthly': monthly, 'totals': totals}
+
+
+def _weighted_average(live_average, live_count, archived_sum, archived_count):
+    count = live_count + archived_count
+    if not count:
+        return 0
+    return (float(live_average or 0) * live_count + float(archived_sum or 0)) / count
+
+
+def include_archived_statistics(stats, tenant_id, directory=None):
+    """
+    Merge the archived quotes of a tenant into the result of get_service_statistics.
+    Without an archive (or without duckdb) the statistics are returned unchanged.
+    """
+    if not has_archive(directory):
+        return stats
+    try:
+        archived = archived_statistics(tenant_id, directory)
+    except RuntimeError as e:
+        logger.warning("Statistiche senza i preventivi archiviati: %s", e)
+        return stats
+
+    counts = {service['id']: dict(service) for service in stats['service_counts']}
+    live_counts = {service_id: service['count'] for service_id, service in counts.items()}
+    values = {service['id']: dict(service) for service in stats['service_values']}
+
+    for service_id, name, count, value_sum, fee_sum in archived['services']:
+        entry = counts.setdefault(service_id, {'id': service_id, 'name': name, 'count': 0})
+        entry['count'] += count
+
+        live_count = live_counts.get(service_id, 0)
+        value = values.setdefault(service_id, {'id': service_id, 'name': entry['name'],
+                                               'avg_value': 0, 'avg_fee': 0})
+        value['avg_value'] = _weighted_average(value['avg_value'], live_count, value_sum, count)
+        value['avg_fee'] = _weighted_average(value['avg_fee'], live_count, fee_sum, count)
+
+    monthly = {(month['year'], month['month']): month['count'] for month in stats['monthly_counts']}
+    for year, month, count in archived['monthly']:
+        monthly[(int(year), int(month))] = monthly.get((int(year), int(month)), 0) + count
+
+    totals = stats['total_stats']
+    archived_count, value_sum, fee_sum = archived['totals']
+    live_count = totals['total_quotes']
+
+    return {
+        'service_counts': sorted(counts.values(), key=lambda service: service['count'], reverse=True),
+        'service_values': sorted(values.values(), key=lambda service: service['name']),
+        'monthly_counts': [
+            {'year': year, 'month': month, 'count': count}
+            for (year, month), count in sorted(monthly.items())
+        ],
+        'total_stats': {
+            'total_quotes': live_count + archived_count,
+            'avg_value': _weighted_average(totals['avg_value'], live_count, value_sum, archived_count),
+            'avg_fee': _weighted_average(totals['avg_fee'], live_count, fee_sum, archived_count),
+        }
+    }
+
+
+def iter_archived_quotes_for_export(tenant_id, directory=None, chunk_size=5000):
+    """Yield the archived quotes of a tenant in EXPORT_COLUMNS order (services joined with '; '), by id"""
+    if not has_archive(directory):
+        return
+
+    con = _connect()
+    try:
+        cur = con.execute(f"""
+        SELECT quote_id, created_at, valore_bene, total_fee,
+               nome, cognome, email, telefono, codice_fiscale, indirizzo,
+               array_to_string(list_sort(services), '; ')
+        FROM {_tenant_source(con, tenant_id, directory)}
+        ORDER BY quote_id
+        """)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        con.close()
+
+
+def iter_archived_quote_pricing(tenant_id, directory=None, chunk_size=50000):
+    """Yield (valore_bene as float, year, month, service ids) for every archived quote of a tenant"""
+    if not has_archive(directory):
+        return
+
+    con = _connect()
+    try:
+        cur = con.execute(f"""
+        SELECT CAST(valore_bene AS DOUBLE), year(created_at), month(created_at), service_ids
+        FROM {_tenant_source(con, tenant_id, directory)}
+        """)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        con.close()
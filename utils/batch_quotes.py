@@ -0,0 +1,309 @@
+"""
+Preventivi in blocco da un file CSV o XLSX (liste di pratiche delle assicurazioni).
+
+Una riga per cliente, con intestazioni come quelle dell'esportazione
+(utils.exporter) o in forma breve:
+
+    nome, cognome, email, telefono, codice_fiscale, indirizzo, valore_bene, servizi
+
+I servizi sono nomi del catalogo separati da ';'. Le righe vengono lette a
+blocchi: ogni blocco è calcolato con utils.fee_calculator (con il tariffario
+dello studio corrente, utils.tenants), salvato con una sola
+transazione (facoltativo) e passato a un pool di processi che genera i PDF su
+tutti i core; i PDF dei preventivi salvati vengono archiviati anche nel
+database (database.save_quote_pdfs), un blocco per transazione. Il numero di PDF in coda è limitato, quindi la memoria non
+dipende dalla lunghezza del file. Il riepilogo CSV riporta l'esito di ogni riga.
+"""
+import csv
+import itertools
+import math
+import multiprocessing
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import database
+from utils import catalog, tenants
+from utils.fee_calculator import calculate_fees
+from utils.pdf_generator import generate_pdf
+
+EMAIL_REGEX = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+
+REQUIRED_FIELDS = ('nome', 'cognome', 'email', 'codice_fiscale')
+
+# Intestazioni accettate (minuscole, spazi come '_') -> campo
+COLUMN_ALIASES = {
+    'nome': 'nome',
+    'cognome': 'cognome',
+    'email': 'email',
+    'telefono': 'telefono',
+    'codice_fiscale': 'codice_fiscale',
+    'indirizzo': 'indirizzo',
+    'valore_bene': 'valore_bene',
+    'valore_del_bene': 'valore_bene',
+    'servizi': 'servizi',
+}
+
+SUMMARY_HEADERS = [
+    'Riga', 'Esito', 'ID Preventivo', 'Nome', 'Cognome', 'Valore del bene', 'Servizi',
+    'Onorari', 'Spese forfettarie', 'CPA', 'IVA', 'Totale', 'PDF', 'Errore'
+]
+
+
+def _normalize_header(header):
+    key = re.sub(r'\s+', '_', str(header or '').strip().lower())
+    return COLUMN_ALIASES.get(key)
+
+
+def _iter_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        headers = next(reader, [])
+        yield headers
+        yield from reader
+
+
+def _iter_xlsx(path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RuntimeError("La lettura di file XLSX richiede il pacchetto openpyxl")
+
+    # read_only legge il foglio in streaming senza caricarlo tutto
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_input_rows(path):
+    """Yield (line number, {field: value}) for every non-empty data row of a CSV or XLSX file"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.xlsx':
+        rows = _iter_xlsx(path)
+    elif extension == '.csv':
+        rows = _iter_csv(path)
+    else:
+        raise ValueError(f"Formato non supportato: {extension or path} (usare .csv o .xlsx)")
+
+    fields = [_normalize_header(header) for header in next(rows, [])]
+    missing = [field for field in REQUIRED_FIELDS + ('valore_bene', 'servizi') if field not in fields]
+    if missing:
+        raise ValueError(f"Colonne mancanti nel file: {', '.join(missing)}")
+
+    for line, values in enumerate(rows, start=2):
+        if not any(value not in (None, '') for value in values):
+            continue
+        yield line, {field: value for field, value in zip(fields, values) if field}
+
+
+# Importo con il punto per le migliaia ('1.500', '250.000')
+_THOUSANDS_REGEX = re.compile(r'^-?\d{1,3}(\.\d{3})+$')
+# Importo con al più un punto decimale e una o due cifre dopo ('250000', '250000.5')
+_DECIMAL_REGEX = re.compile(r'^-?\d+(\.\d{1,2})?$')
+
+
+def parse_amount(value):
+    """
+    Asset value from a number or a string such as '250000', '250000.50',
+    '250.000' or '€ 250.000,50'; raises ValueError for ambiguous or non-finite values
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        amount = float(value)
+    else:
+        text = str(value or '').replace('€', '').replace(' ', '').replace('\xa0', '').strip()
+        if ',' in text:
+            # Formato italiano: punto per le migliaia, virgola per i decimali
+            integer, _, decimals = text.partition(',')
+            if not (_THOUSANDS_REGEX.match(integer) or re.match(r'^-?\d+$', integer)) \
+                    or not re.match(r'^\d+$', decimals):
+                raise ValueError(f"Valore del bene non valido: {value!r}")
+            text = integer.replace('.', '') + '.' + decimals
+        elif _THOUSANDS_REGEX.match(text):
+            text = text.replace('.', '')
+        elif not _DECIMAL_REGEX.match(text):
+            # Per esempio '1.5000' o '1.2.3': migliaia o decimali non si distinguono
+            raise ValueError(f"Valore del bene non valido: {value!r}")
+        amount = float(text)
+    if not math.isfinite(amount):
+        raise ValueError(f"Valore del bene non valido: {value!r}")
+    return amount
+
+
+def parse_row(row, services):
+    """
+    Validate one input row against the service catalog (utils.catalog.Catalog)
+
+    Returns:
+        tuple: (client_data, selected_services); raises ValueError with the reason otherwise
+    """
+    client_data = {field: str(row.get(field) or '').strip()
+                   for field in REQUIRED_FIELDS + ('telefono', 'indirizzo')}
+    missing = [field for field in REQUIRED_FIELDS if not client_data[field]]
+    if missing:
+        raise ValueError(f"Campi obbligatori mancanti: {', '.join(missing)}")
+    if not re.match(EMAIL_REGEX, client_data['email']):
+        raise ValueError("L'indirizzo email non è valido")
+
+    client_data['valore_bene'] = parse_amount(row.get('valore_bene'))
+    if client_data['valore_bene'] <= 0:
+        raise ValueError("Il valore del bene deve essere maggiore di zero")
+
+    names = [name.strip() for name in str(row.get('servizi') or '').split(';') if name.strip()]
+    if not names:
+        raise ValueError("Nessun servizio indicato")
+    unknown = [name for name in names if services.find(name) is None]
+    if unknown:
+        raise ValueError(f"Servizi inesistenti: {', '.join(unknown)}")
+
+    selected = {services.find(name).id: services.find(name) for name in names}
+    return client_data, list(selected.values())
+
+
+def pdf_filename(line, client_data):
+    filename = f"Preventivo_{line:06d}_{client_data['cognome']}_{client_data['nome']}.pdf"
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', filename)
+
+
+def _render_pdf(path, client_data, selected_services, fees, return_pdf=False, branding=None):
+    # Eseguita nei processi del pool: il PDF va su disco e torna al processo
+    # principale solo se deve essere archiviato nel database
+    pdf_bytes = generate_pdf(client_data, selected_services, fees, branding)
+    with open(path, 'wb') as f:
+        f.write(pdf_bytes)
+    return pdf_bytes if return_pdf else len(pdf_bytes)
+
+
+def _chunks(rows, chunk_size):
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _summary_row(entry):
+    fees = entry.get('fees') or {}
+    client_data = entry['client_data']
+    return [
+        entry['line'], entry['status'], entry.get('quote_id') or '',
+        client_data.get('nome', ''), client_data.get('cognome', ''), client_data.get('valore_bene', ''),
+        '; '.join(service['name'] for service in entry.get('services', [])),
+        *(round(fees[key], 2) if key in fees else '' for key in ('professional_fee', 'expenses', 'cpa', 'iva', 'total')),
+        entry.get('pdf') or '', entry.get('error') or '',
+    ]
+
+
+def batch_quotes(input_path, output_dir, persist=False, render_pdfs=True, workers=None,
+                 chunk_size=500, summary_path=None, tenant=None):
+    """
+    Price every row of input_path, optionally save the quotes and write one PDF per quote,
+    all for one tenant (default: the current one)
+
+    Args:
+        input_path (str): File CSV o XLSX
+        output_dir (str): Cartella dei PDF (e del riepilogo, se summary_path non è indicato)
+        persist (bool): Salva i preventivi nel database, una transazione per blocco
+        render_pdfs (bool): Genera i PDF
+        workers (int): Processi per i PDF (default: numero di core)
+        chunk_size (int): Righe elaborate per ogni blocco
+        summary_path (str): Percorso del riepilogo CSV (default output_dir/riepilogo.csv)
+        tenant (Tenant): Studio: catalogo, tariffario, intestazione dei PDF e archiviazione
+
+    Returns:
+        dict: Conteggi ('rows', 'priced', 'errors', 'saved', 'pdfs', 'pdf_errors'),
+              'total_fees', 'summary_path' e 'elapsed_seconds'
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    summary_path = summary_path or os.path.join(output_dir, 'riepilogo.csv')
+
+    tenant = tenant or tenants.current()
+    services = catalog.get_catalog(catalog.DatabaseSource(tenant.id))
+    report = {'rows': 0, 'priced': 0, 'errors': 0, 'saved': 0, 'pdfs': 0, 'pdf_errors': 0, 'total_fees': 0.0}
+
+    # spawn: i processi figli non ereditano le connessioni al database del processo principale
+    executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) if render_pdfs else None
+    # Al massimo qualche PDF in attesa per processo: il resto del file non viene letto finché non si liberano
+    max_pending = workers * 4
+    pending = deque()
+    # PDF dei preventivi salvati in attesa di essere archiviati nel database
+    pdfs_to_store = []
+
+    def store_pdfs():
+        if pdfs_to_store:
+            database.save_quote_pdfs(pdfs_to_store, tenant.id)
+            pdfs_to_store.clear()
+
+    def write_oldest(writer):
+        entry, future = pending.popleft()
+        if future is not None:
+            try:
+                result = future.result()
+                report['pdfs'] += 1
+                if entry.get('quote_id'):
+                    pdfs_to_store.append((entry['quote_id'], result))
+                    if len(pdfs_to_store) >= chunk_size:
+                        store_pdfs()
+            except Exception as e:
+                report['pdf_errors'] += 1
+                entry.update(status='errore PDF', pdf=None, error=str(e))
+        writer.writerow(_summary_row(entry))
+
+    try:
+        with open(summary_path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(SUMMARY_HEADERS)
+
+            for chunk in _chunks(iter_input_rows(input_path), chunk_size):
+                entries = []
+                for line, row in chunk:
+                    report['rows'] += 1
+                    try:
+                        client_data, selected_services = parse_row(row, services)
+                    except ValueError as e:
+                        report['errors'] += 1
+                        entries.append({'line': line, 'status': 'scartata', 'client_data': row, 'error': str(e)})
+                        continue
+                    fees = calculate_fees(client_data['valore_bene'], len(selected_services), tenant.tariff)
+                    report['priced'] += 1
+                    report['total_fees'] += fees['total']
+                    entries.append({'line': line, 'status': 'calcolato', 'client_data': client_data,
+                                    'services': selected_services, 'fees': fees})
+
+                priced = [entry for entry in entries if 'fees' in entry]
+                if persist and priced:
+                    quote_ids = database.save_quotes_to_db(
+                        [(entry['client_data'], entry['services'], entry['fees']) for entry in priced], tenant.id)
+                    for entry, quote_id in zip(priced, quote_ids):
+                        entry.update(status='salvato', quote_id=quote_id)
+                    report['saved'] += len(quote_ids)
+
+                for entry in entries:
+                    future = None
+                    if executor is not None and 'fees' in entry:
+                        entry['pdf'] = pdf_filename(entry['line'], entry['client_data'])
+                        # Ai processi del pool solo i campi usati dal PDF, non l'eventuale documento allegato
+                        pdf_services = [{'id': service.id, 'name': service.name, 'description': service.description}
+                                        for service in entry['services']]
+                        future = executor.submit(_render_pdf, os.path.join(output_dir, entry['pdf']),
+                                                 entry['client_data'], pdf_services, entry['fees'],
+                                                 bool(entry.get('quote_id')), tenant.branding)
+                    pending.append((entry, future))
+                    while len(pending) > max_pending:
+                        write_oldest(writer)
+
+            while pending:
+                write_oldest(writer)
+            store_pdfs()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    report['summary_path'] = summary_path
+    report['elapsed_seconds'] = time.perf_counter() - start
+    return report
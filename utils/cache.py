@@ -0,0 +1,398 @@
+"""
+Cache condivisa tra sessioni, processi e istanze.
+
+Il backend si sceglie con CACHE_URL:
+
+    memory://                       LRU nel processo (default)
+    sqlite:///percorso/cache.db     file SQLite locale, condiviso dai processi della macchina
+    redis://[:password@]host:6379/0 server Redis (o compatibile), condiviso da tutte le istanze
+
+Limiti e scadenze:
+
+    CACHE_MAX_ENTRIES   voci massime della cache in memoria (default 1000)
+    CACHE_MAX_MB        spazio massimo (memoria e SQLite) e dimensione massima
+                        di un singolo valore (tutti i backend) (default 64)
+    CACHE_DEFAULT_TTL   scadenza in secondi quando set() non la indica (default 300)
+
+Con Redis il limite complessivo è quello del server (maxmemory con una policy
+allkeys-lru). I valori sono serializzati con pickle: chi legge riceve sempre
+una copia. Hit, miss e scritture vengono contati per backend e compaiono tra
+le metriche (cache_requests_total). Un backend non raggiungibile si comporta
+come una cache vuota: l'applicazione continua a funzionare senza cache.
+"""
+import logging
+import os
+import pickle
+import re
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import unquote, urlparse
+
+from utils import metrics
+
+logger = logging.getLogger("avvocato.cache")
+
+_MISSING = object()
+
+
+class Cache:
+    """Common API; backends implement _get, _set, _delete and clear on pickled bytes"""
+
+    name = 'cache'
+
+    def __init__(self, max_value_bytes=None, default_ttl=None):
+        self.max_value_bytes = max_value_bytes or _max_bytes()
+        self.default_ttl = default_ttl if default_ttl is not None else float(
+            os.environ.get("CACHE_DEFAULT_TTL", "300"))
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0, 'errors': 0}
+
+    def _count(self, stat, value=1):
+        with self._stats_lock:
+            self._stats[stat] += value
+        if stat in ('hits', 'misses'):
+            metrics.increment("cache_requests_total", value, backend=self.name,
+                              result='hit' if stat == 'hits' else 'miss')
+        elif stat == 'evictions':
+            metrics.increment("cache_evictions_total", value, backend=self.name)
+
+    def stats(self):
+        """Counters of this process: hits, misses, sets, evictions, errors and hit_ratio"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _failed(self, operation, error):
+        self._count('errors')
+        logger.warning("Cache %s non disponibile (%s): %s", self.name, operation, error)
+
+    def get(self, key, default=None):
+        try:
+            data = self._get(key)
+        except (OSError, sqlite3.Error) as e:
+            self._failed('get', e)
+            data = None
+        if data is None:
+            self._count('misses')
+            return default
+        self._count('hits')
+        return pickle.loads(data)
+
+    def set(self, key, value, ttl=None):
+        """Store value for ttl seconds (default_ttl if None); values larger than max_value_bytes are skipped"""
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_value_bytes:
+            return False
+        try:
+            self._set(key, data, self.default_ttl if ttl is None else ttl)
+        except (OSError, sqlite3.Error) as e:
+            self._failed('set', e)
+            return False
+        self._count('sets')
+        return True
+
+    def delete(self, key):
+        try:
+            self._delete(key)
+        except (OSError, sqlite3.Error) as e:
+            self._failed('delete', e)
+
+    def get_or_set(self, key, loader, ttl=None):
+        """Return the cached value or compute it with loader() and store it"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value, ttl)
+        return value
+
+
+class MemoryCache(Cache):
+    """LRU in the process, bounded by number of entries and total bytes"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=None, max_bytes=None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries or int(os.environ.get("CACHE_MAX_ENTRIES", "1000"))
+        self.max_bytes = max_bytes or _max_bytes()
+        self._lock = threading.Lock()
+        # chiave -> (scadenza, bytes), dalla meno alla più recentemente usata
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _remove(self, key):
+        _, data = self._entries.pop(key)
+        self._bytes -= len(data)
+
+    def _set(self, key, data, ttl):
+        evicted = 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, data)
+            self._bytes += len(data)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                evicted += 1
+        if evicted:
+            self._count('evictions', evicted)
+
+    def _delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class SQLiteCache(Cache):
+    """Local file cache shared by the processes of one machine, bounded by total bytes"""
+
+    name = 'sqlite'
+
+    def __init__(self, path, max_bytes=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_bytes = max_bytes or _max_bytes()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at_idx ON cache (accessed_at)")
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _get(self, key):
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                conn.execute("DELETE FROM cache WHERE key = ? AND expires_at <= ?", (key, now))
+                conn.commit()
+                return None
+            conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return row[0]
+        finally:
+            conn.close()
+
+    def _set(self, key, data, ttl):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("""
+                INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?)
+                """, (key, data, len(data), now + ttl, now))
+                conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+                # Oltre il limite si eliminano le voci usate meno di recente
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+                evicted = 0
+                if total > self.max_bytes:
+                    for old_key, size in conn.execute(
+                            "SELECT key, size FROM cache WHERE key <> ? ORDER BY accessed_at", (key,)).fetchall():
+                        conn.execute("DELETE FROM cache WHERE key = ?", (old_key,))
+                        evicted += 1
+                        total -= size
+                        if total <= self.max_bytes:
+                            break
+        finally:
+            conn.close()
+        if evicted:
+            self._count('evictions', evicted)
+
+    def _delete(self, key):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM cache")
+        finally:
+            conn.close()
+
+
+class RedisCache(Cache):
+    """
+    Redis (or any server speaking the RESP protocol) through a minimal client:
+    one connection per thread, GET / SET PX / DEL / SCAN only. clear() removes
+    only the keys with this cache's prefix: the database may be shared
+    """
+
+    name = 'redis'
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, prefix='avvocato:',
+                 timeout=2.0, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        parsed = urlparse(url)
+        db = parsed.path.lstrip('/')
+        return cls(host=parsed.hostname or 'localhost', port=parsed.port or 6379, db=int(db or 0),
+                   password=unquote(parsed.password) if parsed.password else None, **kwargs)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = (sock, sock.makefile('rb'))
+            self._local.conn = conn
+            try:
+                if self.password:
+                    self._call(conn, b'AUTH', self.password.encode())
+                if self.db:
+                    self._call(conn, b'SELECT', str(self.db).encode())
+            except BaseException:
+                self._disconnect()
+                raise
+        return conn
+
+    def _disconnect(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    @staticmethod
+    def _read_reply(reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("Connessione Redis chiusa")
+        kind, payload = line[:1], line[1:-2]
+        if kind in (b'+', b':'):
+            return payload
+        if kind == b'-':
+            raise ConnectionError(f"Errore Redis: {payload.decode(errors='replace')}")
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            return None if length < 0 else [RedisCache._read_reply(reader) for _ in range(length)]
+        raise ConnectionError(f"Risposta Redis non riconosciuta: {line[:20]!r}")
+
+    def _call(self, conn, *args):
+        command = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            command.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        conn[0].sendall(b''.join(command))
+        return self._read_reply(conn[1])
+
+    def _execute(self, *args):
+        try:
+            return self._call(self._connection(), *args)
+        except OSError:
+            # Connessione chiusa dal server o scaduta: la prossima chiamata ne apre una nuova
+            self._disconnect()
+            raise
+
+    def _key(self, key):
+        return (self.prefix + key).encode()
+
+    def _get(self, key):
+        return self._execute(b'GET', self._key(key))
+
+    def _set(self, key, data, ttl):
+        self._execute(b'SET', self._key(key), data, b'PX', str(max(1, int(ttl * 1000))).encode())
+
+    def _delete(self, key):
+        self._execute(b'DEL', self._key(key))
+
+    def clear(self):
+        # SCAN a blocchi invece di FLUSHDB (o KEYS): il server resta disponibile e le
+        # chiavi di altre applicazioni nello stesso database non vengono toccate
+        pattern = re.sub(r'([*?\[\]\\])', r'\\\1', self.prefix).encode() + b'*'
+        cursor = b'0'
+        while True:
+            cursor, keys = self._execute(b'SCAN', cursor, b'MATCH', pattern, b'COUNT', b'1000')
+            if keys:
+                self._execute(b'DEL', *keys)
+            if cursor == b'0':
+                break
+
+
+def _max_bytes():
+    return int(float(os.environ.get("CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+
+def create_cache(url):
+    """Build a cache backend from a CACHE_URL value"""
+    scheme = urlparse(url).scheme
+    if scheme == 'memory':
+        return MemoryCache()
+    if scheme == 'sqlite':
+        # Come in DATABASE_URL: sqlite:///data/cache.db (relativo), sqlite:////tmp/cache.db (assoluto)
+        return SQLiteCache(url[len('sqlite:///'):])
+    if scheme in ('redis', 'rediss'):
+        if scheme == 'rediss':
+            raise ValueError("Redis con TLS (rediss://) non è supportato")
+        return RedisCache.from_url(url)
+    raise ValueError(f"CACHE_URL non supportato: {url}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The process-wide cache configured by CACHE_URL (created on first use)"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = create_cache(os.environ.get("CACHE_URL", "memory://"))
+    return _cache
@@ -0,0 +1,301 @@
+"""
+Catalogo dei servizi con un unico caricatore per CSV, JSON e database.
+
+    from utils import catalog
+
+    services = catalog.get_catalog()                      # database (default)
+    services = catalog.get_catalog(catalog.JsonSource('data/services.json'))
+    services.get(3), services.find('recupero crediti'), services.in_category('Contratti')
+
+Una sorgente file viene riletta solo se cambiano mtime o dimensione, e
+rianalizzata solo se cambia anche l'hash del contenuto; per il database si
+confronta la versione del catalogo (database.services_version, che cambia a
+ogni modifica), e solo se è cambiata i servizi vengono letti dalla cache
+condivisa (database.load_services_from_db) e il catalogo ricostruito; ogni studio
+(utils.tenants) ha il proprio catalogo e il proprio caricatore. I servizi sono
+record immutabili con __slots__, indicizzati per id, nome (senza distinzione
+tra maiuscole e minuscole) e categoria; si leggono anche come dizionari
+(service['name']), quindi sostituiscono le liste di dict del resto del codice.
+"""
+import csv
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_CSV_PATH = os.path.join("data", "services.csv")
+DEFAULT_JSON_PATH = os.path.join("data", "services.json")
+
+
+class Service:
+    """Immutable service record, readable as a mapping for compatibility with dict rows"""
+
+    __slots__ = ('id', 'name', 'description', 'category', 'file_content')
+
+    def __init__(self, id, name, description=None, category=None, file_content=None):
+        for field, value in zip(self.__slots__, (int(id), name, description, category or None, file_content)):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("I servizi del catalogo sono immutabili")
+
+    def __delattr__(self, name):
+        raise AttributeError("I servizi del catalogo sono immutabili")
+
+    def __reduce__(self):
+        return (Service, tuple(getattr(self, field) for field in self.__slots__))
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def __eq__(self, other):
+        if not isinstance(other, Service):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __hash__(self):
+        return hash((self.id, self.name))
+
+    def __repr__(self):
+        return f"Service(id={self.id!r}, name={self.name!r}, category={self.category!r})"
+
+
+class Catalog:
+    """Immutable sequence of services with lookups by id, name and category"""
+
+    __slots__ = ('services', '_by_id', '_by_name', '_by_category')
+
+    def __init__(self, services):
+        self.services = tuple(sorted(services, key=lambda service: service.name))
+        self._by_id = {service.id: service for service in self.services}
+        self._by_name = {service.name.strip().lower(): service for service in self.services}
+        by_category = {}
+        for service in self.services:
+            by_category.setdefault(service.category, []).append(service)
+        self._by_category = {category: tuple(group) for category, group in by_category.items()}
+
+    def __iter__(self):
+        return iter(self.services)
+
+    def __len__(self):
+        return len(self.services)
+
+    def __bool__(self):
+        return bool(self.services)
+
+    def get(self, service_id):
+        """Service with the given id, or None"""
+        return self._by_id.get(service_id)
+
+    def find(self, name):
+        """Service with the given name (case and surrounding spaces ignored), or None"""
+        return self._by_name.get(str(name).strip().lower())
+
+    def in_category(self, category):
+        """Services of a category (None: services without category)"""
+        return self._by_category.get(category, ())
+
+    def categories(self):
+        return sorted(category for category in self._by_category if category is not None)
+
+
+class FileSource:
+    """Base for file sources: stat first, then hash, then parse"""
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def key(self):
+        return (type(self).__name__, os.path.abspath(self.path))
+
+    def stat_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def read(self):
+        """Return (content hash, raw bytes), or (None, None) if the file does not exist"""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None, None
+        return hashlib.sha256(data).hexdigest(), data
+
+
+class CsvSource(FileSource):
+    """data/services.csv: id, nome_servizio, descrizione, categoria, documento"""
+
+    def __init__(self, path=DEFAULT_CSV_PATH):
+        super().__init__(path)
+
+    def parse(self, data):
+        rows = csv.DictReader(data.decode('utf-8-sig').splitlines())
+        return [
+            Service(row['id'], row.get('nome_servizio') or row.get('name'),
+                    row.get('descrizione') or row.get('description'),
+                    row.get('categoria') or row.get('category'),
+                    row.get('documento') or row.get('file_content') or None)
+            for row in rows if row.get('id')
+        ]
+
+
+class JsonSource(FileSource):
+    """data/services.json: list of {id, name, description, file_content[, category]}"""
+
+    def __init__(self, path=DEFAULT_JSON_PATH):
+        super().__init__(path)
+
+    def parse(self, data):
+        return [
+            Service(item['id'], item['name'], item.get('description'), item.get('category'),
+                    item.get('file_content'))
+            for item in json.loads(data)
+        ]
+
+
+class DatabaseSource:
+    """The services of one tenant, read through database.load_services_from_db (shared cache)"""
+
+    def __init__(self, tenant_id=None):
+        from utils import tenants
+
+        self.tenant_id = tenants.current_id() if tenant_id is None else tenant_id
+
+    @property
+    def key(self):
+        return ('DatabaseSource', self.tenant_id)
+
+    def stat_signature(self):
+        import database
+
+        # Al posto di mtime e dimensione: un token che cambia a ogni modifica del catalogo
+        return database.services_version(self.tenant_id)
+
+    def read(self):
+        import database
+
+        rows = database.load_services_from_db(self.tenant_id)
+        digest = hashlib.sha256(repr([
+            (row['id'], row['name'], row['description'], row.get('file_content')) for row in rows
+        ]).encode()).hexdigest()
+        return digest, rows
+
+    def parse(self, rows):
+        return [Service(row['id'], row['name'], row['description'], row.get('category'), row.get('file_content'))
+                for row in rows]
+
+
+def iter_json_array(stream, chunk_size=1 << 16):
+    """
+    Yield the elements of a top-level JSON array read from a text stream, one at a
+    time, without loading the whole document (elements are expected to be objects)
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+
+    def read_more(size):
+        nonlocal buffer, position, eof
+        data = stream.read(size)
+        if not data:
+            eof = True
+        buffer = buffer[position:] + data
+        position = 0
+
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError("JSON incompleto: manca la chiusura della lista")
+            read_more(chunk_size)
+            continue
+
+        char = buffer[position]
+        if not started:
+            if char != '[':
+                raise ValueError("Il file JSON deve contenere una lista di servizi")
+            started = True
+            position += 1
+        elif char == ']':
+            return
+        elif char == ',':
+            position += 1
+        else:
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Elemento non ancora completo: letture crescenti, così un documento
+                # allegato molto grande non viene rianalizzato a ogni blocco
+                read_more(max(chunk_size, len(buffer) - position))
+                continue
+            yield value
+
+
+def iter_json_services(path=DEFAULT_JSON_PATH):
+    """Stream the services of a JSON catalog file (see iter_json_array)"""
+    with open(path, encoding='utf-8') as f:
+        yield from iter_json_array(f)
+
+
+class CatalogLoader:
+    """Keeps the last Catalog of one source and rebuilds it only when the source changes"""
+
+    def __init__(self, source):
+        self.source = source
+        self._lock = threading.Lock()
+        self._signature = None
+        self._digest = None
+        self._catalog = None
+        self.parses = 0
+
+    def load(self):
+        with self._lock:
+            signature = self.source.stat_signature()
+            if self._catalog is not None and signature is not None and signature == self._signature:
+                return self._catalog
+
+            digest, data = self.source.read()
+            if digest is None:
+                self._catalog = Catalog(())
+            elif digest != self._digest or self._catalog is None:
+                self._catalog = Catalog(self.source.parse(data))
+                self.parses += 1
+            self._signature = signature
+            self._digest = digest
+            return self._catalog
+
+
+_loaders = {}
+_loaders_lock = threading.Lock()
+
+
+def get_loader(source=None):
+    """The process-wide loader of a source (default: the database, for the current tenant)"""
+    source = source or DatabaseSource()
+    with _loaders_lock:
+        loader = _loaders.get(source.key)
+        if loader is None:
+            loader = _loaders[source.key] = CatalogLoader(source)
+        return loader
+
+
+def get_catalog(source=None):
+    """Current catalog of a source (default: the database, for the current tenant)"""
+    return get_loader(source).load()
@@ -1,10 +1,17 @@
 import smtplib
 import os
+import logging
+import time
+from email.message import EmailMessage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
 from datetime import datetime
+from utils import metrics
 
+logger = logging.getLogger("avvocato.email")
+
+@metrics.timed("email_send_seconds")
 def send_email_with_pdf(recipient_email, client_name, pdf_bytes):
     """
     Invia un'email con il preventivo allegato in formato PDF
@@ -38,4 +45,113 @@ def send_email_with_pdf(recipient_email, client_name, pdf_bytes):
         
     except Exception as e:
         print(f"Errore nella simulazione dell'invio dell'email: {str(e)}")
-        return False, f"Errore nella simulazione dell'invio: {str(e)}"
\ No newline at end of file
+        return False, f"Errore nella simulazione dell'invio: {str(e)}"
+
+
+class SmtpBatchSender:
+    """
+    Invio di molte email su un'unica connessione SMTP riutilizzata, con limite di velocità.
+
+    Configurazione tramite variabili d'ambiente:
+
+        SMTP_HOST                   server SMTP (se assente: simulazione, i messaggi vengono solo registrati nel log)
+        SMTP_PORT                   porta (default 587 con STARTTLS, 25 senza)
+        SMTP_STARTTLS               '1' (default) per cifrare la connessione con STARTTLS, '0' per il server locale
+        EMAIL_USER, EMAIL_PASSWORD  credenziali (e mittente) del server
+        EMAIL_RATE_PER_SECOND       messaggi al secondo al massimo (default 10)
+        SMTP_MAX_PER_CONNECTION     messaggi per connessione prima di riaprirla (default 100)
+
+    Da usare come context manager: la connessione viene aperta al primo invio e
+    chiusa all'uscita.
+    """
+
+    def __init__(self, host=None, port=None, user=None, password=None, starttls=None, rate=None,
+                 max_per_connection=None):
+        self.host = host if host is not None else os.getenv("SMTP_HOST")
+        self.starttls = starttls if starttls is not None else os.getenv("SMTP_STARTTLS", "1") != "0"
+        self.port = int(port or os.getenv("SMTP_PORT") or (587 if self.starttls else 25))
+        self.user = user if user is not None else os.getenv("EMAIL_USER")
+        self.password = password if password is not None else os.getenv("EMAIL_PASSWORD")
+        self.sender = self.user or "studio.provvisorio@example.com"
+        self.rate = float(rate or os.getenv("EMAIL_RATE_PER_SECOND", "10"))
+        self.max_per_connection = int(max_per_connection or os.getenv("SMTP_MAX_PER_CONNECTION", "100"))
+        self._smtp = None
+        self._sent_on_connection = 0
+        self._next_send = 0.0
+
+    @property
+    def configured(self):
+        """False in simulation mode (no SMTP_HOST): messages are only logged"""
+        return bool(self.host)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.user and self.password:
+                smtp.login(self.user, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self._sent_on_connection = 0
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                self._smtp.close()
+            except OSError:
+                pass
+            self._smtp = None
+
+    def _throttle(self):
+        # Intervallo minimo tra due messaggi: nessuna raffica oltre il limite del provider
+        now = time.monotonic()
+        if self._next_send > now:
+            time.sleep(self._next_send - now)
+            now = self._next_send
+        self._next_send = now + 1.0 / self.rate
+
+    def message(self, recipient, subject, body):
+        """Prepara un messaggio di solo testo dal mittente configurato"""
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = recipient
+        message['Subject'] = subject
+        message.set_content(body)
+        return message
+
+    def send(self, message):
+        """
+        Invia un messaggio. Le eccezioni di smtplib per il singolo destinatario
+        (SMTPRecipientsRefused, SMTPDataError...) passano al chiamante; una
+        connessione caduta viene riaperta una volta.
+        """
+        self._throttle()
+        start = time.perf_counter()
+        if not self.host:
+            logger.info("[SIMULAZIONE INVIO EMAIL] A: %s, Oggetto: %s", message['To'], message['Subject'])
+        else:
+            if self._smtp is not None and self._sent_on_connection >= self.max_per_connection:
+                self.close()
+            for attempt in range(2):
+                if self._smtp is None:
+                    self._connect()
+                try:
+                    self._smtp.send_message(message)
+                    break
+                except smtplib.SMTPServerDisconnected:
+                    self._smtp = None
+                    if attempt:
+                        raise
+            self._sent_on_connection += 1
+        metrics.observe("email_send_seconds", time.perf_counter() - start, function="SmtpBatchSender.send")
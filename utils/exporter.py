@@ -0,0 +1,102 @@
+import csv
+import io
+import itertools
+import os
+
+import database
+from utils import archive, tenants
+
+# Intestazioni delle colonne esportate (stesso ordine di storage.base.EXPORT_COLUMNS)
+EXPORT_HEADERS = [
+    'ID Preventivo', 'Data', 'Valore del bene', 'Totale preventivo',
+    'Nome', 'Cognome', 'Email', 'Telefono', 'Codice Fiscale', 'Indirizzo', 'Servizi'
+]
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+
+def download_limit():
+    """
+    Largest export (bytes) offered as a download by the Streamlit admin panel,
+    which keeps the whole file in memory (EXPORT_DOWNLOAD_MAX_MB, default 25);
+    larger exports go through manage.py export-quotes, which streams to a file
+    """
+    return int(float(os.environ.get("EXPORT_DOWNLOAD_MAX_MB", "25")) * 1024 * 1024)
+
+
+def write_csv(rows, stream):
+    """
+    Scrive le righe in formato CSV su uno stream di testo, una alla volta
+
+    Returns:
+        int: Numero di righe scritte
+    """
+    writer = csv.writer(stream)
+    writer.writerow(EXPORT_HEADERS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_xlsx(rows, stream):
+    """
+    Scrive le righe in formato XLSX su uno stream binario.
+    La cartella di lavoro in modalità write_only non tiene le righe in memoria.
+
+    Returns:
+        int: Numero di righe scritte
+    """
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RuntimeError("L'esportazione in XLSX richiede il pacchetto openpyxl")
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Preventivi")
+    sheet.append(EXPORT_HEADERS)
+    count = 0
+    for row in rows:
+        # I valori NUMERIC arrivano come Decimal: Excel li vuole numerici
+        sheet.append([float(value) if i in (2, 3) and value is not None else value
+                      for i, value in enumerate(row)])
+        count += 1
+    workbook.save(stream)
+    return count
+
+
+def export_quotes(stream, export_format='csv', chunk_size=5000, include_archive=True, tenant_id=None):
+    """
+    Esporta tutti i preventivi di uno studio con dati del cliente e servizi sullo stream indicato
+
+    Args:
+        stream: Stream binario di destinazione (file, risposta HTTP, ...)
+        export_format (str): 'csv' o 'xlsx'
+        chunk_size (int): Righe lette dal database per ogni blocco
+        include_archive (bool): Include i preventivi archiviati in Parquet (più vecchi, quindi per primi)
+        tenant_id (int): Studio da esportare (default: lo studio corrente)
+
+    Returns:
+        int: Numero di preventivi esportati
+    """
+    # Risolto subito: le righe vengono lette più tardi, anche da un altro contesto
+    tenant_id = tenants.current_id() if tenant_id is None else tenant_id
+    rows = database.iter_quotes_for_export(chunk_size, tenant_id)
+    if include_archive:
+        rows = itertools.chain(archive.iter_archived_quotes_for_export(tenant_id, chunk_size=chunk_size), rows)
+
+    if export_format == 'csv':
+        text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        try:
+            return write_csv(rows, text_stream)
+        finally:
+            # Svuota il buffer senza chiudere lo stream del chiamante
+            text_stream.flush()
+            text_stream.detach()
+    if export_format == 'xlsx':
+        return write_xlsx(rows, stream)
+    raise ValueError(f"Formato di esportazione non supportato: {export_format}")
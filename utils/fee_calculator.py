@@ -1,34 +1,37 @@
-def get_scaglione(valore):
+# Limiti superiori degli scaglioni di valore (DM 55/2014): lo scaglione 7 è oltre l'ultimo
+LIMITI_SCAGLIONI = (1100, 5200, 26000, 52000, 260000, 520000)
+
+# Tabella 25 - Prestazioni di assistenza stragiudiziale (valori ufficiali)
+TARIFFE_BASE = {
+    1: 270,    # fino a € 1.100
+    2: 1215,   # da € 1.100,01 a € 5.200
+    3: 1890,   # da € 5.200,01 a € 26.000
+    4: 2295,   # da € 26.000,01 a € 52.000
+    5: 4320,   # da € 52.000,01 a € 260.000
+    6: 5870,   # da € 260.000,01 a € 520.000
+    7: 8770    # oltre € 520.000 (valore stimato in base alla progressione)
+}
+
+SPESE_FORFETTARIE = 0.15  # Spese forfettarie sull'onorario
+CPA = 0.04                # Cassa previdenza avvocati
+IVA = 0.22
+
+def get_scaglione(valore, limiti_scaglioni=LIMITI_SCAGLIONI):
     """Determina lo scaglione di appartenenza in base al valore della controversia secondo DM 55/2014"""
-    if valore <= 1100:
-        return 1
-    elif valore <= 5200:
-        return 2
-    elif valore <= 26000:
-        return 3
-    elif valore <= 52000:
-        return 4
-    elif valore <= 260000:
-        return 5
-    elif valore <= 520000:
-        return 6
-    else:
-        return 7
+    for scaglione, limite in enumerate(limiti_scaglioni, start=1):
+        if valore <= limite:
+            return scaglione
+    return len(limiti_scaglioni) + 1
 
-def calcola_onorario_base(scaglione):
-    """Calcola l'onorario base secondo i parametri del DM 55/2014, Tabella 25 - Prestazioni di assistenza stragiudiziale"""
-    # Tabella 25 - Prestazioni di assistenza stragiudiziale (valori ufficiali)
-    tariffe_base = {
-        1: 270,    # fino a € 1.100
-        2: 1215,   # da € 1.100,01 a € 5.200
-        3: 1890,   # da € 5.200,01 a € 26.000
-        4: 2295,   # da € 26.000,01 a € 52.000
-        5: 4320,   # da € 52.000,01 a € 260.000
-        6: 5870,   # da € 260.000,01 a € 520.000
-        7: 8770    # oltre € 520.000 (valore stimato in base alla progressione)
-    }
-    
-    return tariffe_base.get(scaglione, 0)
+def calcola_onorario_base(scaglione, tariff=None):
+    """
+    Calcola l'onorario base secondo i parametri del DM 55/2014, Tabella 25 - Prestazioni di assistenza stragiudiziale,
+    o secondo il tariffario dello studio ({'limiti_scaglioni': [...], 'tariffe_base': [...]})
+    """
+    if tariff is None:
+        return TARIFFE_BASE.get(scaglione, 0)
+    tariffe = tariff['tariffe_base']
+    return tariffe[scaglione - 1] if 1 <= scaglione <= len(tariffe) else 0
 
 def apply_complexity_factor(base_fee, num_services):
     """Applica un fattore di complessità basato sul numero di servizi selezionati"""
@@ -39,28 +42,28 @@ def apply_complexity_factor(base_fee, num_services):
     else:
         return base_fee * (1.2 + ((num_services - 2) * 0.1))  # +10% per ogni servizio aggiuntivo
 
-def calculate_fees(asset_value, num_services=1):
+def calculate_fees(asset_value, num_services=1, tariff=None):
     """
     Calcola le tariffe legali basate sul valore del bene e il numero di servizi
-    secondo i parametri del DM 55/2014
+    secondo i parametri del DM 55/2014 o, se indicato, il tariffario dello studio
     """
     # Determina lo scaglione di appartenenza
-    scaglione = get_scaglione(asset_value)
+    scaglione = get_scaglione(asset_value, tariff['limiti_scaglioni'] if tariff else LIMITI_SCAGLIONI)
     
     # Calcola l'onorario base
-    base_fee = calcola_onorario_base(scaglione)
+    base_fee = calcola_onorario_base(scaglione, tariff)
     
     # Applica fattore di complessità
     adjusted_fee = apply_complexity_factor(base_fee, num_services)
     
     # Calcola spese forfettarie (15%)
-    expenses = adjusted_fee * 0.15
+    expenses = adjusted_fee * SPESE_FORFETTARIE
     
     # Cassa previdenza avvocati (4%)
-    cpa = (adjusted_fee + expenses) * 0.04
+    cpa = (adjusted_fee + expenses) * CPA
     
     # IVA (22%)
-    iva = (adjusted_fee + expenses + cpa) * 0.22
+    iva = (adjusted_fee + expenses + cpa) * IVA
     
     # Totale
     total = adjusted_fee + expenses + cpa + iva
@@ -72,3 +75,21 @@ def calculate_fees(asset_value, num_services=1):
         'iva': iva,
         'total': total
     }
+
+def fees_from_total(total):
+    """
+    Ricostruisce il dettaglio dei costi dal totale salvato con il preventivo: spese,
+    CPA e IVA sono percentuali fisse dell'onorario, quindi il totale lo determina
+    senza ricalcolarlo con il tariffario attuale (che può essere cambiato)
+    """
+    total = float(total)
+    adjusted_fee = total / ((1 + SPESE_FORFETTARIE) * (1 + CPA) * (1 + IVA))
+    expenses = adjusted_fee * SPESE_FORFETTARIE
+    cpa = (adjusted_fee + expenses) * CPA
+    return {
+        'professional_fee': adjusted_fee,
+        'expenses': expenses,
+        'cpa': cpa,
+        'iva': total - adjusted_fee - expenses - cpa,
+        'total': total
+    }
@@ -0,0 +1,263 @@
+"""
+Strumentazione leggera dei percorsi critici.
+
+Le durate vengono raccolte in istogrammi in memoria (per processo) ed esposte
+in formato testo Prometheus su un endpoint HTTP opzionale o tramite una riga
+di log periodica. Configurazione tramite variabili d'ambiente:
+
+    METRICS_PORT          porta dell'endpoint /metrics (disabilitato se assente)
+    METRICS_LOG_INTERVAL  secondi tra due righe di log riepilogative (disabilitato se assente)
+    SLOW_QUERY_MS         soglia oltre la quale una query viene registrata come lenta (default 200)
+"""
+import bisect
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("avvocato.metrics")
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+_started = set()
+
+
+def slow_query_threshold():
+    """Soglia delle query lente in secondi"""
+    return float(os.environ.get("SLOW_QUERY_MS", "200")) / 1000
+
+
+class Histogram:
+    """Cumulative-bucket histogram compatible with the Prometheus exposition format"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket containing it"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+
+def observe(name, seconds, **labels):
+    """Record a duration (seconds) in the histogram identified by name and labels"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+def increment(name, value=1, **labels):
+    """Add value to the counter identified by name and labels"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def counters():
+    """Return a copy of the counters as {(name, labels): value}"""
+    with _lock:
+        return dict(_counters)
+
+
+def set_gauge(name, value, **labels):
+    """Set the current value of the gauge identified by name and labels"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _gauges[key] = value
+
+
+def gauges():
+    """Return a copy of the gauges as {(name, labels): value}"""
+    with _lock:
+        return dict(_gauges)
+
+
+@contextmanager
+def span(name, **labels):
+    """Context manager che misura la durata del blocco"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name, **labels):
+    """Decorator che misura ogni chiamata della funzione, etichettata con il suo nome"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, function=func.__name__, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def statement_label(query):
+    """Normalizza un'istruzione SQL in un'etichetta compatta"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    return re.sub(r'\s+', ' ', str(query)).strip()[:120]
+
+
+def observe_sql(query, seconds):
+    """Registra la durata di un'istruzione SQL e segnala le query lente"""
+    label = statement_label(query)
+    observe("sql_statement_seconds", seconds, statement=label)
+    if seconds >= slow_query_threshold():
+        logger.warning("Query lenta (%.1f ms): %s", seconds * 1000, label)
+
+
+def snapshot():
+    """Return a copy of the collected histograms as {(name, labels): Histogram}"""
+    with _lock:
+        copies = {}
+        for key, histogram in _histograms.items():
+            copy = Histogram(histogram.buckets)
+            copy.counts = list(histogram.counts)
+            copy.sum = histogram.sum
+            copy.count = histogram.count
+            copies[key] = copy
+        return copies
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = [
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in items
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus():
+    """Render all histograms, counters and gauges in the Prometheus text exposition format"""
+    lines = []
+    seen_names = set()
+    for (name, labels), histogram in sorted(snapshot().items()):
+        if name not in seen_names:
+            lines.append(f"# TYPE {name} histogram")
+            seen_names.add(name)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', repr(bound))])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    for kind, values in (('counter', counters()), ('gauge', gauges())):
+        for (name, labels), value in sorted(values.items()):
+            if name not in seen_names:
+                lines.append(f"# TYPE {name} {kind}")
+                seen_names.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def summary_line():
+    """Riepilogo compatto di tutti gli istogrammi per il log periodico"""
+    parts = []
+    for (name, labels), histogram in sorted(snapshot().items()):
+        label_text = ",".join(f"{value}" for _, value in labels)
+        parts.append(
+            f"{name}[{label_text}] n={histogram.count} "
+            f"media={histogram.sum / histogram.count * 1000:.1f}ms "
+            f"p95<={histogram.quantile(0.95) * 1000:.0f}ms"
+        )
+    return "; ".join(parts)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _ensure_log_handler():
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def _start_once(key, target):
+    with _lock:
+        if key in _started:
+            return False
+        _started.add(key)
+    threading.Thread(target=target, name=f"metrics-{key}", daemon=True).start()
+    return True
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Avvia (una sola volta per processo) l'endpoint HTTP /metrics"""
+    def serve():
+        try:
+            ThreadingHTTPServer((host, port), _MetricsHandler).serve_forever()
+        except OSError as e:
+            logger.error("Impossibile avviare l'endpoint delle metriche sulla porta %s: %s", port, e)
+    return _start_once("server", serve)
+
+
+def start_log_reporter(interval):
+    """Avvia (una sola volta per processo) il log periodico delle metriche"""
+    def report():
+        while True:
+            time.sleep(interval)
+            line = summary_line()
+            if line:
+                logger.info("Metriche: %s", line)
+    return _start_once("log", report)
+
+
+def setup_from_env():
+    """Attiva endpoint e log periodico in base alle variabili d'ambiente"""
+    _ensure_log_handler()
+
+    port = os.environ.get("METRICS_PORT")
+    if port:
+        start_metrics_server(int(port))
+
+    interval = os.environ.get("METRICS_LOG_INTERVAL")
+    if interval:
+        start_log_reporter(float(interval))
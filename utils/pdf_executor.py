@@ -0,0 +1,243 @@
+"""
+Generazione dei PDF con controllo di ammissione.
+
+I PDF vengono generati da un pool di processi di dimensione fissa invece che
+nel thread della sessione Streamlit: una raffica di richieste non occupa tutti
+i core e non blocca il GIL del server. Chi richiede un PDF lo attende al
+massimo PDF_MAX_WAIT secondi; oltre, riceve un PdfJob da controllare più
+tardi (l'interfaccia mostra subito il riepilogo e il link al PDF quando è
+pronto). La coda è limitata: oltre PDF_MAX_QUEUE PDF richiesti e non ancora
+completati submit solleva PdfRejected, e un PDF rimasto in coda più di
+PDF_MAX_QUEUE_WAIT secondi fallisce con PdfRejected invece di essere
+generato quando nessuno lo attende più. Con quote_id il PDF viene archiviato nel database appena generato
+(database.save_quote_pdf), anche se la sessione che lo ha chiesto è già
+terminata. Lo studio (intestazione del PDF e archiviazione) è quello corrente
+al momento della richiesta. Configurazione tramite variabili d'ambiente:
+
+    PDF_MAX_CONCURRENCY   PDF generati in parallelo (default: core meno uno, almeno 1)
+    PDF_MAX_WAIT          secondi di attesa prima della consegna differita (default 3)
+    PDF_MAX_QUEUE         PDF in coda o in generazione al massimo (default: 4 per processo del pool)
+    PDF_MAX_QUEUE_WAIT    secondi massimi in coda prima dell'inizio della generazione (default 60)
+    PDF_EXECUTOR          'process' (default) o 'inline' (nel thread chiamante, senza pool)
+
+Metriche: pdf_queue_depth (PDF richiesti e non ancora completati),
+pdf_queue_wait_seconds (attesa prima dell'inizio della generazione),
+pdf_render_seconds, pdf_deferred_total (consegne differite) e pdf_rejected_total
+(reason: queue_full o queue_wait).
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from utils import metrics, tenants
+from utils.pdf_generator import generate_pdf
+
+logger = logging.getLogger("avvocato.pdf_executor")
+
+_lock = threading.Lock()
+_executor = None
+_in_flight = 0
+# PDF da archiviare non ancora completati in questo processo, per (studio, preventivo)
+_pending = {}
+
+
+def max_concurrency():
+    default = max(1, (os.cpu_count() or 1) - 1)
+    return max(1, int(os.environ.get("PDF_MAX_CONCURRENCY", default)))
+
+
+def max_wait():
+    return float(os.environ.get("PDF_MAX_WAIT", "3"))
+
+
+def max_queue():
+    return max(1, int(os.environ.get("PDF_MAX_QUEUE", 4 * max_concurrency())))
+
+
+def max_queue_wait():
+    return float(os.environ.get("PDF_MAX_QUEUE_WAIT", "60"))
+
+
+class PdfRejected(RuntimeError):
+    """The render queue refused the PDF (queue full) or dropped it (waited past PDF_MAX_QUEUE_WAIT)"""
+
+
+def _queue_timeout():
+    return PdfRejected(f"PDF rimasto in coda oltre {max_queue_wait():g} secondi: troppe richieste in corso")
+
+
+def _inline():
+    return os.environ.get("PDF_EXECUTOR", "process") == "inline"
+
+
+def _render(client_data, selected_services, fees, branding=None, deadline=None):
+    # Eseguita nei processi del pool: gli orari servono al processo principale per le metriche
+    started = time.time()
+    if deadline is not None and started > deadline:
+        raise _queue_timeout()
+    pdf_bytes = generate_pdf(client_data, selected_services, fees, branding)
+    return pdf_bytes, started, time.time()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawn: i processi figli non ereditano connessioni al database né thread del server
+            _executor = ProcessPoolExecutor(max_concurrency(), mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def _reset_executor(broken):
+    global _executor
+    with _lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _track(delta):
+    global _in_flight
+    with _lock:
+        _in_flight += delta
+        metrics.set_gauge("pdf_queue_depth", _in_flight)
+
+
+def _admit():
+    """Take a place in the render queue, or raise PdfRejected when it is full"""
+    global _in_flight
+    limit = max_queue()
+    with _lock:
+        if _in_flight < limit:
+            _in_flight += 1
+            metrics.set_gauge("pdf_queue_depth", _in_flight)
+            return
+    metrics.increment("pdf_rejected_total", reason="queue_full")
+    raise PdfRejected(f"Coda dei PDF piena ({limit} in preparazione): riprovare tra poco")
+
+
+class PdfJob:
+    """A PDF being rendered; result() returns the bytes, or None while it is not ready"""
+
+    def __init__(self, future, submitted_at):
+        self._future = future
+        self.submitted_at = submitted_at
+
+    def _expire(self):
+        # Ancora in coda oltre il limite: annullato se nessun processo del pool lo ha preso
+        # (altrimenti è il processo a rifiutarlo, in _render)
+        if not self._future.done() and time.time() - self.submitted_at > max_queue_wait():
+            self._future.cancel()
+
+    def done(self):
+        self._expire()
+        return self._future.done()
+
+    def result(self, timeout=None):
+        """Wait up to timeout seconds (None: until done); render errors and PdfRejected are raised"""
+        self._expire()
+        try:
+            pdf_bytes, _, _ = self._future.result(timeout)
+        except TimeoutError:
+            return None
+        except CancelledError:
+            raise _queue_timeout()
+        return pdf_bytes
+
+
+def _persist(quote_id, pdf_bytes, tenant_id):
+    import database
+
+    try:
+        database.save_quote_pdf(quote_id, pdf_bytes, tenant_id)
+    except Exception:
+        # Il PDF resta comunque disponibile a chi lo attende
+        logger.exception("PDF del preventivo %s non archiviato", quote_id)
+
+
+def pending(quote_id, tenant_id):
+    """Whether this process is still rendering the PDF of a quote"""
+    with _lock:
+        return (tenant_id, quote_id) in _pending
+
+
+def _completed(submitted_at, quote_id, tenant_id):
+    def callback(future):
+        _track(-1)
+        try:
+            if future.cancelled() or isinstance(future.exception(), PdfRejected):
+                metrics.increment("pdf_rejected_total", reason="queue_wait")
+                return
+            if future.exception() is not None:
+                return
+            pdf_bytes, started, finished = future.result()
+            metrics.observe("pdf_queue_wait_seconds", max(0.0, started - submitted_at))
+            metrics.observe("pdf_render_seconds", finished - started, function="generate_pdf")
+            if quote_id is not None:
+                _persist(quote_id, pdf_bytes, tenant_id)
+        finally:
+            # Tolto dopo l'archiviazione: chi non lo trova più qui lo trova nel database
+            if quote_id is not None:
+                with _lock:
+                    _pending.pop((tenant_id, quote_id), None)
+    return callback
+
+
+def submit(client_data, selected_services, fees, quote_id=None, tenant=None):
+    """
+    Queue a PDF for rendering and return its PdfJob; with quote_id it is stored once rendered.
+    The PDF carries the branding of tenant (default: the current one). Raises PdfRejected
+    when PDF_MAX_QUEUE PDFs are already waiting or rendering.
+    """
+    # Solo i campi usati nel PDF: niente documenti allegati da serializzare verso il pool
+    services = [{'id': service['id'], 'name': service['name'], 'description': service.get('description')}
+                for service in selected_services]
+    # Il callback di completamento gira in un thread del pool: lo studio va fissato ora
+    tenant = tenant or tenants.current()
+    submitted_at = time.time()
+
+    if _inline():
+        pdf_bytes = generate_pdf(client_data, services, fees, tenant.branding)
+        if quote_id is not None:
+            _persist(quote_id, pdf_bytes, tenant.id)
+        future = Future()
+        future.set_result((pdf_bytes, submitted_at, submitted_at))
+        return PdfJob(future, submitted_at)
+
+    _admit()
+    deadline = submitted_at + max_queue_wait()
+    for attempt in range(2):
+        executor = _get_executor()
+        try:
+            future = executor.submit(_render, client_data, services, fees, tenant.branding, deadline)
+            break
+        except (BrokenProcessPool, RuntimeError) as e:
+            # Un processo del pool è terminato in modo anomalo: si ricrea il pool una volta
+            logger.warning("Pool dei PDF non disponibile, viene ricreato: %s", e)
+            _reset_executor(executor)
+            if attempt:
+                _track(-1)
+                raise
+    if quote_id is not None:
+        with _lock:
+            _pending[(tenant.id, quote_id)] = future
+    future.add_done_callback(_completed(submitted_at, quote_id, tenant.id))
+    return PdfJob(future, submitted_at)
+
+
+def render(client_data, selected_services, fees, wait=None, quote_id=None, tenant=None):
+    """
+    Submit a PDF (see submit) and wait for it up to wait seconds (default PDF_MAX_WAIT)
+
+    Returns:
+        tuple: (pdf bytes, or None if it is not ready yet, PdfJob)
+    """
+    job = submit(client_data, selected_services, fees, quote_id, tenant)
+    pdf_bytes = job.result(max_wait() if wait is None else wait)
+    if pdf_bytes is None:
+        metrics.increment("pdf_deferred_total")
+    return pdf_bytes, job
@@ -1,12 +1,147 @@
+"""
+Generazione del PDF del preventivo.
+
+I PDF vengono inviati per email e incorporati in base64 nella pagina, quindi
+il profilo di uscita punta alle dimensioni: flussi compressi con zlib senza
+codifica ASCII85 e output deterministico (stessi dati, stessi byte).
+Configurazione tramite variabili d'ambiente:
+
+    PDF_FONT          file TTF del testo (default: Helvetica, font standard non incorporato)
+    PDF_FONT_BOLD     file TTF del grassetto (default: PDF_FONT)
+    PDF_LOGO          logo dello studio in testa al preventivo (PNG, JPEG o, con svglib, SVG)
+    PDF_LOGO_WIDTH_CM larghezza del logo in centimetri (default 5)
+
+Ogni studio può sostituire logo e larghezza e aggiungere intestazione e
+recapiti con il proprio branding (utils.tenants). Dei font TTF vengono
+incorporati solo i caratteri usati. Ogni logo viene decodificato e ridotto a
+LOGO_DPI una sola volta per processo e poi riusato da tutti i documenti finché
+il file non cambia.
+"""
+import functools
+import hashlib
 import io
+import json
+import os
 from datetime import datetime
+from xml.sax.saxutils import escape
+from reportlab import rl_config
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Flowable
+from utils import metrics
+from utils.cache import get_cache
+
+# Scadenza dei PDF nella cache condivisa (secondi)
+PDF_CACHE_TTL = 3600
+
+# Profilo di uscita: compressione dei flussi sempre attiva e nessun timestamp o
+# identificativo casuale, così lo stesso preventivo produce sempre gli stessi byte
+OUTPUT_PROFILE = {'pageCompression': 1, 'invariant': 1}
+
+# ASCII85 rende testuali i flussi compressi al prezzo di un quarto di byte in più:
+# inutile in un PDF binario. È un'impostazione globale di reportlab (questo
+# modulo è l'unico a generare PDF)
+rl_config.useA85 = 0
+
+# Risoluzione del logo ridotto: sufficiente per la stampa, molto più leggera dell'originale
+LOGO_DPI = 150
+
+CORE_FONTS = ('Helvetica', 'Helvetica-Bold')
+
+
+@functools.lru_cache(maxsize=4)
+def _register_fonts(regular_path, bold_path):
+    names = []
+    for path in (regular_path, bold_path):
+        name = 'Avvocato-' + os.path.splitext(os.path.basename(path))[0]
+        if name not in pdfmetrics.getRegisteredFontNames():
+            # I TTFont di reportlab incorporano solo il sottoinsieme di glifi usato nel documento
+            pdfmetrics.registerFont(TTFont(name, path))
+        names.append(name)
+    return tuple(names)
+
+
+def pdf_fonts():
+    """Names of the (regular, bold) fonts used in the PDF: PDF_FONT/PDF_FONT_BOLD or the core Helvetica"""
+    regular_path = os.environ.get("PDF_FONT")
+    if not regular_path:
+        return CORE_FONTS
+    return _register_fonts(regular_path, os.environ.get("PDF_FONT_BOLD") or regular_path)
+
+
+class _Logo(Flowable):
+    """Draws an already decoded image: the same ImageReader is shared by every document"""
+
+    def __init__(self, reader, width, height):
+        super().__init__()
+        self.reader = reader
+        self.width = width
+        self.height = height
+        self.hAlign = 'CENTER'
 
-def generate_pdf(client_data, selected_services, fees):
+    def wrap(self, available_width, available_height):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.reader, 0, 0, self.width, self.height, mask='auto')
+
+
+@functools.lru_cache(maxsize=32)
+def _load_logo(path, width, signature):
+    # signature (mtime, dimensione) fa parte della chiave: un file sostituito viene riletto
+    if os.path.splitext(path)[1].lower() == '.svg':
+        try:
+            from svglib.svglib import svg2rlg
+        except ImportError:
+            raise RuntimeError("Un logo SVG richiede il pacchetto svglib (o usare un PNG/JPEG)")
+        drawing = svg2rlg(path)
+        scale = width / drawing.width
+        drawing.scale(scale, scale)
+        drawing.width, drawing.height = width, drawing.height * scale
+        drawing.hAlign = 'CENTER'
+        return drawing
+
+    from PIL import Image as PILImage
+
+    with PILImage.open(path) as image:
+        image.load()
+        height = width * image.height / image.width
+        pixels = (max(1, round(width / 72 * LOGO_DPI)), max(1, round(height / 72 * LOGO_DPI)))
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA')
+        if image.width > pixels[0]:
+            image = image.resize(pixels, PILImage.LANCZOS)
+        else:
+            image = image.copy()
+    reader = ImageReader(image)
+    # Decodifica anticipata: i documenti successivi trovano i pixel già pronti
+    reader.getRGBData()
+    return reader, width, height
+
+
+def pdf_logo(branding=None):
+    """
+    Flowable of the tenant's logo (branding 'logo'), else of PDF_LOGO, decoded once
+    per process; None if no logo is configured
+    """
+    branding = branding or {}
+    path = branding.get('logo') or os.environ.get("PDF_LOGO")
+    if not path:
+        return None
+    stat = os.stat(path)
+    width_cm = branding.get('logo_width_cm') or os.environ.get("PDF_LOGO_WIDTH_CM", "5")
+    logo = _load_logo(path, float(width_cm) * cm, (stat.st_mtime_ns, stat.st_size))
+    if isinstance(logo, tuple):
+        return _Logo(*logo)
+    return logo
+
+@metrics.timed("pdf_render_seconds")
+def generate_pdf(client_data, selected_services, fees, branding=None):
     """
     Genera un file PDF contenente il preventivo per i servizi legali
     
@@ -14,6 +149,7 @@ def generate_pdf(client_data, selected_services, fees):
         client_data (dict): Dati del cliente
         selected_services (list): Servizi selezionati
         fees (dict): Dettaglio costi calcolati
+        branding (dict): Logo, intestazione e recapiti dello studio (utils.tenants)
         
     Returns:
         bytes: Il file PDF come bytes
@@ -27,11 +163,17 @@ def generate_pdf(client_data, selected_services, fees):
         rightMargin=2*cm,
         leftMargin=2*cm,
         topMargin=2*cm,
-        bottomMargin=2*cm
+        bottomMargin=2*cm,
+        title="Preventivo servizi legali",
+        **OUTPUT_PROFILE
     )
     
     # Stili
+    font, bold_font = pdf_fonts()
     styles = getSampleStyleSheet()
+    styles['Normal'].fontName = font
+    styles['Title'].fontName = bold_font
+    styles['Heading2'].fontName = bold_font
     styles.add(ParagraphStyle(
         name='RightAlign',
         parent=styles['Normal'],
@@ -59,6 +201,18 @@ def generate_pdf(client_data, selected_services, fees):
     # Contenuto del documento
     elements = []
     
+    branding = branding or {}
+    logo = pdf_logo(branding)
+    if logo is not None:
+        elements.append(logo)
+        elements.append(Spacer(1, 0.5*cm))
+    if branding.get('intestazione'):
+        elements.append(Paragraph(f"<b>{escape(branding['intestazione'])}</b>", styles['Center']))
+    if branding.get('recapiti'):
+        elements.append(Paragraph(escape(branding['recapiti']), styles['Center']))
+    if branding.get('intestazione') or branding.get('recapiti'):
+        elements.append(Spacer(1, 0.5*cm))
+    
     # Intestazione
     elements.append(Paragraph("PREVENTIVO SERVIZI LEGALI", styles['Title']))
     
@@ -82,7 +236,8 @@ def generate_pdf(client_data, selected_services, fees):
         ('GRID', (0, 0), (-1, -1), 0.5, colors.white),
         ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
         ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (0, 0), (-1, -1), font),
+        ('FONTNAME', (0, 0), (0, -1), bold_font),
         ('PADDING', (0, 0), (-1, -1), 6),
     ]))
     
@@ -101,7 +256,8 @@ def generate_pdf(client_data, selected_services, fees):
         ('GRID', (0, 0), (-1, -1), 0.5, colors.white),
         ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
         ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (0, 0), (-1, -1), font),
+        ('FONTNAME', (0, 0), (0, -1), bold_font),
         ('PADDING', (0, 0), (-1, -1), 6),
     ]))
     
@@ -121,6 +277,7 @@ def generate_pdf(client_data, selected_services, fees):
             ('GRID', (0, 0), (-1, -1), 0.5, colors.white),
             ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
             ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('FONTNAME', (0, 0), (-1, -1), font),
             ('PADDING', (0, 0), (-1, -1), 6),
         ]))
         elements.append(services_table)
@@ -147,8 +304,9 @@ def generate_pdf(client_data, selected_services, fees):
         ('BACKGROUND', (0, 4), (-1, 4), colors.grey),
         ('TEXTCOLOR', (0, 4), (-1, 4), colors.white),
         ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (0, 4), (-1, 4), 'Helvetica-Bold'),
+        ('FONTNAME', (0, 0), (-1, -1), font),
+        ('FONTNAME', (0, 0), (0, -1), bold_font),
+        ('FONTNAME', (0, 4), (-1, 4), bold_font),
         ('PADDING', (0, 0), (-1, -1), 6),
         ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
     ]))
@@ -164,7 +322,10 @@ def generate_pdf(client_data, selected_services, fees):
     
     # Piè di pagina
     elements.append(Spacer(1, 2*cm))
-    elements.append(Paragraph("Documento generato automaticamente - Tutti i diritti riservati", styles['Center']))
+    footer = "Documento generato automaticamente - Tutti i diritti riservati"
+    if branding.get('intestazione'):
+        footer = f"{escape(branding['intestazione'])} - {footer}"
+    elements.append(Paragraph(footer, styles['Center']))
     
     # Build PDF
     doc.build(elements)
@@ -174,3 +335,22 @@ def generate_pdf(client_data, selected_services, fees):
     buffer.close()
     
     return pdf_bytes
+
+
+def generate_pdf_cached(client_data, selected_services, fees, branding=None):
+    """
+    generate_pdf through the shared cache: the same quote rendered on the same day
+    (the PDF shows the current date) is built only once across processes and instances
+    """
+    payload = json.dumps([
+        client_data,
+        [[service['id'], service['name'], service.get('description')] for service in selected_services],
+        fees,
+        datetime.now().strftime("%Y-%m-%d"),
+        # Font e logo cambiano i byte del PDF: un cambio di configurazione non riusa i PDF vecchi
+        [os.environ.get(name) for name in ("PDF_FONT", "PDF_FONT_BOLD", "PDF_LOGO", "PDF_LOGO_WIDTH_CM")],
+        branding or {},
+    ], sort_keys=True, default=str)
+    key = "pdf:" + hashlib.sha256(payload.encode()).hexdigest()
+    return get_cache().get_or_set(key, lambda: generate_pdf(client_data, selected_services, fees, branding),
+                                  PDF_CACHE_TTL)
@@ -0,0 +1,194 @@
+"""
+Profilazione dei singoli rerun di app.py.
+
+Quando è attiva (PROFILE_RERUNS=1 per tutte le sessioni, oppure l'interruttore
+"Profila i rerun" nella barra laterale in modalità amministratore, solo per
+quella sessione) il rerun viene eseguito sotto cProfile e tracemalloc e al
+termine viene scritto un report di testo in PROFILE_DIR con:
+
+- le funzioni con il tempo cumulativo più alto, in totale e per area (database
+  e storage, utils, grafici con matplotlib/seaborn)
+- le righe con la maggiore differenza di memoria allocata durante il rerun e
+  il picco raggiunto
+
+Accanto al report viene salvato il profilo grezzo (.pstats, leggibile con
+pstats o snakeviz). Un solo rerun alla volta viene profilato nel processo:
+tracemalloc (e da Python 3.12 cProfile) vede tutti i thread, quindi le
+allocazioni possono includere quelle di altre sessioni concorrenti. I rerun
+interrotti da st.rerun/st.stop vengono chiusi all'inizio del rerun successivo
+della stessa sessione (o del primo rerun profilato dopo la fine del thread).
+
+    PROFILE_RERUNS              1 per profilare tutti i rerun (default 0)
+    PROFILE_DIR                 cartella dei report (default reports/profiles)
+    PROFILE_TOP                 righe per sezione del report (default 25)
+    PROFILE_TRACEMALLOC_FRAMES  frame registrati per allocazione (default 1; 0 disattiva tracemalloc)
+"""
+import cProfile
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+logger = logging.getLogger("avvocato.profiler")
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Aree del report: nome -> funzione che riconosce il file sorgente
+AREAS = (
+    ('database', lambda path: path == os.path.join(ROOT_DIR, 'database.py')
+        or path.startswith(os.path.join(ROOT_DIR, 'storage') + os.sep)),
+    ('utils', lambda path: path.startswith(os.path.join(ROOT_DIR, 'utils') + os.sep)),
+    ('grafici', lambda path: any(f"{os.sep}{package}{os.sep}" in path for package in ('matplotlib', 'seaborn'))),
+)
+
+_lock = threading.Lock()
+# Rerun profilato in questo momento (uno solo per processo)
+_active = None
+
+
+def enabled_from_env():
+    return os.environ.get("PROFILE_RERUNS", "0") == "1"
+
+
+def profile_dir():
+    return os.environ.get("PROFILE_DIR", os.path.join("reports", "profiles"))
+
+
+def top_count():
+    return int(os.environ.get("PROFILE_TOP", "25"))
+
+
+def tracemalloc_frames():
+    return int(os.environ.get("PROFILE_TRACEMALLOC_FRAMES", "1"))
+
+
+class RerunProfile:
+    """cProfile and tracemalloc state of one profiled rerun"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.thread = threading.current_thread()
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self.snapshot = None
+        self.started_tracemalloc = False
+
+        frames = tracemalloc_frames()
+        if frames > 0:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self.started_tracemalloc = True
+            tracemalloc.reset_peak()
+            self.snapshot = tracemalloc.take_snapshot()
+        self.profile.enable()
+
+    def stop(self, interrupted=False):
+        """Stop profiling and write the report; returns its path"""
+        self.profile.disable()
+        elapsed = time.perf_counter() - self.start
+        allocations, peak = [], None
+        if self.snapshot is not None and tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1]
+            after = tracemalloc.take_snapshot()
+            ignored = (tracemalloc.Filter(False, tracemalloc.__file__),
+                       tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                       tracemalloc.Filter(False, "<unknown>"))
+            allocations = after.filter_traces(ignored).compare_to(self.snapshot.filter_traces(ignored), 'lineno')
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+
+        directory = profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        session = re.sub(r"[^0-9A-Za-z]", "", str(self.session_id))[:8]
+        base = os.path.join(directory, f"{self.started_at:%Y%m%d-%H%M%S-%f}-{session}")
+        stats = pstats.Stats(self.profile)
+        stats.dump_stats(base + ".pstats")
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(format_report(self, stats, elapsed, interrupted, allocations, peak, top_count()))
+        logger.info("Profilo del rerun salvato in %s.txt (%.3f s)", base, elapsed)
+        return base + ".txt"
+
+
+def _short_path(path):
+    if path.startswith(ROOT_DIR + os.sep):
+        return os.path.relpath(path, ROOT_DIR)
+    marker = f"{os.sep}site-packages{os.sep}"
+    return path.split(marker, 1)[1] if marker in path else path
+
+
+def _function_rows(entries, top):
+    lines = [f"{'chiamate':>10} {'tottime':>9} {'cumtime':>9}  funzione"]
+    for (path, line, name), (primitive, calls, tottime, cumtime, _) in entries[:top]:
+        ncalls = f"{calls}/{primitive}" if calls != primitive else str(calls)
+        lines.append(f"{ncalls:>10} {tottime:9.4f} {cumtime:9.4f}  {_short_path(path)}:{line}({name})")
+    return lines
+
+
+def format_report(rerun, stats, elapsed, interrupted, allocations, peak, top):
+    """Text report: functions by cumulative time (all and per area) and allocation deltas"""
+    entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    lines = [
+        f"Rerun profilato   {rerun.started_at:%Y-%m-%d %H:%M:%S}",
+        f"Sessione          {rerun.session_id}",
+        f"Durata            {elapsed:.3f} s" + (" (interrotto da st.rerun/st.stop)" if interrupted else ""),
+        f"Chiamate          {stats.total_calls} ({stats.prim_calls} primitive)",
+    ]
+    if peak is not None:
+        allocated = sum(stat.size_diff for stat in allocations)
+        lines.append(f"Memoria           {allocated / 1e6:+.2f} MB allocati nel rerun, picco {peak / 1e6:.2f} MB")
+
+    lines += ["", "== Funzioni per tempo cumulativo ==", *_function_rows(entries, top)]
+    for area, matches in AREAS:
+        selected = [entry for entry in entries if matches(entry[0][0])]
+        lines += ["", f"== {area} ==", *(_function_rows(selected, top) if selected else ["(nessuna chiamata)"])]
+
+    if peak is not None:
+        lines += ["", "== Allocazioni per riga (differenza dall'inizio del rerun) ==",
+                  f"{'KB':>10} {'blocchi':>9}  riga"]
+        for stat in allocations[:top]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size_diff / 1024:+10.1f} {stat.count_diff:+9d}  "
+                         f"{_short_path(frame.filename)}:{frame.lineno}")
+    return "\n".join(lines) + "\n"
+
+
+def start_rerun(session_id, enabled=False):
+    """
+    Start profiling the current rerun when enabled (or PROFILE_RERUNS=1) and no
+    other rerun is being profiled; returns the RerunProfile, or None
+    """
+    global _active
+
+    with _lock:
+        if _active is not None and (_active.session_id == session_id or not _active.thread.is_alive()):
+            # Rerun precedente interrotto prima di finish_rerun
+            stale, _active = _active, None
+            try:
+                stale.stop(interrupted=True)
+            except Exception:
+                logger.exception("Profilo del rerun interrotto non salvato")
+        if not (enabled or enabled_from_env()):
+            return None
+        if _active is not None:
+            logger.info("Rerun della sessione %s non profilato: è in corso un altro profilo", session_id)
+            return None
+        _active = RerunProfile(session_id)
+        return _active
+
+
+def finish_rerun(rerun):
+    """Stop profiling the rerun and write its report; returns the report path (None if not profiled)"""
+    global _active
+
+    if rerun is None:
+        return None
+    with _lock:
+        if _active is not rerun:
+            return None
+        _active = None
+    return rerun.stop()
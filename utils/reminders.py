@@ -0,0 +1,153 @@
+"""
+Promemoria di scadenza dei preventivi.
+
+Il PDF del preventivo indica una validità di QUOTE_VALIDITY_DAYS giorni. Il job
+(python manage.py quote-reminders, pianificato una volta al giorno) cerca i
+preventivi che scadono entro REMINDER_DAYS_BEFORE giorni con una scansione per
+intervallo su quotes.created_at, a pagine, e invia un promemoria per ciascuno
+con utils.email_sender.SmtpBatchSender (una connessione SMTP riutilizzata, con
+limite di velocità). Ogni invio viene registrato in quote_reminders: un
+preventivo riceve un solo promemoria anche se il job viene ripetuto o se un
+giorno salta (la finestra copre tutti i giorni che mancano alla scadenza).
+Il job elabora uno studio alla volta (tutti, se non ne è attivo uno) e firma
+i messaggi con il nome dello studio.
+
+Senza SMTP_HOST il job non invia né registra nulla (come con dry_run): un
+promemoria registrato in simulazione non verrebbe mai più inviato. Solo i
+rifiuti definitivi del server (codici 5xx) vengono registrati; quelli
+temporanei (4xx: greylisting, limiti di velocità) restano per l'esecuzione
+successiva.
+
+    REMINDER_DAYS_BEFORE    giorni di anticipo sulla scadenza (default 7)
+"""
+import logging
+import os
+import smtplib
+import time
+from datetime import datetime, timedelta
+
+from storage import get_storage
+from utils import metrics, tenants
+from utils.email_sender import SmtpBatchSender
+
+logger = logging.getLogger("avvocato.reminders")
+
+# Validità indicata nel PDF del preventivo (utils.pdf_generator)
+QUOTE_VALIDITY_DAYS = 30
+
+SUBJECT = "Il suo preventivo scade il {expires:%d/%m/%Y}"
+
+BODY = """Gentile {nome} {cognome},
+
+le ricordiamo che il preventivo n. {id} del {created_at:%d/%m/%Y}, per un totale di € {total_fee:,.2f},
+resterà valido fino al {expires:%d/%m/%Y}.
+
+Per accettarlo o per qualsiasi chiarimento può contattare lo studio legale ai recapiti indicati nel preventivo.
+
+Cordiali saluti
+{studio}
+"""
+
+
+def days_before():
+    return int(os.environ.get("REMINDER_DAYS_BEFORE", "7"))
+
+
+def reminder_window(now=None, days=None):
+    """[start, end) of created_at for quotes expiring within `days` days and not yet expired"""
+    now = now or datetime.now()
+    days = days_before() if days is None else days
+    start = now - timedelta(days=QUOTE_VALIDITY_DAYS)
+    return start, start + timedelta(days=days)
+
+
+def send_expiry_reminders(days=None, page_size=1000, limit=None, dry_run=False, sender=None, now=None,
+                          tenant_list=None):
+    """
+    Send one reminder to every quote expiring within `days` days that has not had one
+
+    Args:
+        days (int): Giorni di anticipo sulla scadenza (default REMINDER_DAYS_BEFORE)
+        page_size (int): Preventivi letti (e invii registrati) per ogni blocco
+        limit (int): Numero massimo di promemoria in questa esecuzione
+        dry_run (bool): Conta i preventivi senza inviare né registrare nulla
+        sender (SmtpBatchSender): Mittente da usare (default: configurato dall'ambiente)
+        tenant_list (list): Studi da elaborare (default: lo studio attivo, altrimenti tutti)
+
+    Returns:
+        dict: 'due', 'sent', 'refused', 'deferred' (rifiuti temporanei), 'dry_run' and 'elapsed_seconds'
+    """
+    start_time = time.perf_counter()
+    start, end = reminder_window(now, days)
+    report = {'due': 0, 'sent': 0, 'refused': 0, 'deferred': 0}
+    if tenant_list is None:
+        active = tenants.active()
+        tenant_list = [active] if active is not None else tenants.all_tenants()
+    sender = sender or SmtpBatchSender()
+    if not dry_run and not sender.configured:
+        logger.warning("SMTP_HOST non configurato: promemoria solo contati, nessun invio registrato")
+        dry_run = True
+    report['dry_run'] = dry_run
+
+    # Una sola connessione SMTP per tutti gli studi
+    with sender:
+        for tenant in tenant_list:
+            _send_tenant_reminders(tenant, start, end, page_size, limit, dry_run, sender, report)
+
+    report['elapsed_seconds'] = time.perf_counter() - start_time
+    logger.info("Promemoria di scadenza: %d da inviare, %d inviati, %d rifiutati in %.1f s",
+                report['due'], report['sent'], report['refused'], report['elapsed_seconds'])
+    return report
+
+
+def _permanent(error):
+    """True for a 5xx refusal; 4xx replies (greylisting, rate limits) are transient"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+    else:
+        codes = [error.smtp_code]
+    return bool(codes) and all(500 <= code < 600 for code in codes)
+
+
+def _send_tenant_reminders(tenant, start, end, page_size, limit, dry_run, sender, report):
+    storage = get_storage()
+    after = None
+    while limit is None or report['due'] < limit:
+        size = page_size if limit is None else min(page_size, limit - report['due'])
+        quotes = storage.get_expiring_quotes(tenant.id, start, end, after, size)
+        if not quotes:
+            break
+        after = (quotes[-1]['created_at'], quotes[-1]['id'])
+        report['due'] += len(quotes)
+        if dry_run:
+            continue
+
+        # Registrati anche se l'invio si interrompe a metà: nessun doppio promemoria alla ripresa
+        recorded = []
+        try:
+            for quote in quotes:
+                fields = dict(quote, total_fee=float(quote['total_fee']), studio=tenant.name,
+                              expires=quote['created_at'] + timedelta(days=QUOTE_VALIDITY_DAYS))
+                message = sender.message(quote['email'], SUBJECT.format(**fields), BODY.format(**fields))
+                try:
+                    sender.send(message)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as e:
+                    if not _permanent(e):
+                        # Rifiuto temporaneo: nessuna registrazione, si riprova alla prossima esecuzione
+                        logger.info("Promemoria del preventivo %s rinviato (%s): %s",
+                                    quote['id'], quote['email'], e)
+                        report['deferred'] += 1
+                        continue
+                    # Indirizzo rifiutato: registrato per non riprovarlo a ogni esecuzione
+                    logger.warning("Promemoria del preventivo %s rifiutato (%s): %s",
+                                   quote['id'], quote['email'], e)
+                    recorded.append((quote['id'], quote['email'], 'rifiutato'))
+                    report['refused'] += 1
+                    continue
+                recorded.append((quote['id'], quote['email'], 'inviato'))
+                report['sent'] += 1
+        finally:
+            storage.record_reminders(tenant.id, recorded)
+            metrics.increment("reminders_sent_total", sum(1 for r in recorded if r[2] == 'inviato'))
+            metrics.increment("reminders_refused_total", sum(1 for r in recorded if r[2] == 'rifiutato'))
+
@@ -0,0 +1,227 @@
+"""
+Memoria occupata dallo stato delle sessioni Streamlit.
+
+A ogni rerun app.py misura la dimensione profonda di ogni chiave di
+st.session_state della sessione (oggetti condivisi tra le sessioni, come il
+Catalog dei servizi, non vengono attribuiti alla sessione) e la registra nel
+totale del processo, esposto come gauge session_state_bytes e
+session_state_sessions (utils.metrics) e nella barra laterale in modalità
+amministratore. I file caricati non sono qui: restano su disco in
+utils.upload_spool, che ha le proprie quote.
+
+Quando la sessione supera SESSION_STATE_BUDGET_MB, o il processo supera
+SESSION_STATE_PROCESS_BUDGET_MB (in quel caso ogni sessione viene ricondotta
+alla sua quota del totale), le chiavi dichiarate scaricabili vengono liberate
+a partire dalla più grande: eliminate se la sessione sa ricostruirle,
+altrimenti sostituite da una versione leggera (per esempio il solo id di un
+PDF già archiviato nel database). Ogni sessione libera solo il proprio stato,
+durante il proprio rerun.
+
+    SESSION_STATE_BUDGET_MB          memoria massima per sessione (default 32)
+    SESSION_STATE_PROCESS_BUDGET_MB  memoria massima per processo, tutte le sessioni (default 512)
+    SESSION_STATE_TTL                secondi dopo i quali una sessione non più misurata esce dal totale (default 3600)
+"""
+import logging
+import os
+import sys
+import threading
+import time
+import types
+
+from utils import metrics
+
+logger = logging.getLogger("avvocato.session_memory")
+
+# Oggetti oltre i quali la misura di una chiave si ferma (valore approssimato per difetto)
+MAX_OBJECTS = 200_000
+
+# Tipi mai attraversati: appartengono al processo, non alla sessione
+_PROCESS_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                  types.CodeType, types.FrameType, threading.Thread)
+# Tipi che riportano già in sys.getsizeof la memoria dei propri dati
+_LEAF_MODULES = ('numpy', 'pandas', 'pyarrow')
+
+_lock = threading.Lock()
+# Ultima misura di ogni sessione di questo processo: id -> (istante, {chiave: byte})
+_sessions = {}
+
+
+def session_budget():
+    return int(float(os.environ.get("SESSION_STATE_BUDGET_MB", "32")) * 1024 * 1024)
+
+
+def process_budget():
+    return int(float(os.environ.get("SESSION_STATE_PROCESS_BUDGET_MB", "512")) * 1024 * 1024)
+
+
+def session_ttl():
+    return float(os.environ.get("SESSION_STATE_TTL", "3600"))
+
+
+def _megabytes(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def deep_size(obj, shared_types=(), seen=None):
+    """
+    Bytes reachable from obj (containers, instance attributes and slots), each
+    object counted once per seen set; instances of shared_types count zero
+    """
+    seen = set() if seen is None else seen
+    stack = [obj]
+    size = 0
+    while stack and len(seen) < MAX_OBJECTS:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _PROCESS_TYPES + tuple(shared_types)):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+
+        if isinstance(current, (str, bytes, bytearray, int, float, complex, bool, range)) or current is None:
+            continue
+        if isinstance(current, memoryview):
+            size += current.nbytes
+            continue
+        if type(current).__module__.split('.')[0] in _LEAF_MODULES:
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+            continue
+        if isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+            continue
+
+        attributes = getattr(current, '__dict__', None)
+        if isinstance(attributes, dict):
+            stack.append(attributes)
+        for cls in type(current).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if isinstance(slot, str) and slot not in ('__dict__', '__weakref__'):
+                    value = getattr(current, slot, None)
+                    if value is not None:
+                        stack.append(value)
+    return size
+
+
+def measure(state, shared_types=()):
+    """{key: bytes} for every key of a session state (an object reachable from two keys counts once)"""
+    seen = set()
+    sizes = {}
+    for key in list(state.keys()):
+        try:
+            value = state[key]
+        except KeyError:
+            continue
+        sizes[key] = deep_size(value, shared_types, seen)
+    return sizes
+
+
+def _is_active(session_id):
+    """False when the Streamlit runtime knows the session has ended"""
+    try:
+        from streamlit import runtime
+    except ImportError:
+        return True
+    if not runtime.exists():
+        return True
+    return runtime.get_instance().is_active_session(session_id)
+
+
+def _prune(now):
+    cutoff = now - session_ttl()
+    for session_id, (measured_at, _) in list(_sessions.items()):
+        if measured_at < cutoff or not _is_active(session_id):
+            del _sessions[session_id]
+
+
+def record(session_id, sizes):
+    """Store the latest measure of a session and refresh the process gauges"""
+    now = time.monotonic()
+    with _lock:
+        _sessions[session_id] = (now, dict(sizes))
+        _prune(now)
+        total = sum(sum(keys.values()) for _, keys in _sessions.values())
+        count = len(_sessions)
+    metrics.set_gauge("session_state_bytes", total)
+    metrics.set_gauge("session_state_sessions", count)
+
+
+def forget(session_id):
+    with _lock:
+        _sessions.pop(session_id, None)
+
+
+def process_usage(top=5):
+    """Totals of this process: sessions, bytes and the top largest (session, key, bytes) entries"""
+    with _lock:
+        _prune(time.monotonic())
+        entries = [(session_id, key, size)
+                   for session_id, (_, keys) in _sessions.items() for key, size in keys.items()]
+        count = len(_sessions)
+    entries.sort(key=lambda entry: entry[2], reverse=True)
+    return {
+        'sessions': count,
+        'bytes': sum(size for _, _, size in entries),
+        'largest': entries[:top],
+    }
+
+
+def _limit():
+    """Bytes this session may keep: its budget, or its share of the process budget when that is exceeded"""
+    limit = session_budget()
+    usage = process_usage(top=0)
+    if usage['bytes'] > process_budget():
+        limit = min(limit, process_budget() // max(1, usage['sessions']))
+    return limit
+
+
+def enforce(state, session_id, evictable, shared_types=()):
+    """
+    Measure and record a session state, then free its evictable keys (largest
+    first) until it fits its limit
+
+    Args:
+        state: st.session_state (o un qualsiasi mapping mutabile)
+        session_id: Identificativo della sessione
+        evictable (dict): chiave -> funzione che riceve il valore e restituisce la versione
+            leggera da conservare, oppure None per eliminare la chiave
+        shared_types (tuple): Tipi condivisi tra le sessioni, non attribuiti alla sessione
+
+    Returns:
+        dict: 'bytes' (after eviction), 'limit' and 'evicted' (keys freed)
+    """
+    sizes = measure(state, shared_types)
+    record(session_id, sizes)
+    limit = _limit()
+    evicted = []
+
+    candidates = sorted((key for key in evictable if key in sizes), key=sizes.get, reverse=True)
+    for key in candidates:
+        if sum(sizes.values()) <= limit:
+            break
+        offload = evictable[key]
+        replacement = offload(state[key]) if offload is not None else None
+        if replacement is None:
+            del state[key]
+            freed = sizes.pop(key)
+        else:
+            size = deep_size(replacement, shared_types)
+            if size >= sizes[key]:
+                # Non ancora scaricabile (per esempio un PDF in preparazione)
+                continue
+            state[key] = replacement
+            freed, sizes[key] = sizes[key] - size, size
+        evicted.append(key)
+        metrics.increment("session_state_evictions_total", key=key)
+        logger.info("Sessione %s oltre %s: liberata la chiave %s (%s)",
+                    session_id, _megabytes(limit), key, _megabytes(freed))
+
+    if evicted:
+        record(session_id, sizes)
+    total = sum(sizes.values())
+    if total > limit:
+        largest = max(sizes, key=sizes.get)
+        logger.warning("Sessione %s oltre %s (%s) senza altre chiavi da liberare; la più grande è %s (%s)",
+                       session_id, _megabytes(limit), _megabytes(total), largest, _megabytes(sizes[largest]))
+    return {'bytes': total, 'limit': limit, 'evicted': evicted}
@@ -0,0 +1,186 @@
+"""
+Impatto di un nuovo tariffario sui preventivi storici.
+
+Ogni preventivo di uno studio (anche archiviato) viene ricalcolato con il
+tariffario attuale dello studio (il suo, o quello di utils.fee_calculator) e
+con quello candidato, a blocchi e in forma
+vettoriale con numpy. Le differenze vengono aggregate per scaglione attuale,
+per servizio e per mese; gli aggregati si fondono blocco per blocco, quindi la
+memoria non dipende dal numero di preventivi.
+
+Il tariffario candidato è un file JSON:
+
+    {"tariffe_base": [280, 1250, 1950, 2360, 4450, 6050, 9030],
+     "limiti_scaglioni": [1100, 5200, 26000, 52000, 260000, 520000]}
+
+limiti_scaglioni è facoltativo (default: gli scaglioni attuali).
+"""
+import itertools
+import json
+import time
+
+import numpy as np
+
+from storage import get_storage
+from utils import archive, tenants
+from utils.fee_calculator import CPA, IVA, LIMITI_SCAGLIONI, SPESE_FORFETTARIE, TARIFFE_BASE
+
+# Chiavi degli aggregati di ogni gruppo
+FIELDS = ('quotes', 'current', 'candidate', 'delta', 'delta_min', 'delta_max', 'increased', 'decreased')
+
+
+def current_tariff(tenant=None):
+    """The tariff of a tenant, or else of utils.fee_calculator, in the format of load_tariff"""
+    if tenant is not None and tenant.tariff is not None:
+        return tenant.tariff
+    return {
+        'limiti_scaglioni': list(LIMITI_SCAGLIONI),
+        'tariffe_base': [TARIFFE_BASE[scaglione] for scaglione in sorted(TARIFFE_BASE)],
+    }
+
+
+def load_tariff(path):
+    """Read and validate a candidate tariff from a JSON file"""
+    with open(path, encoding='utf-8') as f:
+        tariff = json.load(f)
+
+    limits = [float(limit) for limit in tariff.get('limiti_scaglioni', LIMITI_SCAGLIONI)]
+    fees = [float(fee) for fee in tariff['tariffe_base']]
+    if len(fees) != len(limits) + 1:
+        raise ValueError(f"Servono {len(limits) + 1} tariffe base per {len(limits)} limiti di scaglione")
+    if any(lower >= upper for lower, upper in zip(limits, limits[1:])):
+        raise ValueError("I limiti degli scaglioni devono essere crescenti")
+    return {'limiti_scaglioni': limits, 'tariffe_base': fees}
+
+
+def brackets(values, tariff):
+    """Bracket index (0-based) of every value: the first limit the value does not exceed"""
+    return np.searchsorted(np.asarray(tariff['limiti_scaglioni'], dtype=float), values, side='left')
+
+
+def price(values, num_services, tariff):
+    """Vectorized utils.fee_calculator.calculate_fees(...)['total'] under the given tariff"""
+    base_fee = np.asarray(tariff['tariffe_base'], dtype=float)[brackets(values, tariff)]
+    # Stesso fattore di complessità di apply_complexity_factor
+    factor = np.where(num_services == 1, 1.0,
+                      np.where(num_services == 2, 1.2, 1.2 + (num_services - 2) * 0.1))
+    adjusted = base_fee * factor
+    expenses = adjusted * SPESE_FORFETTARIE
+    cpa = (adjusted + expenses) * CPA
+    iva = (adjusted + expenses + cpa) * IVA
+    return adjusted + expenses + cpa + iva
+
+
+class GroupedDeltas:
+    """Mergeable per-key aggregates (count, sums, min/max delta, increases/decreases)"""
+
+    def __init__(self):
+        self.groups = {}
+
+    def add(self, keys, current, candidate):
+        if not len(keys):
+            return
+        unique, inverse = np.unique(keys, return_inverse=True)
+        delta = candidate - current
+        size = len(unique)
+
+        counts = np.bincount(inverse, minlength=size)
+        sums = [np.bincount(inverse, weights=w, minlength=size) for w in (current, candidate, delta)]
+        minimum = np.full(size, np.inf)
+        maximum = np.full(size, -np.inf)
+        np.minimum.at(minimum, inverse, delta)
+        np.maximum.at(maximum, inverse, delta)
+        increased = np.bincount(inverse, weights=delta > 0.005, minlength=size)
+        decreased = np.bincount(inverse, weights=delta < -0.005, minlength=size)
+
+        for i, key in enumerate(unique.tolist()):
+            group = self.groups.get(key)
+            if group is None:
+                self.groups[key] = [int(counts[i]), sums[0][i], sums[1][i], sums[2][i],
+                                    minimum[i], maximum[i], int(increased[i]), int(decreased[i])]
+            else:
+                group[0] += int(counts[i])
+                group[1] += sums[0][i]
+                group[2] += sums[1][i]
+                group[3] += sums[2][i]
+                group[4] = min(group[4], minimum[i])
+                group[5] = max(group[5], maximum[i])
+                group[6] += int(increased[i])
+                group[7] += int(decreased[i])
+
+    def rows(self):
+        """One dictionary per key, sorted by key, with mean and percentage change"""
+        result = []
+        for key in sorted(self.groups):
+            group = dict(zip(FIELDS, self.groups[key]))
+            group = {name: float(value) if isinstance(value, np.floating) else value
+                     for name, value in group.items()}
+            group['key'] = key
+            group['delta_mean'] = group['delta'] / group['quotes']
+            group['delta_pct'] = group['delta'] / group['current'] * 100 if group['current'] else 0.0
+            result.append(group)
+        return result
+
+
+def _chunks(rows, chunk_size):
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def tariff_impact(candidate, chunk_size=50000, include_archive=True, tenant=None):
+    """
+    Reprice every quote of a tenant (default: the current one) under its current and the candidate tariff
+
+    Returns:
+        dict: 'total', 'by_bracket' (current bracket, 1-based), 'by_service'
+              (each quote counted once per requested service), 'by_month'
+              ('YYYY-MM'), 'quotes' and 'elapsed_seconds'
+    """
+    start = time.perf_counter()
+    tenant = tenant or tenants.current()
+    current = current_tariff(tenant)
+    storage = get_storage()
+
+    sources = [storage.iter_quote_pricing(tenant.id, chunk_size)]
+    if include_archive:
+        sources.insert(0, archive.iter_archived_quote_pricing(tenant.id, chunk_size=chunk_size))
+
+    total, by_bracket, by_service, by_month = GroupedDeltas(), GroupedDeltas(), GroupedDeltas(), GroupedDeltas()
+    for chunk in _chunks(itertools.chain(*sources), chunk_size):
+        size = len(chunk)
+        values = np.fromiter((row[0] for row in chunk), dtype=float, count=size)
+        months = np.fromiter((row[1] * 100 + row[2] for row in chunk), dtype=np.int64, count=size)
+        num_services = np.fromiter((len(row[3]) for row in chunk), dtype=np.int64, count=size)
+        service_ids = np.fromiter(itertools.chain.from_iterable(row[3] for row in chunk), dtype=np.int64,
+                                  count=int(num_services.sum()))
+
+        current_total = price(values, num_services, current)
+        candidate_total = price(values, num_services, candidate)
+
+        total.add(np.zeros(size, dtype=np.int64), current_total, candidate_total)
+        by_bracket.add(brackets(values, current) + 1, current_total, candidate_total)
+        by_month.add(months, current_total, candidate_total)
+        # Un collegamento per servizio: il preventivo conta una volta per ciascun servizio richiesto
+        by_service.add(service_ids, np.repeat(current_total, num_services),
+                       np.repeat(candidate_total, num_services))
+
+    service_names = {service['id']: service['name'] for service in storage.load_services(tenant.id)}
+    by_service_rows = by_service.rows()
+    for row in by_service_rows:
+        row['name'] = service_names.get(row['key'], f"Servizio {row['key']}")
+    by_month_rows = by_month.rows()
+    for row in by_month_rows:
+        row['key'] = f"{row['key'] // 100}-{row['key'] % 100:02d}"
+
+    totals = total.rows()
+    return {
+        'total': totals[0] if totals else None,
+        'by_bracket': by_bracket.rows(),
+        'by_service': by_service_rows,
+        'by_month': by_month_rows,
+        'quotes': totals[0]['quotes'] if totals else 0,
+        'elapsed_seconds': time.perf_counter() - start,
+    }
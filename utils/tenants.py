@@ -0,0 +1,151 @@
+"""
+Studi legali serviti dalla stessa istanza.
+
+Ogni riga di services, clients, quotes e quote_services appartiene a uno
+studio (colonna tenant_id) e ogni operazione di database.py vede solo le righe
+dello studio corrente. Lo studio corrente è una ContextVar impostata da chi
+riceve la richiesta: l'app Streamlit (nome host secondo TENANT_HOSTS,
+altrimenti DEFAULT_TENANT), l'API (studio associato alla chiave del partner,
+API_KEYS di api.py) e manage.py (--tenant). Lo studio è deciso solo dalla
+configurazione del server: l'utente non può sceglierlo con un parametro, e un
+nome host non elencato in TENANT_HOSTS vale DEFAULT_TENANT (un'istanza per
+studio non richiede altro).
+
+    from utils import tenants
+
+    with tenants.use_tenant(tenants.resolve('rossi')):
+        services = database.load_services_from_db()   # solo i servizi dello studio rossi
+
+Ogni studio può avere un tariffario proprio (tabella tariffs; senza righe vale
+quello del DM 55/2014 di utils.fee_calculator) e un'intestazione propria nei PDF:
+
+    {"intestazione": "Studio Legale Rossi", "recapiti": "Via Roma 1, Milano - 02 1234567",
+     "logo": "/percorso/logo.png", "logo_width_cm": 4}
+
+L'elenco degli studi passa dalla cache condivisa (database.load_tenants).
+
+    DEFAULT_TENANT    slug dello studio delle richieste che non ne indicano uno (default 'default')
+    TENANT_HOSTS      nomi host dell'app associati agli studi, "host=studio" separati da virgole
+                      (per esempio "rossi.preventivi.example.it=rossi"); default nessuno
+"""
+import contextlib
+import contextvars
+import os
+
+from storage.base import DEFAULT_TENANT_ID, DEFAULT_TENANT_SLUG
+
+_current = contextvars.ContextVar("avvocato_tenant", default=None)
+
+
+class UnknownTenant(LookupError):
+    pass
+
+
+class Tenant:
+    """One firm: id, slug (used in URLs and host names), name, PDF branding and tariff (None: default)"""
+
+    __slots__ = ('id', 'slug', 'name', 'branding', 'tariff')
+
+    def __init__(self, id, slug, name, branding=None, tariff=None):
+        self.id = id
+        self.slug = slug
+        self.name = name
+        self.branding = branding or {}
+        self.tariff = tariff
+
+    def __eq__(self, other):
+        if not isinstance(other, Tenant):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return f"Tenant(id={self.id!r}, slug={self.slug!r})"
+
+
+def default_slug():
+    return os.environ.get("DEFAULT_TENANT", DEFAULT_TENANT_SLUG)
+
+
+def host_map():
+    """{host name: tenant slug} from TENANT_HOSTS (host names without port, lower case)"""
+    hosts = {}
+    for entry in os.environ.get("TENANT_HOSTS", "").split(','):
+        host, separator, slug = entry.partition('=')
+        if separator and host.strip() and slug.strip():
+            hosts[host.strip().lower()] = slug.strip().lower()
+    return hosts
+
+
+def all_tenants():
+    """Every tenant, from the shared cache"""
+    import database
+
+    return [Tenant(**row) for row in database.load_tenants()]
+
+
+def find(slug):
+    """Tenant with the given slug, or None"""
+    slug = str(slug).strip().lower()
+    return next((tenant for tenant in all_tenants() if tenant.slug == slug), None)
+
+
+def get_tenant(tenant_id):
+    """Tenant with the given id; UnknownTenant if it does not exist"""
+    tenant = next((tenant for tenant in all_tenants() if tenant.id == tenant_id), None)
+    if tenant is None:
+        raise UnknownTenant(f"Studio {tenant_id} inesistente")
+    return tenant
+
+
+def resolve(slug=None, host=None):
+    """
+    Tenant of a request: the slug chosen by the server (UnknownTenant if it does
+    not exist), else the one TENANT_HOSTS binds to the host name, else DEFAULT_TENANT
+    """
+    if not slug and host:
+        slug = host_map().get(host.split(':')[0].strip().lower())
+    if slug:
+        tenant = find(slug)
+        if tenant is None:
+            raise UnknownTenant(f"Studio '{slug}' inesistente")
+        return tenant
+    tenant = find(default_slug())
+    if tenant is None:
+        raise UnknownTenant(f"Studio predefinito '{default_slug()}' inesistente (DEFAULT_TENANT)")
+    return tenant
+
+
+def activate(tenant):
+    """Make tenant the current one for this context (thread, task or Streamlit rerun)"""
+    return _current.set(tenant)
+
+
+@contextlib.contextmanager
+def use_tenant(tenant):
+    """Make tenant the current one inside the block"""
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+
+def active():
+    """The tenant activated in this context, or None"""
+    return _current.get()
+
+
+def current():
+    """The current tenant (DEFAULT_TENANT when none was activated)"""
+    tenant = _current.get()
+    return tenant if tenant is not None else resolve()
+
+
+def current_id():
+    """Id of the current tenant; without an active tenant or DEFAULT_TENANT, no lookup is needed"""
+    tenant = _current.get()
+    if tenant is not None:
+        return tenant.id
+    if default_slug() == DEFAULT_TENANT_SLUG:
+        return DEFAULT_TENANT_ID
+    return resolve().id
@@ -0,0 +1,206 @@
+"""
+Spool su disco dei file caricati dall'interfaccia.
+
+I file caricati vengono copiati a blocchi in una cartella per sessione sotto
+UPLOAD_SPOOL_DIR; nello stato della sessione resta solo un UploadHandle
+(percorso, nome, tipo, dimensione) e il contenuto viene riletto con mmap solo
+quando serve. Configurazione tramite variabili d'ambiente:
+
+    UPLOAD_SPOOL_DIR            cartella dello spool (default <tmp>/avvocato-uploads)
+    UPLOAD_SESSION_QUOTA_MB     spazio massimo per sessione (default 50)
+    UPLOAD_GLOBAL_QUOTA_MB      spazio massimo per processo, tutte le sessioni (default 1024)
+    UPLOAD_SPOOL_TTL            secondi dopo i quali una cartella orfana viene eliminata (default 86400)
+
+La cartella di una sessione viene eliminata quando l'oggetto SessionSpool
+conservato nello stato della sessione viene raccolto (fine della sessione) o
+all'uscita del processo; quelle rimaste da processi terminati male vengono
+eliminate dopo UPLOAD_SPOOL_TTL secondi.
+"""
+import base64
+import contextlib
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+logger = logging.getLogger("avvocato.upload_spool")
+
+CHUNK_SIZE = 1 << 20
+
+_lock = threading.Lock()
+# Byte occupati da ogni sessione attiva di questo processo (cartella -> byte)
+_usage = {}
+
+
+class QuotaExceeded(Exception):
+    """The upload does not fit in the session or global quota"""
+
+
+def spool_dir():
+    return os.environ.get("UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "avvocato-uploads"))
+
+
+def session_quota():
+    return int(float(os.environ.get("UPLOAD_SESSION_QUOTA_MB", "50")) * 1024 * 1024)
+
+
+def global_quota():
+    return int(float(os.environ.get("UPLOAD_GLOBAL_QUOTA_MB", "1024")) * 1024 * 1024)
+
+
+def global_usage():
+    """Bytes spooled by every active session of this process"""
+    with _lock:
+        return sum(_usage.values())
+
+
+def _megabytes(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+class UploadHandle:
+    """Reference to a spooled upload: the only thing kept in session state"""
+
+    __slots__ = ('path', 'filename', 'content_type', 'size')
+
+    def __init__(self, path, filename, content_type, size):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+
+    @contextlib.contextmanager
+    def mapped(self):
+        """Read-only memory map of the content (b'' for empty files, which cannot be mapped)"""
+        if not self.size:
+            yield b''
+            return
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+    def base64(self):
+        """Content encoded in base64, as stored in services.file_content"""
+        with self.mapped() as data:
+            return base64.b64encode(data).decode()
+
+
+def _remove_session_dir(directory):
+    with _lock:
+        _usage.pop(directory, None)
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def sweep_stale(max_age=None):
+    """Remove session directories left behind by dead processes (untouched for max_age seconds)"""
+    if max_age is None:
+        max_age = float(os.environ.get("UPLOAD_SPOOL_TTL", "86400"))
+    root = spool_dir()
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return removed
+
+    with _lock:
+        active = set(_usage)
+    for entry in entries:
+        if entry.path in active or not entry.is_dir(follow_symlinks=False):
+            continue
+        try:
+            if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        logger.info("Eliminate %d cartelle di upload orfane da %s", removed, root)
+    return removed
+
+
+class SessionSpool:
+    """Spool directory of one session; the directory is removed when this object is collected"""
+
+    def __init__(self):
+        root = spool_dir()
+        os.makedirs(root, exist_ok=True)
+        sweep_stale()
+        self.directory = os.path.join(root, uuid.uuid4().hex)
+        os.makedirs(self.directory)
+        with _lock:
+            _usage[self.directory] = 0
+        self._finalizer = weakref.finalize(self, _remove_session_dir, self.directory)
+
+    @property
+    def used(self):
+        with _lock:
+            return _usage.get(self.directory, 0)
+
+    def _reserve(self, size):
+        with _lock:
+            used = _usage[self.directory]
+            if used + size > session_quota():
+                raise QuotaExceeded(
+                    f"Spazio per i documenti della sessione esaurito "
+                    f"({_megabytes(used)} usati su {_megabytes(session_quota())})")
+            if sum(_usage.values()) + size > global_quota():
+                raise QuotaExceeded("Spazio per i documenti caricati esaurito, riprovare più tardi")
+            _usage[self.directory] = used + size
+
+    def _release(self, size):
+        with _lock:
+            if self.directory in _usage:
+                _usage[self.directory] = max(0, _usage[self.directory] - size)
+
+    def add(self, file):
+        """
+        Copy an uploaded file (Streamlit UploadedFile or any binary file object
+        with a name) to the spool in chunks
+
+        Returns:
+            UploadHandle: Handle to keep in session state
+        """
+        path = os.path.join(self.directory, uuid.uuid4().hex)
+        expected = getattr(file, 'size', None)
+        reserved = expected or 0
+        if reserved:
+            self._reserve(reserved)
+
+        written = 0
+        try:
+            file.seek(0)
+            with open(path, 'wb') as out:
+                while True:
+                    chunk = file.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    # Dimensione non dichiarata (o sbagliata): si riserva man mano
+                    if written > reserved:
+                        self._reserve(written - reserved)
+                        reserved = written
+                    out.write(chunk)
+        except BaseException:
+            self._release(reserved)
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            raise
+        self._release(reserved - written)
+
+        return UploadHandle(path, os.path.basename(getattr(file, 'name', '') or 'documento'),
+                            getattr(file, 'type', None), written)
+
+    def discard(self, handle):
+        """Delete a spooled upload and give its bytes back to the quotas"""
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(handle.path)
+            self._release(handle.size)
+
+    def close(self):
+        """Delete every upload of the session now"""
+        self._finalizer()